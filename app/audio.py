@@ -0,0 +1,170 @@
+import io
+import os
+import tempfile
+from typing import List, Optional
+
+# Funciones de audio que se ejecutan en el pool de procesos. Este módulo no importa
+# nada de la aplicación para que los procesos hijos arranquen rápido.
+
+# Frecuencia de muestreo a la que se convierte el audio para Whisper
+WHISPER_SAMPLE_RATE = 16000
+
+# Duración de cada ventana del detector de silencios, en segundos
+VAD_FRAME_SECONDS = 0.03
+
+# Formatos que Whisper acepta tal cual; el resto se convierte a WAV
+WHISPER_FORMATS = {"ogg", "wav", "flac", "mp3", "m4a", "webm"}
+
+# Formatos que libsndfile decodifica desde memoria; el resto pasa por audioread
+_SNDFILE_FORMATS = {"ogg", "wav", "flac", "mp3"}
+
+# Marcas del contenedor ISO (cabecera ftyp) que son 3GP/3G2 y no M4A
+_3GP_BRANDS = (b"3gp", b"3gg", b"3g2")
+
+
+def sniff_audio_format(data: bytes) -> Optional[str]:
+  """
+    Detecta el formato del audio por su cabecera.
+
+    Args:
+        data (bytes): Contenido del archivo de audio.
+
+    Returns:
+        Optional[str]: La extensión (ogg, wav, mp3, flac, m4a, webm, 3gp, amr) o None si no se reconoce.
+    """
+  if data[:4] == b"OggS":
+    return "ogg"
+  if data[:4] == b"RIFF" and data[8:12] == b"WAVE":
+    return "wav"
+  if data[:4] == b"fLaC":
+    return "flac"
+  if data[:3] == b"ID3" or (len(data) > 1 and data[0] == 0xFF
+                            and data[1] & 0xE0 == 0xE0):
+    return "mp3"
+  if data[4:8] == b"ftyp":
+    # Las notas de voz de muchos móviles son 3GP (con AMR dentro), que Whisper no acepta
+    if data[8:11] in _3GP_BRANDS:
+      return "3gp"
+    return "m4a"
+  if data[:5] == b"#!AMR":
+    return "amr"
+  if data[:4] == b"\x1a\x45\xdf\xa3":
+    return "webm"
+  return None
+
+
+def transcode_to_wav(data: bytes) -> bytes:
+  """
+    Decodifica el audio y lo recodifica como WAV mono de 16 bits a 16 kHz.
+
+    Los formatos de libsndfile se decodifican en memoria; el resto (M4A, 3GP, AMR)
+    se escribe antes en un archivo temporal.
+
+    Args:
+        data (bytes): Contenido del archivo de audio original.
+
+    Returns:
+        bytes: El archivo WAV resultante.
+    """
+  return _encode_wav(_decode(data))
+
+
+def _decode(data: bytes):
+  import librosa
+
+  audio_format = sniff_audio_format(data)
+  if audio_format in _SNDFILE_FORMATS:
+    samples, _ = librosa.load(io.BytesIO(data),
+                              sr=WHISPER_SAMPLE_RATE,
+                              mono=True)
+    return samples
+
+  # Para el resto (M4A, 3GP, AMR o desconocido) librosa recurre a audioread, que
+  # necesita una ruta de archivo
+  suffix = "." + (audio_format or "bin")
+  with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as audio_file:
+    audio_file.write(data)
+  try:
+    samples, _ = librosa.load(audio_file.name, sr=WHISPER_SAMPLE_RATE, mono=True)
+  finally:
+    os.unlink(audio_file.name)
+  return samples
+
+
+def _encode_wav(samples) -> bytes:
+  import soundfile as sf
+
+  buffer = io.BytesIO()
+  sf.write(buffer, samples, WHISPER_SAMPLE_RATE, format="WAV", subtype="PCM_16")
+  return buffer.getvalue()
+
+
+def find_split_points(samples, segment_seconds: float) -> List[int]:
+  """
+    Busca puntos de corte en silencios con un detector de actividad de voz por energía.
+
+    Cada segmento dura como mucho segment_seconds; dentro de la última mitad de cada
+    ventana se corta en el centro del silencio más largo o, si no hay, en el tramo
+    de menor energía.
+
+    Args:
+        samples: Muestras mono a WHISPER_SAMPLE_RATE.
+        segment_seconds (float): Duración máxima de cada segmento.
+
+    Returns:
+        List[int]: Índices de muestra donde cortar, en orden.
+    """
+  import numpy as np
+
+  frame = int(VAD_FRAME_SECONDS * WHISPER_SAMPLE_RATE)
+  frames = len(samples) // frame
+  if frames == 0:
+    return []
+  energy = np.sqrt(
+    np.mean(samples[:frames * frame].reshape(frames, frame)**2, axis=1))
+  # Umbral relativo al ruido de fondo: un múltiplo del percentil 10 de la energía
+  threshold = max(np.percentile(energy, 10) * 2.0, 1e-4)
+  silent = energy < threshold
+
+  frames_per_segment = max(2, int(segment_seconds / VAD_FRAME_SECONDS))
+  cuts = []
+  start = 0
+  while frames - start > frames_per_segment:
+    low = start + frames_per_segment // 2
+    high = start + frames_per_segment
+    best_cut, best_length = None, 0
+    run_start = None
+    for i in range(low, high + 1):
+      if i < high and silent[i]:
+        if run_start is None:
+          run_start = i
+      elif run_start is not None:
+        if i - run_start > best_length:
+          best_cut, best_length = (run_start + i) // 2, i - run_start
+        run_start = None
+    if best_cut is None:
+      best_cut = low + int(np.argmin(energy[low:high]))
+    cuts.append(best_cut * frame)
+    start = best_cut
+  return cuts
+
+
+def split_audio(data: bytes, segment_seconds: float) -> Optional[List[bytes]]:
+  """
+    Decodifica el audio y lo parte en silencios en segmentos WAV de como mucho segment_seconds.
+
+    Args:
+        data (bytes): Contenido del archivo de audio original.
+        segment_seconds (float): Duración máxima de cada segmento.
+
+    Returns:
+        Optional[List[bytes]]: Los segmentos en orden, o None si el audio es tan corto que no vale la pena partirlo.
+    """
+  samples = _decode(data)
+  if len(samples) <= segment_seconds * 1.5 * WHISPER_SAMPLE_RATE:
+    return None
+  bounds = [0] + find_split_points(samples, segment_seconds) + [len(samples)]
+  return [
+    _encode_wav(samples[start:end]) for start, end in zip(bounds, bounds[1:])
+    if end > start
+  ]
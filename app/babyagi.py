@@ -1,14 +1,24 @@
+import asyncio
+import hashlib
 import os
-import openai
-import pinecone
 import time
 import sys
+import traceback
+import uuid
 from collections import deque
-from typing import Dict, List
+from typing import Deque, Dict, List, Optional
+import numpy as np
 from dotenv import load_dotenv
-from twilio.rest import Client
-from twilio.base.exceptions import TwilioException
-from config import BABYAGI, ACCOUNT_SID, AUTH_TOKEN, TWILIO_WHATSAPP_NUMBER, FACEBOOK_PAGE_ID
+from config import (BABYAGI, BABYAGI_MAX_SESSIONS,
+                    BABYAGI_MAX_SESSIONS_PER_CHAT, BABYAGI_MAX_TASKS,
+                    BABYAGI_RESULT_TOKENS, VECTOR_BACKEND, PINECONE_INDEX)
+from embeddings import embedding_service
+from models import async_openai
+from prompt_builder import fit_items, truncate_tokens
+from metrics import count_tokens, stage_timer
+from telegram_sender import telegram_dispatcher
+from twilio_sender import twilio_sender, get_twilio_sender_number
+from vector_store import vector_store
 
 # Verifica si el sistema es BABYAGI (un sistema de IA)
 if BABYAGI:
@@ -17,107 +27,94 @@ if BABYAGI:
 
   # Establece las claves de API y otras variables de entorno
   OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
-  PINECONE_API_KEY = os.getenv("PINECONE_API_KEY", "")
-  PINECONE_ENVIRONMENT = os.getenv("PINECONE_ENVIRONMENT", "us-east1-gcp")
-  YOUR_TABLE_NAME = os.getenv("TABLE_NAME", "")
   YOUR_FIRST_TASK = os.getenv("FIRST_TASK", "")
   USE_GPT4 = os.getenv("USE_GPT4", True)
 
   # Asegura que las variables requeridas estén configuradas
   if not OPENAI_API_KEY:
     print("OPENAI_API_KEY environment variable is missing from .env")
-  if not YOUR_TABLE_NAME:
+  if VECTOR_BACKEND == "pinecone" and not PINECONE_INDEX:
     print("TABLE_NAME environment variable is missing from .env")
   if not YOUR_FIRST_TASK:
     print("FIRST_TASK environment variable is missing from .env")
 
-  # Configura OpenAI y Pinecone
-  openai.api_key = OPENAI_API_KEY
-  if PINECONE_API_KEY:
-    pinecone.init(api_key=PINECONE_API_KEY, environment=PINECONE_ENVIRONMENT)
-
-  # Crea un índice Pinecone si se establece PINECONE_API_KEY
-  if PINECONE_API_KEY and YOUR_TABLE_NAME not in pinecone.list_indexes():
-    pinecone.create_index(YOUR_TABLE_NAME,
-                          dimension=1536,
-                          metric="cosine",
-                          pod_type="p1")
-
-  # Conéctate al índice si se establece PINECONE_API_KEY
-  if PINECONE_API_KEY:
-    index = pinecone.Index(YOUR_TABLE_NAME)
-
-  # Lista de tareas
-  task_list = deque([])
-
 
 # Funciones
-def add_task(task: Dict):
-  # Agrega una tarea a la lista de tareas
-  task_list.append(task)
+async def get_ada_embedding(text: str) -> np.ndarray:
+  # Obtiene la incrustación de texto de OpenAI utilizando el modelo "text-embedding-ada-002"
+  return await embedding_service.embed(text)
 
 
-def get_ada_embedding(text: str) -> List[float]:
-  # Obtiene la incrustación de texto de OpenAI utilizando el modelo "text-embedding-ada-002"
-  text = text.replace("\n", " ")
-  return openai.Embedding.create(
-    input=[text], model="text-embedding-ada-002")["data"][0]["embedding"]
+def _count_usage(model: str, response):
+  # La API informa de los tokens usados en cada respuesta
+  usage = response.get("usage")
+  if usage:
+    count_tokens(model, usage.get("prompt_tokens", 0),
+                 usage.get("completion_tokens", 0))
 
 
-def openai_call(prompt: str,
-                use_gpt4: bool = False,
-                temperature: float = 0.5,
-                max_tokens: int = 100):
+async def openai_call(prompt: str,
+                      use_gpt4: bool = False,
+                      temperature: float = 0.5,
+                      max_tokens: int = 100):
   # Llama al modelo de chat de OpenAI (ya sea GPT-3 o GPT-4)
   if not use_gpt4:
     # Call GPT-3 DaVinci model
-    response = openai.Completion.create(engine='babbage-002',
-                                        prompt=prompt,
-                                        temperature=temperature,
-                                        max_tokens=max_tokens,
-                                        top_p=1,
-                                        frequency_penalty=0,
-                                        presence_penalty=0)
+    async with async_openai() as openai:
+      with stage_timer("babyagi_llm", model="babbage-002"):
+        response = await openai.Completion.acreate(engine='babbage-002',
+                                                   prompt=prompt,
+                                                   temperature=temperature,
+                                                   max_tokens=max_tokens,
+                                                   top_p=1,
+                                                   frequency_penalty=0,
+                                                   presence_penalty=0)
+    _count_usage("babbage-002", response)
     return response.choices[0].text.strip()
   else:
     # Llama al modelo de chat GPT-4
     messages = [{"role": "user", "content": prompt}]
-    response = openai.ChatCompletion.create(
-      model="gpt-4",
-      messages=messages,
-      temperature=temperature,
-      max_tokens=max_tokens,
-      n=1,
-      stop=None,
-    )
+    async with async_openai() as openai:
+      with stage_timer("babyagi_llm", model="gpt-4"):
+        response = await openai.ChatCompletion.acreate(
+          model="gpt-4",
+          messages=messages,
+          temperature=temperature,
+          max_tokens=max_tokens,
+          n=1,
+          stop=None,
+        )
+    _count_usage("gpt-4", response)
     return response.choices[0].message.content.strip()
 
 
-def task_creation_agent(objective: str,
-                        result: Dict,
-                        task_description: str,
-                        task_list: List[str],
-                        gpt_version: str = 'gpt-3'):
-  # Agente de creación de tareas
+async def task_creation_agent(objective: str,
+                              result: Dict,
+                              task_description: str,
+                              task_list: List[str],
+                              gpt_version: str = 'gpt-3'):
+  # Agente de creación de tareas; el resultado y la lista de tareas se recortan a
+  # BABYAGI_RESULT_TOKENS (openai_call usa gpt-4 cuando recibe gpt_version)
+  result = truncate_tokens(str(result["data"]), BABYAGI_RESULT_TOKENS, "gpt-4")
+  task_list = fit_items(task_list, BABYAGI_RESULT_TOKENS, "gpt-4")
   prompt = f"Eres una IA de creación de tareas que utiliza el resultado de un agente de ejecución para crear nuevas tareas con el siguiente objetivo:{objective}, la última tarea completada tiene el resultado: {result}. Este resultado se basó en la descripción de la tarea:{task_description}.Estas son tareas incompletas: {', '.join(task_list)}. Basado en el resultado, crea nuevas tareas que deben ser completadas por el sistema de IA y que no se superpongan con las tareas incompletas. Devuelve las tareas como una matriz."
-  response = openai_call(prompt, gpt_version)
+  response = await openai_call(prompt, gpt_version)
   new_tasks = response.split('\n')
   return [{"task_name": task_name} for task_name in new_tasks]
 
 
-def prioritization_agent(this_task_id: int,
-                         objective,
-                         gpt_version: str = 'gpt-3'):
+async def prioritization_agent(this_task_id: int,
+                               objective,
+                               task_names: List[str],
+                               gpt_version: str = 'gpt-3') -> Deque[Dict]:
   # Agente de priorización de tareas
-  global task_list
-  task_names = [t["task_name"] for t in task_list]
   next_task_id = int(this_task_id) + 1
   prompt = f"""Eres un IA de priorización de tareas encargado de limpiar el formato y repriorizar las siguientes tareas: {task_names}.Considera el objetivo final de tu equipo: {objective}.No elimines ninguna tarea. Devuelve el resultado como una lista numerada, por ejemplo:
     #. Primera tarea
     #. Segunda tarea
     #. Tercera tarea
     nComienza la lista de tareas con el número {next_task_id}."""
-  response = openai_call(prompt, gpt_version)
+  response = await openai_call(prompt, gpt_version)
   new_tasks = response.split('\n')
   task_list = deque()
   for task_string in new_tasks:
@@ -126,134 +123,297 @@ def prioritization_agent(this_task_id: int,
       task_id = task_parts[0].strip()
       task_name = task_parts[1].strip()
       task_list.append({"task_id": task_id, "task_name": task_name})
+  return task_list
 
 
-def execution_agent(objective: str,
-                    task: str,
-                    gpt_version: str = 'gpt-3') -> str:
-  context = context_agent(index=YOUR_TABLE_NAME, query=objective, n=5)
+async def execution_agent(objective: str,
+                          task: str,
+                          namespace: str,
+                          gpt_version: str = 'gpt-3') -> str:
+  context = await context_agent(query=objective, n=5, namespace=namespace)
   prompt = f"You are an AI who performs one task based on the following objective: {objective}.\nTake into account these previously completed tasks: {context}\nYour task: {task}\nResponse:"
-  return openai_call(prompt, USE_GPT4, 0.7, 2000)
+  return await openai_call(prompt, USE_GPT4, 0.7, 2000)
 
 
-def context_agent(query: str, index: str, n: int):
-  # Agente de contexto
-  query_embedding = get_ada_embedding(query)
-  index = pinecone.Index(index_name=index)
-  results = index.query(query_embedding, top_k=n, include_metadata=True)
-  sorted_results = sorted(results.matches, key=lambda x: x.score, reverse=True)
-  return [(str(item.metadata['task'])) for item in sorted_results]
+async def context_agent(query: str, n: int, namespace: str):
+  # Agente de contexto; solo consulta los resultados de la propia sesión
+  query_embedding = await get_ada_embedding(query)
+  results = await vector_store.query(namespace, query_embedding, top_k=n)
+  return [(str(item["metadata"]['task'])) for item in results]
 
 
-async def send_message(chat_id: str,
-                       message: str,
-                       platform: str,
-                       client=None,
-                       base_url=None):
+async def send_message(chat_id: str, message: str, platform: str):
   if platform == 'telegram':
-    await client.get(f"{base_url}/sendMessage?chat_id={chat_id}&text={message}"
-                     )
+    await telegram_dispatcher.send_message(chat_id, message)
   elif platform == 'twilio':
     await send_twilio_message(chat_id, message)
 
 
-async def process_task(objective: str,
-                       chat_id: str,
-                       platform='telegram',
-                       client=None,
-                       base_url=None):
-  first_task = {"task_id": 1, "task_name": YOUR_FIRST_TASK}
-
-  add_task(first_task)
-
-  task_id_counter = 1
-  while True:
-    if task_list:
-      # Imprime la lista de tareas
-      print("\033[95m\033[1m" + "\n*****TASK LIST*****\n" + "\033[0m\033[0m")
-      temp = ""
-      for t in task_list:
-        tsk = str(t['task_id']) + ": " + t['task_name']
-        print(tsk)
-        temp = temp + tsk + "\n"
-
-      await send_message(chat_id, temp, platform, client, base_url)
-
-      # Paso 1: Extrae la primera tarea
-      task = task_list.popleft()
-      print("\033[92m\033[1m" + "\n*****NEXT TASK*****\n" + "\033[0m\033[0m")
-      next_tsk = str(task['task_id']) + ": " + task['task_name']
-      print(next_tsk)
-
-      await send_message(chat_id, next_tsk, platform, client, base_url)
-
-      # Envía la tarea a la función de ejecución para completarla según el contexto
-      result = execution_agent(objective, task["task_name"])
-      this_task_id = int(task["task_id"])
-      print("\033[93m\033[1m" + "\n*****TASK RESULT*****\n" + "\033[0m\033[0m")
-      print(result)
-
-      await send_message(chat_id, result, platform, client, base_url)
-
-      # Paso 2: Enriquece el resultado y almacénalo en Pinecone
-      # Aquí es donde debes enriquecer el resultado si es necesario
-      enriched_result = {'data': result}
-      result_id = f"result_{task['task_id']}"
-      # Extrae el resultado real del diccionario
-      vector = enriched_result['data']
-      index.upsert([(result_id, get_ada_embedding(vector), {
-        "task": task['task_name'],
-        "result": result
-      })])
-
-    # Paso 3: Crea nuevas tareas y reprioriza la lista de tareas
-    if task_id_counter < 6:
-      print(f"tt: {task_id_counter}")
-      new_tasks = task_creation_agent(objective, enriched_result,
-                                      task["task_name"],
-                                      [t["task_name"] for t in task_list])
-
-      for new_task in new_tasks:
-        task_id_counter += 1
-        new_task.update({"task_id": task_id_counter})
-        add_task(new_task)
-      prioritization_agent(this_task_id, objective)
-    if len(task_list) < 1:
+class BabyAGISession:
+  """
+    Una ejecución de BabyAGI para un objetivo, con su propia lista de tareas y su memoria.
+
+    Los resultados se guardan en la memoria vectorial bajo un espacio de nombres por chat
+    y objetivo: las sesiones de objetivos distintos no mezclan su contexto, y repetir un
+    objetivo en el mismo chat reutiliza los resultados guardados en ejecuciones anteriores.
+
+    Args:
+        objective (str): Objetivo que persigue el agente.
+        chat_id (str): Chat al que se envían los avances.
+        platform (str): "telegram" o "twilio".
+        max_tasks (int): Tareas que la sesión puede crear como máximo.
+    """
+
+  def __init__(self, objective: str, chat_id: str, platform: str,
+               max_tasks: int):
+    self.objective = objective
+    self.chat_id = chat_id
+    self.platform = platform
+    self.max_tasks = max_tasks
+    self.session_id = uuid.uuid4().hex
+    objective_hash = hashlib.sha256(objective.encode("utf-8")).hexdigest()
+    self.namespace = f"{chat_id}-{objective_hash[:12]}"
+    self.task_list: Deque[Dict] = deque()
+    self.task_id_counter = 1
+    self.completed_tasks = 0
+    self.started_at = time.monotonic()
+    self.counters: Dict[str, float] = {
+      "iterations": 0,
+      "iteration_seconds_total": 0.0,
+      "speculative_kept": 0,
+      "speculative_discarded": 0,
+    }
+    # Avisos encolados al chat que aún no se han confirmado
+    self._sends: List[asyncio.Future] = []
+
+  def add_task(self, task: Dict):
+    # Agrega una tarea a la lista de tareas de la sesión
+    self.task_list.append(task)
+
+  def _notify(self, message: str):
+    # Envía el aviso sin esperar; los envíos de un mismo chat salen en orden
+    self._sends.append(
+      asyncio.ensure_future(send_message(self.chat_id, message,
+                                         self.platform)))
+
+  async def _store_result(self, task: Dict, result: str):
+    # Paso 2: Enriquece el resultado y almacénalo en la memoria vectorial
+    # Aquí es donde debes enriquecer el resultado si es necesario
+    enriched_result = {'data': result}
+    # El id lleva la sesión para no pisar los resultados de ejecuciones anteriores del objetivo
+    result_id = f"result_{self.session_id[:12]}_{task['task_id']}"
+    # Extrae el resultado real del diccionario
+    vector = await get_ada_embedding(enriched_result['data'])
+    await vector_store.upsert(self.namespace, [(result_id, vector, {
+      "task": task['task_name'],
+      "result": result
+    })])
+
+  async def _execute(self, task_name: str,
+                     store: Optional[asyncio.Future]) -> str:
+    # El contexto de la tarea debe incluir el resultado anterior, así que se espera a que esté guardado
+    if store is not None:
+      await asyncio.shield(store)
+    return await execution_agent(self.objective, task_name, self.namespace)
+
+  async def run(self):
+    objective = self.objective
+    self.add_task({"task_id": 1, "task_name": YOUR_FIRST_TASK})
+    # Guardado del último resultado y ejecución adelantada de la siguiente tarea, si las hay
+    store: Optional[asyncio.Future] = None
+    execution: Optional[asyncio.Future] = None
+
+    try:
+      while self.task_list:
+        iteration_started = time.monotonic()
+        # Imprime la lista de tareas
+        print("\033[95m\033[1m" + "\n*****TASK LIST*****\n" + "\033[0m\033[0m")
+        temp = ""
+        for t in self.task_list:
+          tsk = str(t['task_id']) + ": " + t['task_name']
+          print(tsk)
+          temp = temp + tsk + "\n"
+
+        self._notify(temp)
+
+        # Paso 1: Extrae la primera tarea
+        task = self.task_list.popleft()
+        print("\033[92m\033[1m" + "\n*****NEXT TASK*****\n" + "\033[0m\033[0m")
+        next_tsk = str(task['task_id']) + ": " + task['task_name']
+        print(next_tsk)
+
+        self._notify(next_tsk)
+
+        # Envía la tarea a la función de ejecución para completarla según el contexto
+        if execution is None:
+          execution = asyncio.ensure_future(
+            self._execute(task["task_name"], store))
+        result = await execution
+        execution = None
+        this_task_id = int(task["task_id"])
+        self.completed_tasks += 1
+        print("\033[93m\033[1m" + "\n*****TASK RESULT*****\n" + "\033[0m\033[0m")
+        print(result)
+
+        self._notify(result)
+
+        # El resultado se guarda mientras se crean las tareas nuevas
+        enriched_result = {'data': result}
+        store = asyncio.ensure_future(self._store_result(task, result))
+
+        # Paso 3: Crea nuevas tareas y reprioriza la lista de tareas
+        if self.task_id_counter < self.max_tasks:
+          print(f"tt: {self.task_id_counter}")
+          new_tasks = await task_creation_agent(
+            objective, enriched_result, task["task_name"],
+            [t["task_name"] for t in self.task_list])
+
+          for new_task in new_tasks:
+            self.task_id_counter += 1
+            new_task.update({"task_id": self.task_id_counter})
+            self.add_task(new_task)
+
+          prioritization = asyncio.ensure_future(
+            prioritization_agent(this_task_id, objective,
+                                 [t["task_name"] for t in self.task_list]))
+          if len(self.task_list) == 1:
+            # Con una sola tarea pendiente el orden no puede cambiar: se ejecuta mientras se prioriza
+            execution = asyncio.ensure_future(
+              self._execute(self.task_list[0]["task_name"], store))
+          self.task_list = await prioritization
+          if execution is not None:
+            if len(self.task_list) == 1:
+              self.counters["speculative_kept"] += 1
+            else:
+              execution.cancel()
+              execution = None
+              self.counters["speculative_discarded"] += 1
+
+        self.counters["iterations"] += 1
+        self.counters["iteration_seconds_total"] += (time.monotonic() -
+                                                     iteration_started)
+
+      if store is not None:
+        await store
       print("Tareas completadas")
-      await send_message(chat_id, "\n\nTareas completadas", platform, client,
-                         base_url)
-      break
+      self._notify("\n\nTareas completadas")
+      await asyncio.gather(*self._sends)
+    finally:
+      for pending in (execution, store):
+        if pending is not None and not pending.done():
+          pending.cancel()
+
+
+class BabyAGISessionManager:
+  """
+    Ejecuta varias sesiones de BabyAGI a la vez con límites global y por chat.
+
+    Las sesiones que superan el límite global esperan su turno; un chat que ya
+    tiene el máximo de sesiones en curso no puede empezar otra.
+
+    Args:
+        max_sessions (int): Sesiones en ejecución a la vez en todo el proceso.
+        max_per_chat (int): Sesiones en curso (en ejecución o esperando) por chat.
+        max_tasks (int): Tareas que cada sesión puede crear como máximo.
+    """
+
+  def __init__(self, max_sessions: int, max_per_chat: int, max_tasks: int):
+    self.max_sessions = max_sessions
+    self.max_per_chat = max_per_chat
+    self.max_tasks = max_tasks
+    self._slots = asyncio.Semaphore(max_sessions)
+    self._sessions: Dict[str, BabyAGISession] = {}
+    self._tasks: Dict[str, asyncio.Task] = {}
+    self.counters: Dict[str, float] = {
+      "started": 0,
+      "completed": 0,
+      "failed": 0,
+      "rejected": 0,
+      "iterations": 0,
+      "iteration_seconds_total": 0.0,
+      "speculative_kept": 0,
+      "speculative_discarded": 0,
+    }
+
+  def sessions_for(self, chat_id: str) -> List[BabyAGISession]:
+    return [s for s in self._sessions.values() if s.chat_id == chat_id]
+
+  async def run(self, objective: str, chat_id: str,
+                platform: str) -> Optional[BabyAGISession]:
+    """
+      Ejecuta una sesión nueva para el objetivo y espera a que termine.
+
+      Returns:
+          Optional[BabyAGISession]: La sesión terminada, o None si el chat ya tenía el máximo de sesiones en curso.
+      """
+    if len(self.sessions_for(chat_id)) >= self.max_per_chat:
+      self.counters["rejected"] += 1
+      return None
+
+    session = BabyAGISession(objective, chat_id, platform, self.max_tasks)
+    self._sessions[session.session_id] = session
+    try:
+      async with self._slots:
+        self.counters["started"] += 1
+        self._tasks[session.session_id] = asyncio.current_task()
+        await session.run()
+      self.counters["completed"] += 1
+      return session
+    except asyncio.CancelledError:
+      raise
+    except Exception:
+      self.counters["failed"] += 1
+      traceback.print_exc()
+      await send_message(chat_id, "La tarea se interrumpió por un error.",
+                         platform)
+      return session
+    finally:
+      for name, value in session.counters.items():
+        self.counters[name] += value
+      self._sessions.pop(session.session_id, None)
+      self._tasks.pop(session.session_id, None)
+      # Otra sesión del mismo chat con el mismo objetivo puede seguir usando el espacio de nombres
+      if not any(s.namespace == session.namespace
+                 for s in self._sessions.values()):
+        vector_store.release(session.namespace)
+
+  def stats(self) -> Dict[str, float]:
+    stats = dict(self.counters)
+    stats["active"] = len(self._tasks)
+    stats["waiting"] = len(self._sessions) - len(self._tasks)
+    iterations = self.counters["iterations"]
+    stats["iteration_seconds_avg"] = (self.counters["iteration_seconds_total"] /
+                                      iterations if iterations else 0.0)
+    return stats
+
+  async def close(self):
+    # Cancela las sesiones en ejecución al apagar el servidor
+    tasks = list(self._tasks.values())
+    for task in tasks:
+      task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# Gestor compartido de las sesiones de BabyAGI del proceso
+session_manager = BabyAGISessionManager(BABYAGI_MAX_SESSIONS,
+                                        BABYAGI_MAX_SESSIONS_PER_CHAT,
+                                        BABYAGI_MAX_TASKS)
+
+
+async def process_task(objective: str, chat_id: str, platform='telegram'):
+  session = await session_manager.run(objective, chat_id, platform)
+  if session is None:
+    await send_message(
+      chat_id,
+      "Ya hay una tarea en curso en este chat. Espera a que termine para empezar otra.",
+      platform)
 
 
 async def send_twilio_message(chat_id: str,
                               message: str,
                               platform: str = "whatsapp"):
-  account_sid = ACCOUNT_SID
-  auth_token = AUTH_TOKEN
-  client = Client(account_sid, auth_token)
-
-  if platform not in ("whatsapp", "messenger"):
-    raise ValueError(
-      "Plataforma no válida especificada. Las plataformas válidas son 'whatsapp' y 'messenger'."
-    )
-
-  if platform == "whatsapp" and not TWILIO_WHATSAPP_NUMBER:
-    print(
-      "Número de WhatsApp de Twilio no configurado. Por favor, establezca la variable de entorno TWILIO_WHATSAPP_NUMBER."
-    )
-    return
-  elif platform == "messenger" and not FACEBOOK_PAGE_ID:
-    print(
-      "ID de página de Facebook no configurado. Por favor, establezca la variable de entorno FACEBOOK_PAGE_ID."
-    )
+  twilio_phone_number = get_twilio_sender_number(platform)
+  if twilio_phone_number is None:
     return
 
-  if platform == "messenger":
-    twilio_phone_number = f'messenger:{FACEBOOK_PAGE_ID}'
-  else:
-    twilio_phone_number = f'whatsapp:{TWILIO_WHATSAPP_NUMBER}'
-
-  try:
-    client.messages.create(body=message, from_=twilio_phone_number, to=chat_id)
-  except TwilioException as e:
-    print(f"Error al enviar el mensaje: {e}")
+  await twilio_sender.send(chat_id, message, twilio_phone_number)
@@ -0,0 +1,92 @@
+import threading
+from typing import Dict
+from config import SELECTED_MODEL
+from executor import run_llm
+from models import get_language_model, is_chat_model
+from templates import get_preamble, get_template, get_turn_template
+
+# Tipos de plantilla que usa el chatbot
+CHAIN_TYPES = ("topic", "chat", "image", "calendar", "summary")
+
+# Cadenas ya construidas, una por tipo de plantilla
+_chains: Dict[str, object] = {}
+_chains_lock = threading.Lock()
+
+# Número de veces que se ha usado cada cadena
+chain_hits: Dict[str, int] = {name: 0 for name in CHAIN_TYPES}
+
+
+def build_chain(template_type: str):
+  """
+    Construye una cadena LLM para el tipo de plantilla dado.
+
+    La cadena no lleva memoria propia: el historial se pasa en cada llamada, por lo
+    que la misma instancia puede compartirse entre todos los chats. Con los modelos
+    de chat el preámbulo de la plantilla va como mensaje de sistema fijo, separado
+    del contenido de cada turno.
+
+    Args:
+        template_type (str): El tipo de plantilla (topic, chat, image, calendar, summary).
+
+    Returns:
+        LLMChain: La cadena lista para usarse.
+    """
+  from langchain import LLMChain, PromptTemplate
+  if is_chat_model(SELECTED_MODEL):
+    from langchain.prompts.chat import (ChatPromptTemplate,
+                                        HumanMessagePromptTemplate)
+    from langchain.schema import SystemMessage
+    prompt = ChatPromptTemplate.from_messages([
+      SystemMessage(content=get_preamble(template_type)),
+      HumanMessagePromptTemplate.from_template(
+        get_turn_template(template_type)),
+    ])
+  else:
+    prompt = PromptTemplate(input_variables=["history", "human_input"],
+                            template=get_template(template_type))
+  return LLMChain(llm=get_language_model(SELECTED_MODEL),
+                  prompt=prompt,
+                  verbose=False)
+
+
+def get_chain(template_type: str):
+  """
+    Devuelve la cadena compartida para el tipo de plantilla, construyéndola en el primer uso.
+
+    Args:
+        template_type (str): El tipo de plantilla (topic, chat, image, calendar).
+
+    Returns:
+        LLMChain: La cadena compartida.
+    """
+  chain = _chains.get(template_type)
+  if chain is None:
+    with _chains_lock:
+      chain = _chains.get(template_type)
+      if chain is None:
+        chain = build_chain(template_type)
+        _chains[template_type] = chain
+  chain_hits[template_type] = chain_hits.get(template_type, 0) + 1
+  return chain
+
+
+async def load_chain(template_type: str):
+  # Como get_chain, pero la primera vez la cadena se construye en el pool: importar
+  # LangChain y crear el modelo bloquearía el bucle de eventos
+  if template_type in _chains:
+    return get_chain(template_type)
+  return await run_llm(get_chain, template_type)
+
+
+def preload_chains():
+  # Construye todas las cadenas por adelantado para que el primer mensaje no pague el coste
+  for template_type in CHAIN_TYPES:
+    if template_type not in _chains:
+      with _chains_lock:
+        if template_type not in _chains:
+          _chains[template_type] = build_chain(template_type)
+
+
+def get_chain_stats() -> Dict[str, int]:
+  # Devuelve una copia de los contadores de uso por cadena
+  return dict(chain_hits)
@@ -1,40 +1,120 @@
-from typing import Dict, Union, Tuple
-from models import initialize_language_model
+import asyncio
+from typing import (AsyncIterator, Awaitable, Callable, Dict, Optional, Set,
+                    Union, Tuple)
+from config import SPECULATIVE_CHAT
+from history import conversation_store
+from intent import intent_router, rule_intent
+from metrics import current_topic
+from models import estimate_tokens
+from prompt_builder import prompt_builder
 from templates import get_template
-from config import SELECTED_MODEL
-from utils import get_topic, process_chat, process_image, process_calendar
+from utils import (llm_topic, process_chat, process_chat_stream, process_image,
+                   process_calendar)
 
-# Inicializa un diccionario para realizar un seguimiento del último mensaje de cada usuario
-last_messages: Dict[int, str] = {}
+# Recibe los fragmentos de una respuesta, los entrega al chat y devuelve el texto completo
+Deliver = Callable[[AsyncIterator[str]], Awaitable[str]]
 
+# Métricas del modo especulativo
+speculation_stats: Dict[str, int] = {
+  "started": 0,
+  "kept": 0,
+  "discarded": 0,
+  "wasted_tokens": 0,
+}
 
-async def process_chat_message(text: str,
-                               chat_id: int) -> Union[str, Tuple[str, str]]:
+
+# Respuestas especulativas descartadas que aún no han terminado
+_discarded_tasks: Set[asyncio.Task] = set()
+
+
+def _discard_speculation(chat_task: asyncio.Task, text: str,
+                         history_string: str):
+  # Descarta la respuesta especulativa y contabiliza los tokens desperdiciados.
+  # La llamada al LLM corre en un hilo del pool y no se puede interrumpir: cancelar
+  # la tarea no ahorraría tokens ni el hueco del pool, así que se deja terminar y
+  # se cuentan el prompt y la respuesta completos
+  speculation_stats["discarded"] += 1
+  prompt_tokens = estimate_tokens(get_template("chat") + history_string + text)
+
+  def account(task: asyncio.Task):
+    _discarded_tasks.discard(task)
+    if task.cancelled() or task.exception() is not None:
+      speculation_stats["wasted_tokens"] += prompt_tokens
+    else:
+      speculation_stats["wasted_tokens"] += prompt_tokens + estimate_tokens(
+        task.result())
+
+  _discarded_tasks.add(chat_task)
+  chat_task.add_done_callback(account)
+
+
+async def process_chat_message(
+    text: str,
+    chat_id: int,
+    deliver: Optional[Deliver] = None) -> Union[str, Tuple[str, str], None]:
   """
     Procesa un mensaje de chat entrante y genera una respuesta apropiada.
     Args:
         text (str): Mensaje de texto de entrada.
         chat_id (int): Identificador único para el chat.
+        deliver (Deliver): Si se indica, las respuestas de chat se le pasan por fragmentos a medida que se generan.
     Returns:
-        Union[str, Tuple[str, str]]: La respuesta generada como una cadena de texto, o una tupla que contiene una cadena de texto y una URL de imagen.
+        Union[str, Tuple[str, str], None]: La respuesta generada como una cadena de texto, o una tupla que contiene una cadena de texto y una URL de imagen; None si la respuesta ya se entregó con deliver.
     """
-  # Obtener los últimos 3 mensajes para este usuario
-  last_3_messages = last_messages.get(chat_id, ["", "", ""])
-  history_string = f"""\n{last_3_messages[0]}\n{last_3_messages[1]}\n{last_3_messages[2]}\n"""
+  # Un turno por chat a la vez, para que el historial leído siga siendo válido al guardarlo
+  async with conversation_store.lock(chat_id):
+    # Obtener los últimos mensajes para este usuario
+    last_messages = await conversation_store.get(chat_id)
+    # Solo los mensajes recientes que caben en el presupuesto de tokens, y el resumen de los anteriores
+    history_string = prompt_builder.history_string(chat_id, last_messages,
+                                                   text)
 
-  # Determinar el tema
-  topic = await get_topic(text, history_string)
+    output, delivered = await _respond(text, history_string, deliver)
 
-  # Procesar el mensaje según el tema
+    # Actualizar los últimos mensajes para este usuario; el más antiguo pasa al resumen
+    await conversation_store.push(chat_id, text)
+    if len(last_messages) >= conversation_store.size:
+      prompt_builder.forget(chat_id, last_messages[conversation_store.size - 1])
+  print(output)
+  return None if delivered else output
+
+
+async def _respond(
+    text: str, history_string: str,
+    deliver: Optional[Deliver]) -> Tuple[Union[str, Tuple[str, str]], bool]:
+  # Determinar el tema; si hace falta el LLM y el modo especulativo está activo,
+  # la respuesta de chat se genera a la vez
   output = ""
-  if topic == "chat":
-    output = process_chat(text, history_string)
+  chat_task = None
+  topic = intent_router.classify(text)
+  if topic is None:
+    # Solo se especula si las reglas, aunque sin confianza suficiente, apuntan a chat
+    if SPECULATIVE_CHAT and rule_intent(text)[0] == "chat":
+      speculation_stats["started"] += 1
+      chat_task = asyncio.create_task(process_chat(text, history_string))
+    try:
+      # Las reglas y el clasificador ya se probaron arriba: solo falta el LLM
+      topic = await llm_topic(text, history_string)
+    except BaseException:
+      if chat_task is not None:
+        _discard_speculation(chat_task, text, history_string)
+      raise
+  current_topic.set(topic)
+
+  if chat_task is not None:
+    if topic == "chat":
+      speculation_stats["kept"] += 1
+      output = await chat_task
+    else:
+      _discard_speculation(chat_task, text, history_string)
+
+  # Procesar el mensaje según el tema
+  if topic == "chat" and chat_task is None:
+    if deliver is not None:
+      return await deliver(process_chat_stream(text, history_string)), True
+    output = await process_chat(text, history_string)
   elif topic == "image":
     output = await process_image(text, history_string)
   elif topic == "calendar":
-    output = process_calendar(text, history_string)
-
-  # Actualizar los últimos mensajes para este usuario
-  last_messages[chat_id] = [text] + last_3_messages[:-1]
-  print(output)
-  return output
+    output = await process_calendar(text, history_string)
+  return output, False
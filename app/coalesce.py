@@ -0,0 +1,106 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Hashable, List
+from config import COALESCE_WINDOW_MS, COALESCE_MAX_WAIT_MS
+from ingest import ingest_queue
+
+
+class _Batch:
+
+  def __init__(self, text: str, handler: Callable[[str], Awaitable],
+               now: float):
+    self.texts: List[str] = [text]
+    self.handler = handler
+    self.started = now
+    self.deadline = now
+    self.timer = None
+
+
+class Coalescer:
+  """
+    Agrupa los mensajes de texto que un chat envía seguidos en un solo turno.
+
+    Cada mensaje nuevo del chat alarga la espera window_ms, sin pasar de max_wait_ms
+    desde el primero. Al vencer, los textos se unen y se encola un único trabajo.
+
+    Args:
+        window_ms (int): Milisegundos de silencio que cierran el grupo.
+        max_wait_ms (int): Milisegundos máximos que puede esperar el primer mensaje.
+    """
+
+  def __init__(self, window_ms: int, max_wait_ms: int):
+    self.window = window_ms / 1000
+    self.max_wait = max(window_ms, max_wait_ms) / 1000
+    self._batches: Dict[Hashable, _Batch] = {}
+    self.counters: Dict[str, int] = {"messages": 0, "turns": 0, "calls_saved": 0}
+
+  @property
+  def enabled(self) -> bool:
+    return self.window > 0
+
+  def add(self, chat_id: Hashable, text: str,
+          handler: Callable[[str], Awaitable]) -> bool:
+    """
+      Añade un mensaje al grupo abierto del chat o abre uno nuevo.
+
+      Args:
+          chat_id (Hashable): Identificador del chat.
+          text (str): Texto del mensaje.
+          handler (Callable[[str], Awaitable]): Procesa el texto unido del grupo.
+
+      Returns:
+          bool: True si el mensaje se aceptó, False si la cola de entrada está llena.
+      """
+    now = time.monotonic()
+    batch = self._batches.get(chat_id)
+    if batch is not None:
+      batch.texts.append(text)
+      batch.deadline = min(now + self.window, batch.started + self.max_wait)
+      self.counters["messages"] += 1
+      self.counters["calls_saved"] += 1
+      return True
+
+    # El grupo ocupará un solo hueco de la cola; se aparta ya para poder rechazar ahora
+    if not ingest_queue.reserve():
+      return False
+    batch = _Batch(text, handler, now)
+    batch.deadline = now + self.window
+    batch.timer = asyncio.create_task(self._flush_later(chat_id, batch))
+    self._batches[chat_id] = batch
+    self.counters["messages"] += 1
+    return True
+
+  async def _flush_later(self, chat_id: Hashable, batch: _Batch):
+    while True:
+      remaining = batch.deadline - time.monotonic()
+      if remaining <= 0:
+        break
+      await asyncio.sleep(remaining)
+    self._submit(chat_id, batch)
+
+  def _submit(self, chat_id: Hashable, batch: _Batch):
+    if self._batches.get(chat_id) is not batch:
+      return
+    del self._batches[chat_id]
+    self.counters["turns"] += 1
+    merged = "\n".join(batch.texts)
+    ingest_queue.submit(lambda: batch.handler(merged),
+                        key=chat_id,
+                        kind="text",
+                        reserved=True)
+
+  def flush(self, chat_id: Hashable):
+    # Encola ya el grupo abierto del chat, p. ej. antes de un mensaje de voz, para mantener el orden
+    batch = self._batches.get(chat_id)
+    if batch is not None:
+      batch.timer.cancel()
+      self._submit(chat_id, batch)
+
+  def stats(self) -> Dict[str, int]:
+    stats = dict(self.counters)
+    stats["open"] = len(self._batches)
+    return stats
+
+
+# Agrupador compartido por los webhooks
+coalescer = Coalescer(COALESCE_WINDOW_MS, COALESCE_MAX_WAIT_MS)
@@ -35,4 +35,171 @@ IMAGE_SIZE = "256x256"
 BOT_NAME = 'Luisa'
 
 # ¿Usar BabyAGI o no?
-BABYAGI = False
\ No newline at end of file
+BABYAGI = os.getenv('BABYAGI', 'false').lower() == 'true'
+
+# Tamaño del pool de conexiones HTTP compartido hacia la API de OpenAI
+LLM_HTTP_POOL_SIZE = int(os.getenv('LLM_HTTP_POOL_SIZE', 20))
+
+# Número máximo de llamadas simultáneas al LLM (se ejecutan en un pool de hilos)
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 32))
+
+# Confianza mínima para decidir el tema localmente sin llamar al LLM
+INTENT_CONFIDENCE_THRESHOLD = float(os.getenv('INTENT_CONFIDENCE_THRESHOLD', 0.75))
+
+# Archivo JSONL donde se guardan las decisiones del LLM para entrenar el clasificador local (opcional)
+INTENT_LOG_PATH = os.getenv('INTENT_LOG_PATH', None)
+
+# Número de decisiones registradas necesarias antes de usar el clasificador local
+INTENT_MIN_SAMPLES = int(os.getenv('INTENT_MIN_SAMPLES', 50))
+
+# Genera la respuesta de chat en paralelo con la detección del tema (gasta tokens si el tema no es chat)
+SPECULATIVE_CHAT = os.getenv('SPECULATIVE_CHAT', 'false').lower() == 'true'
+
+# Número máximo de operaciones de E/S bloqueantes simultáneas (SQLite, envíos síncronos)
+IO_MAX_CONCURRENCY = int(os.getenv('IO_MAX_CONCURRENCY', 16))
+
+# Almacén del historial de conversación: memory, sqlite o redis
+HISTORY_BACKEND = os.getenv('HISTORY_BACKEND', 'memory')
+
+# Número de mensajes recientes que se guardan por chat
+HISTORY_SIZE = int(os.getenv('HISTORY_SIZE', 3))
+
+# Número máximo de chats en memoria (se expulsan los menos recientes)
+HISTORY_MAX_CHATS = int(os.getenv('HISTORY_MAX_CHATS', 10000))
+
+# Segundos que se conserva el historial de un chat inactivo
+HISTORY_TTL = int(os.getenv('HISTORY_TTL', 86400))
+
+# Tokens de entrada como máximo en cada prompt del chatbot (preámbulo, historial y mensaje);
+# el historial más antiguo que no cabe se descarta
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', 2000))
+
+# Resume con el LLM los mensajes que salen del historial, para conservar su contexto en pocas palabras
+HISTORY_SUMMARY = os.getenv('HISTORY_SUMMARY', 'false').lower() == 'true'
+
+# Tokens como máximo del resumen del historial de cada chat
+HISTORY_SUMMARY_TOKENS = int(os.getenv('HISTORY_SUMMARY_TOKENS', 200))
+
+# Archivo SQLite para HISTORY_BACKEND=sqlite
+HISTORY_SQLITE_PATH = os.getenv('HISTORY_SQLITE_PATH', 'history.db')
+
+# URL de un servidor compatible con Redis para los almacenes compartidos
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
+# Plantillas cuyas respuestas se guardan en caché, separadas por comas (p. ej. "chat,image"; vacío la desactiva)
+RESPONSE_CACHE_TEMPLATES = {
+  template.strip()
+  for template in os.getenv('RESPONSE_CACHE_TEMPLATES', '').split(',')
+  if template.strip()
+}
+
+# Número máximo de respuestas en caché y segundos que vive cada una
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', 1000))
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 3600))
+# Segundos que vive una imagen en caché: las URL de DALL-E caducan al cabo de una hora
+RESPONSE_CACHE_IMAGE_TTL = int(os.getenv('RESPONSE_CACHE_IMAGE_TTL', 1800))
+
+# Similitud coseno mínima para reutilizar la respuesta de un mensaje parecido (0 desactiva la búsqueda por embeddings)
+RESPONSE_CACHE_SIMILARITY = float(os.getenv('RESPONSE_CACHE_SIMILARITY', 0))
+
+# Procesos dedicados a convertir audio que Whisper no acepta directamente
+VOICE_PROCESS_WORKERS = int(os.getenv('VOICE_PROCESS_WORKERS', os.cpu_count() or 1))
+
+# Cliente HTTP asíncrono compartido: conexiones máximas, conexiones persistentes y tiempo de espera (segundos)
+HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', 100))
+HTTP_MAX_KEEPALIVE = int(os.getenv('HTTP_MAX_KEEPALIVE', 20))
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', 30))
+
+# Tamaño máximo de un archivo multimedia descargado (Whisper acepta hasta 25 MB)
+MEDIA_MAX_BYTES = int(os.getenv('MEDIA_MAX_BYTES', 25 * 1024 * 1024))
+
+# Transcripciones de voz en caché: número máximo y segundos que vive cada una
+TRANSCRIPTION_CACHE_SIZE = int(os.getenv('TRANSCRIPTION_CACHE_SIZE', 5000))
+TRANSCRIPTION_CACHE_TTL = int(os.getenv('TRANSCRIPTION_CACHE_TTL', 86400))
+
+# Las notas de voz más largas que esto (segundos) se parten en silencios y se transcriben en paralelo (0 lo desactiva)
+VOICE_SEGMENT_SECONDS = float(os.getenv('VOICE_SEGMENT_SECONDS', 60))
+
+# Tamaño mínimo del audio (bytes) para intentar partirlo; evita decodificar las notas cortas
+VOICE_SEGMENT_MIN_BYTES = int(os.getenv('VOICE_SEGMENT_MIN_BYTES', 200 * 1024))
+
+# Segmentos de una misma nota que se transcriben a la vez
+VOICE_SEGMENT_CONCURRENCY = int(os.getenv('VOICE_SEGMENT_CONCURRENCY', 4))
+
+# Mensajes por segundo que se envían desde cada remitente de Twilio y reintentos ante errores transitorios
+TWILIO_SEND_RATE = float(os.getenv('TWILIO_SEND_RATE', 10))
+TWILIO_SEND_RETRIES = int(os.getenv('TWILIO_SEND_RETRIES', 3))
+
+# Límites de envío de Telegram: mensajes por segundo en total y por chat, y reintentos ante errores transitorios
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', 30))
+TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', 1))
+TELEGRAM_SEND_RETRIES = int(os.getenv('TELEGRAM_SEND_RETRIES', 3))
+
+# Mensajes entrantes pendientes como máximo (si se llena, los webhooks responden 503) y workers que los procesan
+INGEST_QUEUE_SIZE = int(os.getenv('INGEST_QUEUE_SIZE', 1000))
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', 32))
+
+# Descarte de entregas repetidas: memory o redis, identificadores recordados y segundos que se recuerdan
+DEDUP_BACKEND = os.getenv('DEDUP_BACKEND', 'memory')
+DEDUP_WINDOW = int(os.getenv('DEDUP_WINDOW', 100000))
+DEDUP_TTL = int(os.getenv('DEDUP_TTL', 3600))
+
+# Une en un solo turno los mensajes de texto que un chat envía con menos de estos milisegundos entre sí (0 lo desactiva)
+COALESCE_WINDOW_MS = int(os.getenv('COALESCE_WINDOW_MS', 0))
+
+# Milisegundos máximos que un mensaje puede esperar a que se cierre su grupo
+COALESCE_MAX_WAIT_MS = int(os.getenv('COALESCE_MAX_WAIT_MS', 3000))
+
+# Peso de cada tipo de mensaje en el reparto de workers entre chats
+INGEST_WEIGHTS = {
+  kind.strip(): int(weight)
+  for kind, weight in (pair.split(':') for pair in os.getenv(
+    'INGEST_WEIGHTS', 'text:4,voice:2,task:1').split(',') if ':' in pair)
+}
+
+# Ejecuciones de /task (BabyAGI) simultáneas como máximo, para que no ocupen todos los workers
+INGEST_TASK_CONCURRENCY = int(
+  os.getenv('INGEST_TASK_CONCURRENCY', max(1, INGEST_WORKERS // 4)))
+
+# Sesiones de BabyAGI en ejecución a la vez en todo el proceso y por chat
+BABYAGI_MAX_SESSIONS = int(os.getenv('BABYAGI_MAX_SESSIONS', 8))
+BABYAGI_MAX_SESSIONS_PER_CHAT = int(os.getenv('BABYAGI_MAX_SESSIONS_PER_CHAT', 1))
+
+# Tareas que BabyAGI puede crear como máximo en cada sesión
+BABYAGI_MAX_TASKS = int(os.getenv('BABYAGI_MAX_TASKS', 6))
+
+# Tokens como máximo del resultado anterior y de la lista de tareas en el prompt de creación de tareas
+BABYAGI_RESULT_TOKENS = int(os.getenv('BABYAGI_RESULT_TOKENS', 400))
+
+# Embeddings: milisegundos que se agrupan los textos antes de llamar a la API, textos por llamada y vectores en caché
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv('EMBEDDING_BATCH_WINDOW_MS', 10))
+EMBEDDING_MAX_BATCH = int(os.getenv('EMBEDDING_MAX_BATCH', 100))
+EMBEDDING_CACHE_SIZE = int(os.getenv('EMBEDDING_CACHE_SIZE', 10000))
+
+# Memoria vectorial de BabyAGI: local (en el proceso) o pinecone, y dimensión de los embeddings
+VECTOR_BACKEND = os.getenv('VECTOR_BACKEND', 'local')
+VECTOR_DIMENSION = int(os.getenv('VECTOR_DIMENSION', 1536))
+
+# Directorio donde la memoria local guarda los vectores (sin definir: solo en memoria)
+VECTOR_STORE_PATH = os.getenv('VECTOR_STORE_PATH', None)
+
+# Credenciales e índice de Pinecone (solo con VECTOR_BACKEND=pinecone)
+PINECONE_API_KEY = os.getenv('PINECONE_API_KEY', '')
+PINECONE_ENVIRONMENT = os.getenv('PINECONE_ENVIRONMENT', 'us-east1-gcp')
+PINECONE_INDEX = os.getenv('TABLE_NAME', '')
+
+# Envía las respuestas de chat a medida que el modelo las genera
+CHAT_STREAMING = os.getenv('CHAT_STREAMING', 'false').lower() == 'true'
+
+# Segundos mínimos entre dos ediciones del mensaje que se va completando en Telegram
+TELEGRAM_EDIT_INTERVAL = float(os.getenv('TELEGRAM_EDIT_INTERVAL', 1.0))
+
+# Caracteres mínimos de cada trozo que se envía por WhatsApp/Messenger durante el streaming
+TWILIO_STREAM_MIN_CHARS = int(os.getenv('TWILIO_STREAM_MIN_CHARS', 300))
+
+# URL base de la API de bots de Telegram y de la API de Twilio (sin definir: la oficial), útil para pruebas y benchmarks
+TELEGRAM_API_BASE = os.getenv('TELEGRAM_API_BASE', 'https://api.telegram.org')
+TWILIO_API_BASE = os.getenv('TWILIO_API_BASE', None)
+
+# Carga en segundo plano, tras arrancar, los clientes que se inicializan en el primer uso (openai, LangChain, Twilio, Zapier)
+WARMUP = os.getenv('WARMUP', 'true').lower() == 'true'
@@ -0,0 +1,110 @@
+from abc import ABC, abstractmethod
+from typing import Dict
+from config import DEDUP_BACKEND, DEDUP_WINDOW, DEDUP_TTL, REDIS_URL
+from ttl_cache import TTLCache
+
+
+class Deduplicator(ABC):
+  """
+    Recuerda los identificadores de las entregas recientes para descartar los reintentos.
+
+    Args:
+        ttl (float): Segundos que se recuerda cada identificador.
+    """
+
+  def __init__(self, ttl: float):
+    self.ttl = ttl
+    self.counters: Dict[str, int] = {"new": 0, "duplicates": 0}
+
+  async def first_seen(self, key: str) -> bool:
+    """
+      Marca el identificador como visto.
+
+      Args:
+          key (str): Identificador de la entrega (update_id de Telegram, MessageSid de Twilio).
+
+      Returns:
+          bool: True si es la primera vez que se ve, False si es un reintento.
+      """
+    new = await self._mark(key)
+    self.counters["new" if new else "duplicates"] += 1
+    return new
+
+  @abstractmethod
+  async def _mark(self, key: str) -> bool:
+    pass
+
+  @abstractmethod
+  async def forget(self, key: str):
+    # Olvida el identificador, p. ej. si la entrega se rechazó y debe aceptarse al reintentarla
+    pass
+
+  async def close(self):
+    pass
+
+  def stats(self) -> Dict[str, int]:
+    return dict(self.counters)
+
+
+class MemoryDeduplicator(Deduplicator):
+  """
+    Ventana de identificadores en memoria, con expulsión LRU y caducidad.
+
+    Args:
+        window (int): Número máximo de identificadores recordados.
+        ttl (float): Segundos que se recuerda cada identificador.
+    """
+
+  def __init__(self, window: int, ttl: float):
+    super().__init__(ttl)
+    self._seen = TTLCache(window, ttl)
+
+  async def _mark(self, key: str) -> bool:
+    return self._seen.add(key)
+
+  async def forget(self, key: str):
+    self._seen.pop(key)
+
+
+class RedisDeduplicator(Deduplicator):
+  """
+    Identificadores compartidos en un servidor compatible con Redis, para varios workers.
+
+    Args:
+        url (str): URL del servidor.
+        ttl (float): Segundos que se recuerda cada identificador.
+    """
+
+  def __init__(self, url: str, ttl: float):
+    super().__init__(ttl)
+    try:
+      import redis.asyncio as redis
+    except ImportError:
+      raise ImportError(
+        "DEDUP_BACKEND=redis necesita el paquete 'redis' (pip install redis)")
+    self._redis = redis.from_url(url)
+
+  async def _mark(self, key: str) -> bool:
+    # SET NX es atómico: solo el primer worker que ve el identificador lo procesa
+    return bool(await self._redis.set(f"seen:{key}", 1, nx=True,
+                                      ex=int(self.ttl)))
+
+  async def forget(self, key: str):
+    await self._redis.delete(f"seen:{key}")
+
+  async def close(self):
+    await self._redis.close()
+
+
+def create_deduplicator() -> Deduplicator:
+  # Crea el deduplicador según DEDUP_BACKEND
+  if DEDUP_BACKEND == "memory":
+    return MemoryDeduplicator(DEDUP_WINDOW, DEDUP_TTL)
+  elif DEDUP_BACKEND == "redis":
+    return RedisDeduplicator(REDIS_URL, DEDUP_TTL)
+  else:
+    raise ValueError(f"Deduplicador no válido: {DEDUP_BACKEND}")
+
+
+# Deduplicador compartido por los webhooks
+deduplicator = create_deduplicator()
@@ -0,0 +1,142 @@
+import asyncio
+import hashlib
+from typing import Dict, List, Optional, Set
+import numpy as np
+from config import (EMBEDDING_BATCH_WINDOW_MS, EMBEDDING_MAX_BATCH,
+                    EMBEDDING_CACHE_SIZE)
+from metrics import stage_timer
+from models import async_openai
+from ttl_cache import TTLCache
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+
+def _text_key(text: str) -> str:
+  return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingService:
+  """
+    Calcula embeddings agrupando en una sola llamada a la API los textos pedidos casi a la vez.
+
+    Los vectores se guardan como arrays float32 en una caché LRU indexada por el
+    hash del texto, así que pedir dos veces el mismo texto (p. ej. el objetivo de
+    BabyAGI en cada iteración) no vuelve a llamar a la API.
+
+    Args:
+        model (str): Modelo de embeddings de OpenAI.
+        batch_window_ms (float): Milisegundos que se esperan otros textos antes de llamar a la API.
+        max_batch (int): Textos por llamada como máximo.
+        cache_size (int): Vectores guardados en la caché.
+    """
+
+  def __init__(self, model: str, batch_window_ms: float, max_batch: int,
+               cache_size: int):
+    self.model = model
+    self.batch_window = batch_window_ms / 1000
+    self.max_batch = max_batch
+    self._cache = TTLCache(cache_size)
+    # Textos esperando a la próxima llamada y sus futuros, por hash del texto
+    self._pending: Dict[str, str] = {}
+    self._futures: Dict[str, asyncio.Future] = {}
+    self._flush_handle: Optional[asyncio.TimerHandle] = None
+    # Llamadas en curso; se guardan para que el recolector no las cancele a medias
+    self._requests: Set[asyncio.Task] = set()
+    self.counters: Dict[str, int] = {
+      "requests": 0,
+      "cache_hits": 0,
+      "api_calls": 0,
+      "api_inputs": 0,
+      "failed": 0,
+    }
+
+  async def embed(self, text: str) -> np.ndarray:
+    """
+      Devuelve el embedding del texto.
+
+      Args:
+          text (str): Texto a convertir; los saltos de línea se tratan como espacios.
+
+      Returns:
+          np.ndarray: El vector en float32.
+      """
+    text = text.replace("\n", " ")
+    key = _text_key(text)
+    self.counters["requests"] += 1
+    vector = self._cache.get(key)
+    if vector is not None:
+      self.counters["cache_hits"] += 1
+      return vector
+
+    future = self._futures.get(key)
+    if future is None:
+      # Primer pedido de este texto en la ventana: se apunta para la próxima llamada
+      future = asyncio.get_running_loop().create_future()
+      self._futures[key] = future
+      self._pending[key] = text
+      if len(self._pending) >= self.max_batch:
+        self._flush()
+      elif self._flush_handle is None:
+        self._flush_handle = asyncio.get_running_loop().call_later(
+          self.batch_window, self._flush)
+    return await asyncio.shield(future)
+
+  async def embed_many(self, texts: List[str]) -> List[np.ndarray]:
+    return list(await asyncio.gather(*(self.embed(text) for text in texts)))
+
+  def _flush(self):
+    if self._flush_handle is not None:
+      self._flush_handle.cancel()
+      self._flush_handle = None
+    if not self._pending:
+      return
+    batch = self._pending
+    self._pending = {}
+    task = asyncio.ensure_future(self._request(batch))
+    self._requests.add(task)
+    task.add_done_callback(self._requests.discard)
+
+  async def _request(self, batch: Dict[str, str]):
+    keys = list(batch)
+    self.counters["api_calls"] += 1
+    self.counters["api_inputs"] += len(keys)
+    try:
+      async with async_openai() as openai:
+        with stage_timer("embedding", model=self.model):
+          response = await openai.Embedding.acreate(
+            input=[batch[k] for k in keys], model=self.model)
+      # La API indica a qué entrada corresponde cada vector
+      for item in response["data"]:
+        key = keys[item["index"]]
+        vector = np.asarray(item["embedding"], dtype=np.float32)
+        self._cache.set(key, vector)
+        future = self._futures.pop(key, None)
+        if future is not None and not future.done():
+          future.set_result(vector)
+    except Exception as e:
+      self.counters["failed"] += 1
+      for key in keys:
+        future = self._futures.pop(key, None)
+        if future is not None and not future.done():
+          future.set_exception(e)
+    finally:
+      # Entradas sin vector en la respuesta, para no dejar a nadie esperando
+      for key in keys:
+        future = self._futures.pop(key, None)
+        if future is not None and not future.done():
+          future.set_exception(
+            RuntimeError("La API no devolvió el embedding del texto"))
+
+  def stats(self) -> Dict[str, float]:
+    stats = dict(self.counters)
+    stats["cache_size"] = len(self._cache)
+    stats["cache_evictions"] = self._cache.evictions
+    stats["pending"] = len(self._pending)
+    calls = self.counters["api_calls"]
+    stats["batch_avg"] = self.counters["api_inputs"] / calls if calls else 0.0
+    return stats
+
+
+# Servicio compartido por la caché de respuestas y BabyAGI
+embedding_service = EmbeddingService(EMBEDDING_MODEL, EMBEDDING_BATCH_WINDOW_MS,
+                                     EMBEDDING_MAX_BATCH, EMBEDDING_CACHE_SIZE)
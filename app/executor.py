@@ -0,0 +1,85 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict
+from config import LLM_MAX_CONCURRENCY, IO_MAX_CONCURRENCY
+
+
+class BoundedExecutor:
+  """
+    Ejecuta llamadas bloqueantes en un pool de hilos acotado sin bloquear el bucle de eventos.
+
+    Args:
+        max_workers (int): Número máximo de llamadas ejecutándose a la vez.
+        name (str): Prefijo de los hilos, útil para depurar.
+    """
+
+  def __init__(self, max_workers: int, name: str):
+    self.name = name
+    self.max_workers = max_workers
+    self._pool = ThreadPoolExecutor(max_workers=max_workers,
+                                    thread_name_prefix=name)
+    self._lock = threading.Lock()
+    self.active = 0
+    self.waiting = 0
+    self.completed = 0
+
+  async def run(self, func: Callable, *args, **kwargs):
+    """
+      Ejecuta func(*args, **kwargs) en el pool y espera su resultado.
+
+      Returns:
+          El valor devuelto por func.
+      """
+
+    def call():
+      with self._lock:
+        self.waiting -= 1
+        self.active += 1
+      try:
+        return func(*args, **kwargs)
+      finally:
+        with self._lock:
+          self.active -= 1
+          self.completed += 1
+
+    with self._lock:
+      self.waiting += 1
+    future = self._pool.submit(call)
+    try:
+      return await asyncio.wrap_future(future)
+    except asyncio.CancelledError:
+      # Si la llamada nunca llegó a empezar, deja de contarla como en espera
+      if future.cancel():
+        with self._lock:
+          self.waiting -= 1
+      raise
+
+  def stats(self) -> Dict[str, int]:
+    return {
+      "max_workers": self.max_workers,
+      "active": self.active,
+      "waiting": self.waiting,
+      "completed": self.completed,
+    }
+
+  def shutdown(self):
+    self._pool.shutdown(wait=False)
+
+
+# Pool global para las llamadas al LLM (LangChain, DALL-E, Whisper)
+llm_executor = BoundedExecutor(LLM_MAX_CONCURRENCY, "llm")
+
+# Pool para E/S bloqueante que no es del LLM (SQLite, clientes HTTP síncronos)
+io_executor = BoundedExecutor(IO_MAX_CONCURRENCY, "io")
+
+
+async def run_llm(func: Callable, *args, **kwargs):
+  # Atajo para ejecutar una llamada bloqueante al LLM en el pool global
+  return await llm_executor.run(functools.partial(func, *args, **kwargs))
+
+
+async def run_io(func: Callable, *args, **kwargs):
+  # Atajo para ejecutar una llamada de E/S bloqueante en el pool de E/S
+  return await io_executor.run(functools.partial(func, *args, **kwargs))
@@ -0,0 +1,203 @@
+import asyncio
+import sqlite3
+import threading
+import time
+import weakref
+from abc import ABC, abstractmethod
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import List
+from config import (HISTORY_BACKEND, HISTORY_SIZE, HISTORY_MAX_CHATS,
+                    HISTORY_TTL, HISTORY_SQLITE_PATH, REDIS_URL)
+from executor import run_io
+from ttl_cache import TTLCache
+
+
+class ConversationStore(ABC):
+  """
+    Almacén del historial reciente de cada chat.
+
+    Guarda los últimos mensajes del usuario, del más nuevo al más antiguo.
+    Cada escritura es atómica por chat, y lock() permite serializar un turno
+    completo (leer historial, responder, guardar) dentro del proceso.
+
+    Args:
+        size (int): Número de mensajes que se conservan por chat.
+    """
+
+  def __init__(self, size: int):
+    self.size = size
+    self._locks: "weakref.WeakValueDictionary" = weakref.WeakValueDictionary()
+
+  @asynccontextmanager
+  async def lock(self, chat_id):
+    # Un candado por chat; desaparece solo cuando nadie lo está usando
+    chat_lock = self._locks.get(chat_id)
+    if chat_lock is None:
+      chat_lock = asyncio.Lock()
+      self._locks[chat_id] = chat_lock
+    async with chat_lock:
+      yield
+
+  @abstractmethod
+  async def get(self, chat_id) -> List[str]:
+    pass
+
+  @abstractmethod
+  async def push(self, chat_id, text: str):
+    pass
+
+  async def close(self):
+    pass
+
+  def history_string(self, messages: List[str]) -> str:
+    # Formatea el historial rellenando con vacíos hasta el tamaño configurado
+    padded = list(messages[:self.size]) + [""] * (self.size - len(messages))
+    return "\n" + "\n".join(padded) + "\n"
+
+
+class MemoryConversationStore(ConversationStore):
+  """
+    Historial en memoria con un búfer circular por chat y expulsión LRU/TTL.
+
+    Args:
+        size (int): Número de mensajes que se conservan por chat.
+        max_chats (int): Número máximo de chats en memoria.
+        ttl (float): Segundos que se conserva un chat inactivo.
+    """
+
+  def __init__(self, size: int, max_chats: int, ttl: float):
+    super().__init__(size)
+    self._chats = TTLCache(max_chats, ttl)
+
+  async def get(self, chat_id) -> List[str]:
+    messages = self._chats.get(chat_id)
+    return list(messages) if messages is not None else []
+
+  async def push(self, chat_id, text: str):
+    messages = self._chats.get(chat_id)
+    if messages is None:
+      messages = deque(maxlen=self.size)
+    messages.appendleft(text)
+    # Reinserta para renovar la caducidad y la posición LRU
+    self._chats.set(chat_id, messages)
+
+
+class SQLiteConversationStore(ConversationStore):
+  """
+    Historial compartido en un archivo SQLite, válido para varios workers en la misma máquina.
+
+    Args:
+        path (str): Ruta del archivo de base de datos.
+        size (int): Número de mensajes que se conservan por chat.
+        ttl (float): Segundos que se conserva un chat inactivo.
+    """
+
+  def __init__(self, path: str, size: int, ttl: float):
+    super().__init__(size)
+    self.ttl = ttl
+    self._conn = sqlite3.connect(path,
+                                 check_same_thread=False,
+                                 isolation_level=None,
+                                 timeout=30)
+    self._conn.execute("PRAGMA journal_mode=WAL")
+    self._conn.execute("""CREATE TABLE IF NOT EXISTS messages (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      chat_id TEXT NOT NULL,
+      text TEXT NOT NULL,
+      created_at REAL NOT NULL)""")
+    self._conn.execute(
+      "CREATE INDEX IF NOT EXISTS messages_chat ON messages (chat_id, id)")
+    self._conn_lock = threading.Lock()
+
+  def _get(self, chat_id) -> List[str]:
+    oldest = time.time() - self.ttl if self.ttl > 0 else 0
+    with self._conn_lock:
+      rows = self._conn.execute(
+        "SELECT text FROM messages WHERE chat_id = ? AND created_at >= ? "
+        "ORDER BY id DESC LIMIT ?", (str(chat_id), oldest, self.size)).fetchall()
+    return [row[0] for row in rows]
+
+  def _push(self, chat_id, text: str):
+    with self._conn_lock:
+      # BEGIN IMMEDIATE bloquea a otros escritores, también de otros procesos
+      self._conn.execute("BEGIN IMMEDIATE")
+      try:
+        self._conn.execute(
+          "INSERT INTO messages (chat_id, text, created_at) VALUES (?, ?, ?)",
+          (str(chat_id), text, time.time()))
+        self._conn.execute(
+          "DELETE FROM messages WHERE chat_id = ? AND id NOT IN "
+          "(SELECT id FROM messages WHERE chat_id = ? ORDER BY id DESC LIMIT ?)",
+          (str(chat_id), str(chat_id), self.size))
+        self._conn.execute("COMMIT")
+      except BaseException:
+        self._conn.execute("ROLLBACK")
+        raise
+
+  async def get(self, chat_id) -> List[str]:
+    return await run_io(self._get, chat_id)
+
+  async def push(self, chat_id, text: str):
+    await run_io(self._push, chat_id, text)
+
+  async def close(self):
+    with self._conn_lock:
+      self._conn.close()
+
+
+class RedisConversationStore(ConversationStore):
+  """
+    Historial compartido en un servidor compatible con Redis, válido para varias máquinas.
+
+    Args:
+        url (str): URL del servidor (p. ej. redis://localhost:6379/0).
+        size (int): Número de mensajes que se conservan por chat.
+        ttl (float): Segundos que se conserva un chat inactivo.
+    """
+
+  def __init__(self, url: str, size: int, ttl: float):
+    super().__init__(size)
+    try:
+      import redis.asyncio as redis
+    except ImportError:
+      raise ImportError(
+        "HISTORY_BACKEND=redis necesita el paquete 'redis' (pip install redis)")
+    self.ttl = int(ttl)
+    self._redis = redis.from_url(url, decode_responses=True)
+
+  def _key(self, chat_id) -> str:
+    return f"history:{chat_id}"
+
+  async def get(self, chat_id) -> List[str]:
+    return await self._redis.lrange(self._key(chat_id), 0, self.size - 1)
+
+  async def push(self, chat_id, text: str):
+    key = self._key(chat_id)
+    async with self._redis.pipeline(transaction=True) as pipe:
+      pipe.lpush(key, text)
+      pipe.ltrim(key, 0, self.size - 1)
+      if self.ttl > 0:
+        pipe.expire(key, self.ttl)
+      await pipe.execute()
+
+  async def close(self):
+    await self._redis.close()
+
+
+def create_conversation_store() -> ConversationStore:
+  # Crea el almacén de historial según HISTORY_BACKEND
+  if HISTORY_BACKEND == "memory":
+    return MemoryConversationStore(HISTORY_SIZE, HISTORY_MAX_CHATS,
+                                   HISTORY_TTL)
+  elif HISTORY_BACKEND == "sqlite":
+    return SQLiteConversationStore(HISTORY_SQLITE_PATH, HISTORY_SIZE,
+                                   HISTORY_TTL)
+  elif HISTORY_BACKEND == "redis":
+    return RedisConversationStore(REDIS_URL, HISTORY_SIZE, HISTORY_TTL)
+  else:
+    raise ValueError(f"Almacén de historial no válido: {HISTORY_BACKEND}")
+
+
+# Almacén compartido por todo el proceso
+conversation_store = create_conversation_store()
@@ -0,0 +1,61 @@
+from typing import Optional, Tuple
+import httpx
+from config import (HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE, HTTP_TIMEOUT,
+                    MEDIA_MAX_BYTES)
+from metrics import timed
+
+# Agente de usuario personalizado para evitar restricciones al descargar archivos
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:89.0) Gecko/20100101 Firefox/89.0"
+
+# Cliente HTTP asíncrono compartido, con conexiones persistentes reutilizables
+http_client = httpx.AsyncClient(
+  headers={"User-Agent": USER_AGENT},
+  limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                      max_keepalive_connections=HTTP_MAX_KEEPALIVE),
+  timeout=httpx.Timeout(HTTP_TIMEOUT),
+  follow_redirects=True,
+)
+
+# Tamaño de los fragmentos leídos durante una descarga
+CHUNK_SIZE = 64 * 1024
+
+
+class MediaTooLargeError(ValueError):
+  """El archivo a descargar supera el tamaño máximo permitido."""
+
+
+@timed("media_download")
+async def download_media(url: str,
+                         max_bytes: int = MEDIA_MAX_BYTES,
+                         auth: Optional[Tuple[str, str]] = None) -> bytes:
+  """
+    Descarga un archivo multimedia por fragmentos usando el cliente compartido.
+
+    Args:
+        url (str): URL del archivo (Telegram file_path o MediaUrl0 de Twilio).
+        max_bytes (int): Tamaño máximo aceptado.
+        auth (Tuple[str, str]): Credenciales HTTP básicas, si la URL las necesita.
+
+    Returns:
+        bytes: El contenido del archivo.
+
+    Raises:
+        MediaTooLargeError: Si el archivo supera max_bytes.
+        httpx.HTTPError: Si la descarga falla o se agota el tiempo.
+    """
+  async with http_client.stream("GET", url, auth=auth) as response:
+    response.raise_for_status()
+    declared = response.headers.get("Content-Length")
+    if declared is not None and declared.isdigit() and int(declared) > max_bytes:
+      raise MediaTooLargeError(f"{url} ocupa {declared} bytes")
+
+    buffer = bytearray()
+    async for chunk in response.aiter_bytes(CHUNK_SIZE):
+      buffer.extend(chunk)
+      if len(buffer) > max_bytes:
+        raise MediaTooLargeError(f"{url} supera {max_bytes} bytes")
+    return bytes(buffer)
+
+
+async def close_http_client():
+  await http_client.aclose()
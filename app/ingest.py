@@ -0,0 +1,203 @@
+import asyncio
+import time
+import traceback
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Hashable, List, Set, Tuple
+from config import (INGEST_QUEUE_SIZE, INGEST_WORKERS, INGEST_WEIGHTS,
+                    INGEST_TASK_CONCURRENCY)
+
+# Tipos de trabajo que reparte el planificador
+JOB_KINDS = ("text", "voice", "task")
+
+_Entry = Tuple[float, str, Callable[[], Awaitable]]
+
+
+class IngestQueue:
+  """
+    Cola acotada de mensajes entrantes con un actor por chat y reparto justo entre chats.
+
+    Los webhooks encolan el trabajo y responden de inmediato; si la cola está
+    llena, submit() devuelve False para que el webhook pida al remitente que
+    reintente más tarde.
+
+    Los trabajos de un mismo chat se ejecutan de uno en uno y en orden. Entre
+    chats, los workers se turnan por tipo de trabajo (texto, voz, /task) en
+    proporción a sus pesos y, dentro de cada tipo, por orden de llegada de los
+    chats, así que un chat muy activo o un /task largo no acaparan los workers.
+
+    Args:
+        maxsize (int): Trabajos pendientes como máximo.
+        workers (int): Número de workers (trabajos en ejecución a la vez).
+        weights (Dict[str, int]): Peso de cada tipo de trabajo en el reparto.
+        limits (Dict[str, int]): Trabajos de cada tipo en ejecución a la vez como máximo.
+    """
+
+  def __init__(self, maxsize: int, workers: int, weights: Dict[str, int],
+               limits: Dict[str, int]):
+    self.maxsize = maxsize
+    self.worker_count = workers
+    self.limits = {kind: limits.get(kind, workers) for kind in JOB_KINDS}
+    # Secuencia de turnos, p. ej. text, voice, text, task, text, voice, text
+    self._schedule = self._build_schedule(weights)
+    self._cursor = 0
+    self._chats: Dict[Hashable, Deque[_Entry]] = {}
+    self._ready: Dict[str, Deque[Hashable]] = {kind: deque() for kind in JOB_KINDS}
+    self._busy: Set[Hashable] = set()
+    self._running: Dict[str, int] = {kind: 0 for kind in JOB_KINDS}
+    self._pending = 0
+    self._reserved = 0
+    self._wakeup = asyncio.Event()
+    self._workers: List[asyncio.Task] = []
+    self.counters: Dict[str, float] = {
+      "enqueued": 0,
+      "rejected": 0,
+      "completed": 0,
+      "failed": 0,
+      "wait_seconds_total": 0.0,
+      "wait_seconds_max": 0.0,
+    }
+
+  @staticmethod
+  def _build_schedule(weights: Dict[str, int]) -> List[str]:
+    # Reparto ponderado suave: cada tipo aparece según su peso, intercalado con los demás
+    weights = {kind: max(1, weights.get(kind, 1)) for kind in JOB_KINDS}
+    credit = {kind: 0 for kind in JOB_KINDS}
+    schedule = []
+    for _ in range(sum(weights.values())):
+      for kind in JOB_KINDS:
+        credit[kind] += weights[kind]
+      kind = max(JOB_KINDS, key=lambda k: credit[k])
+      credit[kind] -= sum(weights.values())
+      schedule.append(kind)
+    return schedule
+
+  def _has_room(self) -> bool:
+    return self._pending + self._reserved < self.maxsize
+
+  def reserve(self) -> bool:
+    """
+      Aparta un hueco en la cola para un trabajo que se encolará más tarde.
+
+      Returns:
+          bool: True si se apartó el hueco, False si la cola está llena.
+      """
+    if not self._has_room():
+      self.counters["rejected"] += 1
+      return False
+    self._reserved += 1
+    return True
+
+  def submit(self,
+             job: Callable[[], Awaitable],
+             key: Hashable,
+             kind: str = "text",
+             reserved: bool = False) -> bool:
+    """
+      Encola un trabajo sin esperar.
+
+      Args:
+          job (Callable[[], Awaitable]): Función que crea la corrutina a ejecutar.
+          key (Hashable): Chat al que pertenece el trabajo.
+          kind (str): Tipo de trabajo: "text", "voice" o "task".
+          reserved (bool): Si el trabajo ocupa un hueco apartado antes con reserve().
+
+      Returns:
+          bool: True si se encoló, False si la cola está llena.
+      """
+    if reserved:
+      self._reserved -= 1
+    elif not self._has_room():
+      self.counters["rejected"] += 1
+      return False
+
+    if kind not in JOB_KINDS:
+      kind = "text"
+    chat_queue = self._chats.setdefault(key, deque())
+    chat_queue.append((time.monotonic(), kind, job))
+    self._pending += 1
+    self.counters["enqueued"] += 1
+    # Si el chat no está en ejecución ni esperando turno, pasa a esperar turno
+    if key not in self._busy and len(chat_queue) == 1:
+      self._ready[kind].append(key)
+      self._wakeup.set()
+    return True
+
+  def _pick(self):
+    for offset in range(len(self._schedule)):
+      kind = self._schedule[(self._cursor + offset) % len(self._schedule)]
+      if self._ready[kind] and self._running[kind] < self.limits[kind]:
+        self._cursor = (self._cursor + offset + 1) % len(self._schedule)
+        key = self._ready[kind].popleft()
+        enqueued_at, _, job = self._chats[key].popleft()
+        self._busy.add(key)
+        self._running[kind] += 1
+        self._pending -= 1
+        return key, kind, job, enqueued_at
+    return None
+
+  def _release(self, key: Hashable, kind: str):
+    self._busy.discard(key)
+    self._running[kind] -= 1
+    chat_queue = self._chats.get(key)
+    if chat_queue:
+      # El chat vuelve al final de la fila del tipo de su siguiente trabajo
+      self._ready[chat_queue[0][1]].append(key)
+    else:
+      self._chats.pop(key, None)
+    self._wakeup.set()
+
+  async def _work(self):
+    while True:
+      picked = self._pick()
+      if picked is None:
+        self._wakeup.clear()
+        await self._wakeup.wait()
+        continue
+
+      key, kind, job, enqueued_at = picked
+      waited = time.monotonic() - enqueued_at
+      self.counters["wait_seconds_total"] += waited
+      self.counters["wait_seconds_max"] = max(self.counters["wait_seconds_max"],
+                                              waited)
+      try:
+        # Cada trabajo corre en su propia tarea para que sus variables de contexto no pasen al siguiente
+        await asyncio.create_task(job())
+        self.counters["completed"] += 1
+      except Exception:
+        self.counters["failed"] += 1
+        traceback.print_exc()
+      finally:
+        self._release(key, kind)
+
+  def start(self):
+    # Arranca los workers; se llama desde el evento de inicio de la aplicación
+    if not self._workers:
+      self._workers = [
+        asyncio.create_task(self._work()) for _ in range(self.worker_count)
+      ]
+
+  async def stop(self):
+    for worker in self._workers:
+      worker.cancel()
+    await asyncio.gather(*self._workers, return_exceptions=True)
+    self._workers = []
+
+  def stats(self) -> Dict[str, float]:
+    stats = dict(self.counters)
+    stats["depth"] = self._pending
+    stats["reserved"] = self._reserved
+    stats["maxsize"] = self.maxsize
+    stats["workers"] = self.worker_count
+    stats["active_chats"] = len(self._chats)
+    for kind in JOB_KINDS:
+      stats[f"running_{kind}"] = self._running[kind]
+      stats[f"ready_{kind}"] = len(self._ready[kind])
+    started = self.counters["completed"] + self.counters["failed"]
+    stats["wait_seconds_avg"] = (self.counters["wait_seconds_total"] /
+                                 started if started else 0.0)
+    return stats
+
+
+# Cola compartida por los webhooks de Telegram y Twilio
+ingest_queue = IngestQueue(INGEST_QUEUE_SIZE, INGEST_WORKERS, INGEST_WEIGHTS,
+                           {"task": INGEST_TASK_CONCURRENCY})
@@ -0,0 +1,248 @@
+import json
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+from config import INTENT_CONFIDENCE_THRESHOLD, INTENT_LOG_PATH, INTENT_MIN_SAMPLES
+
+# Temas que entiende process_chat_message
+TOPICS = ("chat", "image", "calendar")
+
+# Palabras que devuelve la plantilla "topic" y el tema interno al que corresponden
+_TOPIC_ALIASES = {
+  "chat": "chat",
+  "chatear": "chat",
+  "imagen": "image",
+  "image": "image",
+  "calendario": "calendar",
+  "calendar": "calendar",
+}
+
+_IMAGE_WORDS = re.compile(
+  r"\b(imagen(es)?|foto(s|grafia)?|dibujo|ilustracion|retrato|logo|picture|image|photo|drawing)\b"
+)
+_DRAW_VERBS = re.compile(r"\b(dibuja(me|r)?|pinta(me|r)?|ilustra(me|r)?|draw)\b")
+_IMAGE_VERBS = re.compile(
+  r"\b(genera(me)?|crea(me)?|haz(me)?|muestra(me)?|ensena(me)?|dame|quiero|generate|create|make|show)\b"
+)
+_CALENDAR_WORDS = re.compile(
+  r"\b(calendario|agenda(r|me)?|evento|cita|reunion|recordatorio|recuerdame|calendar|meeting|appointment|schedule|remind)\b"
+)
+_CALENDAR_TIMES = re.compile(
+  r"\b(manana|hoy|pasado manana|lunes|martes|miercoles|jueves|viernes|sabado|domingo|a las \d{1,2}|\d{1,2}(:\d{2})?\s?(am|pm|h)|\d{1,2}[/-]\d{1,2}([/-]\d{2,4})?)\b"
+)
+# Solo cuenta como charla si el mensaje entero son saludos o agradecimientos: "hola,
+# ¿me dibujas un gato?" empieza con un saludo pero es una petición de imagen
+_SMALL_TALK = re.compile(
+  r"^\W*((hola|holi|buenas|buenos dias|buenas tardes|buenas noches|gracias|muchas gracias|ok|vale|adios|chao|hi|hello|hey|thanks|thank you|bye)\b\W*)+$"
+)
+
+
+def _normalize(text: str) -> str:
+  # Minúsculas y sin tildes para que las reglas no dependan de la ortografía
+  text = unicodedata.normalize("NFKD", text.lower())
+  return "".join(c for c in text if not unicodedata.combining(c)).strip()
+
+
+def normalize_topic(raw: str) -> str:
+  """
+    Convierte la respuesta del LLM a uno de los temas internos.
+
+    Args:
+        raw (str): Texto devuelto por la plantilla "topic" (p. ej. "Imagen.").
+
+    Returns:
+        str: "chat", "image" o "calendar".
+    """
+  words = re.findall(r"[a-z]+", _normalize(raw))
+  for word in words:
+    if word in _TOPIC_ALIASES:
+      return _TOPIC_ALIASES[word]
+  return "chat"
+
+
+def rule_intent(text: str) -> Tuple[str, float]:
+  """
+    Clasifica el mensaje con reglas de palabras clave.
+
+    Args:
+        text (str): Mensaje del usuario.
+
+    Returns:
+        Tuple[str, float]: El tema y la confianza de la regla (0 a 1).
+    """
+  normalized = _normalize(text)
+  if normalized.startswith("/image"):
+    return "image", 1.0
+
+  wants_image = _IMAGE_WORDS.search(normalized) is not None
+  wants_calendar = _CALENDAR_WORDS.search(normalized) is not None
+
+  if _DRAW_VERBS.search(normalized) and not wants_calendar:
+    return "image", 0.9
+  if wants_image and wants_calendar:
+    return "chat", 0.3
+  if wants_image:
+    if _IMAGE_VERBS.search(normalized):
+      return "image", 0.95
+    return "image", 0.6
+  if wants_calendar:
+    if _CALENDAR_TIMES.search(normalized):
+      return "calendar", 0.95
+    return "calendar", 0.6
+  if _SMALL_TALK.search(normalized):
+    return "chat", 0.95
+  # Ninguna regla aplica: "chat" es solo una suposición, por debajo del umbral para que
+  # decidan el clasificador o el LLM (y sus decisiones entrenen al clasificador)
+  return "chat", 0.5
+
+
+class NgramClassifier:
+  """
+    Clasificador Naive Bayes sobre n-gramas de caracteres y palabras.
+
+    Se entrena con las decisiones que ya tomó el LLM y puede seguir aprendiendo
+    en caliente con cada nueva decisión.
+    """
+
+  def __init__(self, ngram_range: Tuple[int, int] = (3, 5)):
+    self.ngram_range = ngram_range
+    self.doc_counts: Dict[str, int] = defaultdict(int)
+    self.feature_counts: Dict[str, Dict[str, int]] = defaultdict(
+      lambda: defaultdict(int))
+    self.total_features: Dict[str, int] = defaultdict(int)
+    self.vocabulary = set()
+    self.samples = 0
+    self._lock = threading.Lock()
+
+  def _features(self, text: str) -> List[str]:
+    normalized = _normalize(text)
+    features = re.findall(r"\w+", normalized)
+    padded = f" {normalized} "
+    low, high = self.ngram_range
+    for n in range(low, high + 1):
+      features.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+    return features
+
+  def learn(self, text: str, topic: str):
+    features = self._features(text)
+    with self._lock:
+      self.doc_counts[topic] += 1
+      self.samples += 1
+      for feature in features:
+        self.feature_counts[topic][feature] += 1
+        self.total_features[topic] += 1
+        self.vocabulary.add(feature)
+
+  def predict(self, text: str) -> Tuple[str, float]:
+    """
+      Devuelve el tema más probable y su probabilidad a posteriori.
+      """
+    features = self._features(text)
+    with self._lock:
+      vocabulary_size = len(self.vocabulary) + 1
+      scores = {}
+      for topic, docs in self.doc_counts.items():
+        counts = self.feature_counts[topic]
+        denominator = self.total_features[topic] + vocabulary_size
+        score = math.log(docs / self.samples)
+        for feature in features:
+          score += math.log((counts.get(feature, 0) + 1) / denominator)
+        scores[topic] = score
+    if not scores:
+      return "chat", 0.0
+    best = max(scores, key=scores.get)
+    total = sum(math.exp(score - scores[best]) for score in scores.values())
+    return best, 1.0 / total
+
+
+class IntentRouter:
+  """
+    Decide el tema de un mensaje localmente y solo recurre al LLM cuando no está seguro.
+
+    Args:
+        threshold (float): Confianza mínima para aceptar una decisión local.
+        log_path (str): Archivo JSONL donde se guardan las decisiones del LLM (opcional).
+        min_samples (int): Ejemplos necesarios antes de usar el clasificador de n-gramas.
+    """
+
+  def __init__(self,
+               threshold: float,
+               log_path: Optional[str] = None,
+               min_samples: int = 50):
+    self.threshold = threshold
+    self.log_path = log_path
+    self.min_samples = min_samples
+    self.classifier = NgramClassifier()
+    self.counters: Dict[str, int] = {"rules": 0, "classifier": 0, "llm": 0}
+    self.topic_counters: Dict[str, int] = {topic: 0 for topic in TOPICS}
+    self._log_lock = threading.Lock()
+    if log_path and os.path.exists(log_path):
+      self._load_log(log_path)
+
+  def _load_log(self, log_path: str):
+    with open(log_path, encoding="utf-8") as log_file:
+      for line in log_file:
+        try:
+          decision = json.loads(line)
+        except ValueError:
+          continue
+        if decision.get("topic") in TOPICS and decision.get("text"):
+          self.classifier.learn(decision["text"], decision["topic"])
+
+  def classify(self, text: str) -> Optional[str]:
+    """
+      Intenta decidir el tema sin llamar al LLM.
+
+      Args:
+          text (str): Mensaje del usuario.
+
+      Returns:
+          Optional[str]: El tema, o None si la confianza no llega al umbral.
+      """
+    topic, confidence = rule_intent(text)
+    if confidence >= self.threshold:
+      self._count("rules", topic)
+      return topic
+
+    if self.classifier.samples >= self.min_samples:
+      topic, confidence = self.classifier.predict(text)
+      if confidence >= self.threshold:
+        self._count("classifier", topic)
+        return topic
+
+    return None
+
+  def record(self, text: str, topic: str):
+    """
+      Registra una decisión tomada por el LLM para aprender de ella.
+
+      Args:
+          text (str): Mensaje del usuario.
+          topic (str): Tema decidido por el LLM.
+      """
+    self._count("llm", topic)
+    self.classifier.learn(text, topic)
+    if self.log_path:
+      line = json.dumps({"text": text, "topic": topic}, ensure_ascii=False)
+      with self._log_lock:
+        with open(self.log_path, "a", encoding="utf-8") as log_file:
+          log_file.write(line + "\n")
+
+  def _count(self, path: str, topic: str):
+    self.counters[path] += 1
+    self.topic_counters[topic] = self.topic_counters.get(topic, 0) + 1
+
+  def stats(self) -> Dict[str, int]:
+    stats = dict(self.counters)
+    stats.update({f"topic_{topic}": n for topic, n in self.topic_counters.items()})
+    stats["classifier_samples"] = self.classifier.samples
+    return stats
+
+
+# Enrutador compartido por todo el proceso
+intent_router = IntentRouter(INTENT_CONFIDENCE_THRESHOLD, INTENT_LOG_PATH,
+                             INTENT_MIN_SAMPLES)
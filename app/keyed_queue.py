@@ -0,0 +1,69 @@
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Hashable, Tuple
+
+
+class KeyedSerialQueue:
+  """
+    Cola de trabajos asíncronos que respeta el orden por clave.
+
+    Los trabajos con la misma clave (p. ej. el mismo chat) se ejecutan uno tras
+    otro en orden de llegada; los de claves distintas avanzan en paralelo. Cada
+    clave activa tiene su propia tarea, que termina cuando su cola se vacía.
+    """
+
+  def __init__(self):
+    self._queues: Dict[Hashable, Deque[Tuple[Callable[[], Awaitable],
+                                             asyncio.Future]]] = {}
+    self._workers: Dict[Hashable, asyncio.Task] = {}
+    self.pending = 0
+    self.completed = 0
+
+  def submit(self, key: Hashable,
+             job: Callable[[], Awaitable]) -> asyncio.Future:
+    """
+      Encola un trabajo para la clave dada.
+
+      Args:
+          key (Hashable): Clave que define el orden (p. ej. chat_id).
+          job (Callable[[], Awaitable]): Función que crea la corrutina a ejecutar.
+
+      Returns:
+          asyncio.Future: Se resuelve con el resultado del trabajo.
+      """
+    future = asyncio.get_running_loop().create_future()
+    queue = self._queues.setdefault(key, deque())
+    queue.append((job, future))
+    self.pending += 1
+    if key not in self._workers:
+      self._workers[key] = asyncio.create_task(self._drain(key))
+    return future
+
+  async def _drain(self, key: Hashable):
+    queue = self._queues[key]
+    try:
+      while queue:
+        job, future = queue.popleft()
+        self.pending -= 1
+        try:
+          result = await job()
+        except asyncio.CancelledError:
+          future.cancel()
+          raise
+        except Exception as e:
+          if not future.cancelled():
+            future.set_exception(e)
+        else:
+          if not future.cancelled():
+            future.set_result(result)
+        self.completed += 1
+    finally:
+      del self._queues[key]
+      del self._workers[key]
+
+  def active_keys(self) -> int:
+    return len(self._workers)
+
+  async def close(self):
+    for worker in list(self._workers.values()):
+      worker.cancel()
@@ -1,6 +1,34 @@
+# Se importa antes que el resto para que el informe de arranque mida la carga completa
+from startup import startup_report
+import asyncio
+from typing import Optional
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from telegram_handler import telegram_webhook
 from twilio_handler import twilio_api_reply
+from chains import get_chain_stats, preload_chains
+from config import (ACCOUNT_SID, AUTH_TOKEN, BABYAGI, WARMUP,
+                    ZAPIER_NLA_API_KEY, SELECTED_MODEL)
+from executor import llm_executor, io_executor
+from history import conversation_store
+from intent import intent_router
+from http_client import close_http_client
+from voice_handler import shutdown_audio_pool
+from twilio_sender import twilio_sender
+from telegram_sender import telegram_dispatcher
+from ingest import ingest_queue
+from dedup import deduplicator
+from coalesce import coalescer
+from chat_handler import speculation_stats
+from babyagi import session_manager
+from embeddings import embedding_service
+from vector_store import vector_store
+from metrics import registry
+from models import (get_openai, open_openai_session, close_openai_session,
+                    async_llm_stats)
+from utils import get_zapier_agent
+from prompt_builder import load_tokenizer, prompt_builder
+from response_cache import response_cache
 
 # Crea una instancia de la aplicación FastAPI
 app = FastAPI()
@@ -8,3 +36,99 @@ app = FastAPI()
 # Incluye los enrutadores para el webhook de Telegram y la respuesta API de Twilio
 app.include_router(telegram_webhook)
 app.include_router(twilio_api_reply)
+
+
+# Tarea de calentamiento en segundo plano, si está activa
+_warmup_task: Optional[asyncio.Task] = None
+
+
+def warmup_steps():
+  # Clientes que se inicializan en el primer uso y que conviene cargar antes del primer mensaje
+  steps = [("openai", get_openai), ("chains", preload_chains),
+           ("tokenizer", lambda: load_tokenizer(SELECTED_MODEL))]
+  if ACCOUNT_SID and AUTH_TOKEN:
+    steps.append(("twilio", lambda: twilio_sender.client))
+  if ZAPIER_NLA_API_KEY:
+    steps.append(("zapier", get_zapier_agent))
+  if BABYAGI:
+    steps.append(("vector_store", vector_store.connect))
+  return steps
+
+
+@app.on_event("startup")
+async def startup():
+  global _warmup_task
+  # Arranca los workers que procesan los mensajes encolados por los webhooks
+  ingest_queue.start()
+  startup_report.mark_ready()
+
+  # Las integraciones se cargan en su primer uso; el calentamiento las adelanta
+  # sin retrasar el arranque, mientras el servidor ya atiende peticiones
+  if WARMUP:
+    _warmup_task = asyncio.create_task(warm_up())
+
+
+async def warm_up():
+  await startup_report.warm_up(warmup_steps())
+  # openai ya está importado: la sesión HTTP de las llamadas asíncronas se crea sin bloquear
+  try:
+    await open_openai_session()
+  except Exception as e:
+    print(f"No se pudo crear la sesión HTTP de OpenAI: {e}")
+
+
+# Componentes que informan de su estado en /stats y /metrics
+STATS_SOURCES = {
+  "ingest": ingest_queue.stats,
+  "dedup": deduplicator.stats,
+  "coalesce": coalescer.stats,
+  "llm_executor": llm_executor.stats,
+  "io_executor": io_executor.stats,
+  "llm_async": lambda: dict(async_llm_stats),
+  "telegram_sender": telegram_dispatcher.stats,
+  "twilio_sender": twilio_sender.stats,
+  "babyagi": session_manager.stats,
+  "embeddings": embedding_service.stats,
+  "vector_store": vector_store.stats,
+  "prompt": prompt_builder.stats,
+  "chains": get_chain_stats,
+  "intent": intent_router.stats,
+  "speculation": lambda: dict(speculation_stats),
+  "response_cache": response_cache.stats,
+  "startup": startup_report.stats,
+}
+for component, source in STATS_SOURCES.items():
+  registry.register_stats(component, source)
+
+
+@app.get("/stats")
+async def stats():
+  # Estado de la cola de entrada y de los pools de ejecución
+  return {component: source() for component, source in STATS_SOURCES.items()}
+
+
+@app.get("/metrics")
+async def metrics():
+  # Latencia por etapa, tokens y estado de los componentes en formato Prometheus
+  return PlainTextResponse(registry.render(),
+                           media_type="text/plain; version=0.0.4")
+
+
+@app.on_event("shutdown")
+async def shutdown():
+  if _warmup_task is not None:
+    _warmup_task.cancel()
+  await ingest_queue.stop()
+  await session_manager.close()
+  await prompt_builder.close()
+  await conversation_store.close()
+  await deduplicator.close()
+  await twilio_sender.close()
+  await telegram_dispatcher.close()
+  await close_http_client()
+  await close_openai_session()
+
+  # Libera los hilos de los pools de ejecución
+  llm_executor.shutdown()
+  io_executor.shutdown()
+  shutdown_audio_pool()
@@ -0,0 +1,303 @@
+import bisect
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+from typing import (AsyncIterator, Callable, Dict, Iterator, List, Optional,
+                    Sequence, Tuple)
+
+# Métricas en formato de texto de Prometheus, sin dependencias externas.
+
+PREFIX = "chatbot_"
+
+# Límites de los cubos de latencia, en segundos
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0, 120.0)
+
+# Plataforma y tema del mensaje que se está procesando, para etiquetar las métricas de cada etapa
+current_platform: contextvars.ContextVar[str] = contextvars.ContextVar(
+  "current_platform", default="")
+current_topic: contextvars.ContextVar[str] = contextvars.ContextVar(
+  "current_topic", default="")
+
+
+def _escape(value: str) -> str:
+  return str(value).replace("\\", "\\\\").replace("\n",
+                                                  "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+  if not names:
+    return ""
+  pairs = ",".join(f'{name}="{_escape(value)}"'
+                   for name, value in zip(names, values))
+  return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+  if value == float("inf"):
+    return "+Inf"
+  return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+
+  def __init__(self, kind: str, name: str, documentation: str,
+               labelnames: Sequence[str]):
+    self.kind = kind
+    self.name = PREFIX + name
+    self.documentation = documentation
+    self.labelnames = tuple(labelnames)
+    self._lock = threading.Lock()
+
+  def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+    return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+  def _header(self) -> List[str]:
+    return [
+      f"# HELP {self.name} {self.documentation}",
+      f"# TYPE {self.name} {self.kind}",
+    ]
+
+
+class Counter(_Metric):
+  """
+    Contador que solo crece, con etiquetas.
+    """
+
+  def __init__(self, name: str, documentation: str,
+               labelnames: Sequence[str] = ()):
+    super().__init__("counter", name, documentation, labelnames)
+    self._values: Dict[Tuple[str, ...], float] = {}
+
+  def inc(self, amount: float = 1, **labels):
+    key = self._key(labels)
+    with self._lock:
+      self._values[key] = self._values.get(key, 0) + amount
+
+  def render(self) -> List[str]:
+    lines = self._header()
+    with self._lock:
+      for key, value in sorted(self._values.items()):
+        lines.append(
+          f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+        )
+    return lines
+
+
+class Histogram(_Metric):
+  """
+    Histograma acumulado por cubos, con etiquetas.
+
+    Args:
+        name (str): Nombre de la métrica (sin prefijo).
+        documentation (str): Descripción.
+        labelnames (Sequence[str]): Nombres de las etiquetas.
+        buckets (Sequence[float]): Límites superiores de los cubos.
+    """
+
+  def __init__(self,
+               name: str,
+               documentation: str,
+               labelnames: Sequence[str] = (),
+               buckets: Sequence[float] = LATENCY_BUCKETS):
+    super().__init__("histogram", name, documentation, labelnames)
+    self.buckets = tuple(sorted(buckets))
+    # Por cada combinación de etiquetas: cuentas por cubo, suma y número de observaciones
+    self._values: Dict[Tuple[str, ...], list] = {}
+
+  def observe(self, value: float, **labels):
+    key = self._key(labels)
+    index = bisect.bisect_left(self.buckets, value)
+    with self._lock:
+      data = self._values.get(key)
+      if data is None:
+        data = [[0] * len(self.buckets), 0.0, 0]
+        self._values[key] = data
+      if index < len(self.buckets):
+        data[0][index] += 1
+      data[1] += value
+      data[2] += 1
+
+  def render(self) -> List[str]:
+    lines = self._header()
+    names = self.labelnames + ("le", )
+    with self._lock:
+      for key, (counts, total, count) in sorted(self._values.items()):
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+          cumulative += bucket_count
+          lines.append(f"{self.name}_bucket"
+                       f"{_format_labels(names, key + (_format_value(bound), ))}"
+                       f" {cumulative}")
+        lines.append(f"{self.name}_bucket"
+                     f"{_format_labels(names, key + ('+Inf', ))} {count}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+    return lines
+
+
+class Registry:
+  """
+    Conjunto de métricas que se exponen en /metrics.
+
+    Además de las métricas propias, publica como gauges los valores numéricos de
+    los stats() de cada componente (colas, cachés, pools), leídos en cada petición.
+    """
+
+  def __init__(self):
+    self._metrics: List[_Metric] = []
+    self._stats: Dict[str, Callable[[], Dict]] = {}
+
+  def register(self, metric: _Metric) -> _Metric:
+    self._metrics.append(metric)
+    return metric
+
+  def register_stats(self, component: str, stats: Callable[[], Dict]):
+    self._stats[component] = stats
+
+  def _render_stats(self) -> List[str]:
+    lines = []
+    for component, stats in sorted(self._stats.items()):
+      try:
+        values = stats()
+      except Exception:
+        continue
+      for key, value in sorted(values.items()):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+          continue
+        name = f"{PREFIX}{component}_{key}".replace("-", "_")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {_format_value(value)}")
+    return lines
+
+  def render(self) -> str:
+    lines = []
+    for metric in self._metrics:
+      lines.extend(metric.render())
+    lines.extend(self._render_stats())
+    return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.register(
+  Histogram("stage_duration_seconds",
+            "Duración de cada etapa del procesamiento de un mensaje.",
+            ("stage", "platform", "topic", "model")))
+
+stage_errors = registry.register(
+  Counter("stage_errors_total", "Etapas que terminaron con una excepción.",
+          ("stage", "platform", "topic", "model")))
+
+llm_tokens = registry.register(
+  Counter(
+    "llm_tokens_total",
+    "Tokens enviados y recibidos del LLM (estimados cuando la API no los informa).",
+    ("model", "direction")))
+
+
+def _labels(stage: str, platform: Optional[str], topic: Optional[str],
+            model: str) -> Dict[str, str]:
+  return {
+    "stage": stage,
+    "platform": current_platform.get() if platform is None else platform,
+    "topic": current_topic.get() if topic is None else topic,
+    "model": model,
+  }
+
+
+@contextmanager
+def stage_timer(stage: str,
+                platform: Optional[str] = None,
+                topic: Optional[str] = None,
+                model: str = "") -> Iterator[None]:
+  """
+    Mide la duración de un bloque y la registra como la etapa indicada.
+
+    La plataforma y el tema se toman del mensaje en curso si no se indican.
+
+    Args:
+        stage (str): Nombre de la etapa, p. ej. "whisper" o "send".
+        platform (str): Plataforma del mensaje (opcional).
+        topic (str): Tema del mensaje (opcional).
+        model (str): Modelo usado en la etapa, si aplica.
+    """
+  labels = _labels(stage, platform, topic, model)
+  started = time.perf_counter()
+  try:
+    yield
+  except Exception:
+    stage_errors.inc(**labels)
+    raise
+  finally:
+    stage_seconds.observe(time.perf_counter() - started, **labels)
+
+
+async def timed_stream(chunks: AsyncIterator,
+                       stage: str,
+                       platform: Optional[str] = None,
+                       topic: Optional[str] = None,
+                       model: str = "") -> AsyncIterator:
+  """
+    Reenvía los elementos de un iterador asíncrono y registra como la etapa indicada
+    solo el tiempo que se espera a cada uno, sin contar lo que tarda quien los consume.
+
+    Args:
+        chunks (AsyncIterator): Iterador a medir.
+        stage (str): Nombre de la etapa, p. ej. "chat_stream".
+        platform (str): Plataforma del mensaje (opcional).
+        topic (str): Tema del mensaje (opcional).
+        model (str): Modelo usado en la etapa, si aplica.
+    """
+  labels = _labels(stage, platform, topic, model)
+  elapsed = 0.0
+  try:
+    while True:
+      started = time.perf_counter()
+      try:
+        chunk = await chunks.__anext__()
+      except StopAsyncIteration:
+        break
+      finally:
+        elapsed += time.perf_counter() - started
+      yield chunk
+  except Exception:
+    stage_errors.inc(**labels)
+    raise
+  finally:
+    stage_seconds.observe(elapsed, **labels)
+
+
+def timed(stage: str, platform: Optional[str] = None, model: str = ""):
+  """
+    Decorador que mide cada llamada a una función (normal o async) con stage_timer.
+    """
+
+  def decorator(func):
+    if inspect.iscoroutinefunction(func):
+
+      @functools.wraps(func)
+      async def async_wrapper(*args, **kwargs):
+        with stage_timer(stage, platform=platform, model=model):
+          return await func(*args, **kwargs)
+
+      return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+      with stage_timer(stage, platform=platform, model=model):
+        return func(*args, **kwargs)
+
+    return wrapper
+
+  return decorator
+
+
+def count_tokens(model: str, prompt_tokens: int, completion_tokens: int):
+  # Acumula los tokens de una llamada al LLM
+  llm_tokens.inc(prompt_tokens, model=model, direction="prompt")
+  llm_tokens.inc(completion_tokens, model=model, direction="completion")
@@ -1,9 +1,128 @@
-from langchain.chat_models import ChatOpenAI
-from config import TEMPERATURE_VALUE
-from langchain import OpenAI
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict
+from config import TEMPERATURE_VALUE, LLM_HTTP_POOL_SIZE, LLM_MAX_CONCURRENCY
+from executor import run_io, run_llm
+
+# openai y langchain tardan en importarse, así que se cargan en el primer uso
+# y no al arrancar el servidor
+
+_openai = None
+_openai_lock = threading.Lock()
+
+# Modelos ya inicializados, uno por nombre de modelo
+_models: Dict[str, object] = {}
+_models_lock = threading.Lock()
+
+# Sesión aiohttp compartida por las llamadas asíncronas (acreate); sin ella, openai
+# abre una sesión y una conexión TLS nuevas en cada llamada
+_aiosession = None
+
+# Las llamadas asíncronas no pasan por el pool del LLM, así que se limitan aparte
+# con el mismo número de llamadas simultáneas
+_async_slots = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+async_llm_stats: Dict[str, int] = {
+  "max_concurrency": LLM_MAX_CONCURRENCY,
+  "active": 0,
+  "waiting": 0,
+  "completed": 0,
+}
+
+
+def get_openai():
+  """
+    Devuelve el módulo openai, importándolo y configurándolo en el primer uso.
+
+    Las llamadas síncronas comparten una sesión HTTP con conexiones persistentes.
+
+    Returns:
+        El módulo openai.
+    """
+  global _openai
+  if _openai is None:
+    with _openai_lock:
+      if _openai is None:
+        import openai
+        import requests
+        from requests.adapters import HTTPAdapter
+        http_session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=LLM_HTTP_POOL_SIZE,
+                              pool_maxsize=LLM_HTTP_POOL_SIZE)
+        http_session.mount("https://", adapter)
+        http_session.mount("http://", adapter)
+        openai.requestssession = http_session
+        _openai = openai
+  return _openai
+
+
+async def load_openai():
+  # Como get_openai, pero la primera importación se hace en el pool para no bloquear el bucle de eventos
+  if _openai is not None:
+    return _openai
+  return await run_io(get_openai)
+
+
+def _get_aiosession():
+  # Se crea en el bucle de eventos; openai ya importó aiohttp al cargarse
+  global _aiosession
+  if _aiosession is None or _aiosession.closed:
+    import aiohttp
+    _aiosession = aiohttp.ClientSession(connector=aiohttp.TCPConnector(
+      limit=LLM_HTTP_POOL_SIZE))
+  return _aiosession
+
+
+async def open_openai_session():
+  # Carga openai y crea la sesión compartida por adelantado; sin hacerlo, se crea en el primer uso
+  await load_openai()
+  _get_aiosession()
+
+
+async def close_openai_session():
+  global _aiosession
+  if _aiosession is not None:
+    await _aiosession.close()
+    _aiosession = None
+
+
+@asynccontextmanager
+async def async_openai():
+  """
+    Da acceso a openai para una llamada asíncrona (acreate) con la sesión HTTP compartida.
+
+    Espera a que haya hueco si ya hay LLM_MAX_CONCURRENCY llamadas asíncronas en curso.
+
+    Yields:
+        El módulo openai.
+    """
+  openai = await load_openai()
+  async_llm_stats["waiting"] += 1
+  try:
+    await _async_slots.acquire()
+  finally:
+    async_llm_stats["waiting"] -= 1
+  async_llm_stats["active"] += 1
+  try:
+    # openai.aiosession es una ContextVar: se fija en el contexto de cada llamada
+    openai.aiosession.set(_get_aiosession())
+    yield openai
+  finally:
+    async_llm_stats["active"] -= 1
+    async_llm_stats["completed"] += 1
+    _async_slots.release()
+
+
+def is_chat_model(selected_model: str) -> bool:
+  # Los modelos de chat reciben el prompt como mensajes (sistema y usuario)
+  return selected_model in ('gpt-3.5-turbo', 'gpt-4')
 
 
 def initialize_language_model(selected_model):
+  # El cliente de LangChain usa openai, que se configura antes
+  get_openai()
+  from langchain import OpenAI
+  from langchain.chat_models import ChatOpenAI
   if selected_model == 'gpt-3':
     # Inicializa el modelo GPT-3 aquí
     return OpenAI(temperature=TEMPERATURE_VALUE)
@@ -16,3 +135,82 @@ def initialize_language_model(selected_model):
     return ChatOpenAI(model_name="gpt-4", temperature=TEMPERATURE_VALUE)
   else:
     raise ValueError(f"Invalid model selected: {selected_model}")
+
+
+def get_language_model(selected_model):
+  """
+    Devuelve el modelo de lenguaje compartido para el nombre dado, creándolo en el primer uso.
+
+    Args:
+        selected_model (str): Nombre del modelo (gpt-3, gpt-3.5-turbo, gpt-4).
+
+    Returns:
+        El cliente de LangChain para ese modelo.
+    """
+  model = _models.get(selected_model)
+  if model is None:
+    with _models_lock:
+      model = _models.get(selected_model)
+      if model is None:
+        model = initialize_language_model(selected_model)
+        _models[selected_model] = model
+  return model
+
+
+async def load_language_model(selected_model):
+  # Como get_language_model, pero el modelo se crea en el pool si aún no existe
+  model = _models.get(selected_model)
+  if model is not None:
+    return model
+  return await run_llm(get_language_model, selected_model)
+
+
+def estimate_tokens(text: str) -> int:
+  # Estimación aproximada de tokens: unos 4 caracteres por token en los modelos de OpenAI
+  return max(1, len(text) // 4) if text else 0
+
+
+# Rol de la API de chat para cada tipo de mensaje de LangChain
+MESSAGE_ROLES = {"system": "system", "human": "user", "ai": "assistant"}
+
+
+async def stream_completion(prompt, selected_model: str) -> AsyncIterator[str]:
+  """
+    Genera la respuesta del modelo a un prompt por fragmentos, a medida que llegan.
+
+    Usa el mismo modelo y los mismos parámetros que el cliente de LangChain para ese nombre.
+
+    Args:
+        prompt (PromptValue): Prompt ya formateado por la plantilla de la cadena.
+        selected_model (str): Nombre del modelo (gpt-3, gpt-3.5-turbo, gpt-4).
+
+    Yields:
+        str: Los fragmentos de texto en orden.
+    """
+  model = await load_language_model(selected_model)
+  from langchain.chat_models import ChatOpenAI
+  # La conexión queda ocupada hasta el último fragmento, así que el hueco se mantiene todo ese tiempo
+  async with async_openai() as openai:
+    if isinstance(model, ChatOpenAI):
+      response = await openai.ChatCompletion.acreate(
+        model=model.model_name,
+        messages=[{
+          "role": MESSAGE_ROLES.get(message.type, "user"),
+          "content": message.content
+        } for message in prompt.to_messages()],
+        temperature=model.temperature,
+        stream=True)
+      async for chunk in response:
+        content = chunk["choices"][0]["delta"].get("content")
+        if content:
+          yield content
+    else:
+      response = await openai.Completion.acreate(model=model.model_name,
+                                                 prompt=prompt.to_string(),
+                                                 temperature=model.temperature,
+                                                 max_tokens=model.max_tokens,
+                                                 stream=True)
+      async for chunk in response:
+        content = chunk["choices"][0].get("text")
+        if content:
+          yield content
@@ -0,0 +1,264 @@
+import asyncio
+import threading
+from typing import Dict, Hashable, List, Sequence
+from config import (SELECTED_MODEL, PROMPT_TOKEN_BUDGET, HISTORY_SUMMARY,
+                    HISTORY_SUMMARY_TOKENS, HISTORY_MAX_CHATS, HISTORY_TTL)
+from chains import load_chain
+from executor import run_io, run_llm
+from history import conversation_store
+from keyed_queue import KeyedSerialQueue
+from metrics import stage_timer
+from models import estimate_tokens
+from templates import get_template
+from ttl_cache import TTLCache
+
+# Ventana de contexto de cada modelo, en tokens
+MODEL_CONTEXT = {
+  "gpt-3": 4097,
+  "gpt-3.5-turbo": 4096,
+  "gpt-4": 8192,
+}
+
+# Modelo de OpenAI detrás de cada nombre del chatbot, para elegir la codificación de tokens
+OPENAI_MODELS = {"gpt-3": "text-davinci-003"}
+
+# Tokens de la ventana de contexto que se reservan para la respuesta
+RESPONSE_RESERVE = 512
+
+# Codificación de tokens de cada modelo; None si no se pudo cargar
+_encodings: Dict[str, object] = {}
+_encodings_lock = threading.Lock()
+# Carga en segundo plano de la codificación de cada modelo; se guarda la tarea para
+# que el recolector no la cancele y se quita al terminar
+_loading: Dict[str, asyncio.Future] = {}
+
+
+def load_tokenizer(model: str):
+  """
+    Carga la codificación de tokens del modelo con tiktoken (bloqueante).
+
+    tiktoken descarga sus tablas la primera vez; si no está instalado o falla, los
+    tokens se siguen estimando por número de caracteres.
+
+    Args:
+        model (str): Nombre del modelo.
+    """
+  with _encodings_lock:
+    if model in _encodings:
+      return
+    try:
+      import tiktoken
+      try:
+        encoding = tiktoken.encoding_for_model(OPENAI_MODELS.get(model, model))
+      except KeyError:
+        encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+      print(f"No se pudo cargar la codificación de tokens de {model}: {e}")
+      encoding = None
+    _encodings[model] = encoding
+
+
+def _encoding(model: str):
+  # La primera vez la codificación se carga en el pool; mientras tanto se estima
+  if model not in _encodings:
+    try:
+      asyncio.get_running_loop()
+    except RuntimeError:
+      load_tokenizer(model)
+    else:
+      if model not in _loading:
+        task = asyncio.ensure_future(run_io(load_tokenizer, model))
+        _loading[model] = task
+        task.add_done_callback(lambda _: _loading.pop(model, None))
+      return None
+  return _encodings.get(model)
+
+
+def token_count(text: str, model: str) -> int:
+  """
+    Cuenta los tokens de un texto para el modelo dado.
+
+    Args:
+        text (str): Texto a contar.
+        model (str): Nombre del modelo.
+
+    Returns:
+        int: Número de tokens (estimado si la codificación no está disponible).
+    """
+  encoding = _encoding(model)
+  if encoding is None:
+    return estimate_tokens(text)
+  return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int, model: str) -> str:
+  """
+    Recorta un texto para que no supere el número de tokens dado.
+
+    Args:
+        text (str): Texto a recortar.
+        max_tokens (int): Tokens como máximo.
+        model (str): Nombre del modelo.
+
+    Returns:
+        str: El texto, recortado por el final y terminado en "…" si no cabía.
+    """
+  encoding = _encoding(model)
+  if encoding is None:
+    if estimate_tokens(text) <= max_tokens:
+      return text
+    return text[:max_tokens * 4].rstrip() + "…"
+  tokens = encoding.encode(text, disallowed_special=())
+  if len(tokens) <= max_tokens:
+    return text
+  return encoding.decode(tokens[:max_tokens]).rstrip() + "…"
+
+
+def fit_items(items: Sequence[str], max_tokens: int, model: str) -> List[str]:
+  """
+    Devuelve los primeros elementos que caben juntos en el número de tokens dado.
+
+    Se detiene en el primero que no cabe, para no saltarse elementos intermedios.
+
+    Args:
+        items (Sequence[str]): Elementos en orden de prioridad.
+        max_tokens (int): Tokens disponibles.
+        model (str): Nombre del modelo.
+
+    Returns:
+        List[str]: Los elementos que caben, en el mismo orden.
+    """
+  kept = []
+  for item in items:
+    # Cada elemento va en su propia línea o separado por una coma
+    cost = token_count(item, model) + 1
+    if cost > max_tokens:
+      break
+    kept.append(item)
+    max_tokens -= cost
+  return kept
+
+
+class PromptBuilder:
+  """
+    Arma el historial de cada prompt dentro de un presupuesto de tokens.
+
+    El preámbulo fijo de la plantilla y el mensaje del usuario se envían siempre;
+    en lo que queda del presupuesto entran los mensajes más recientes del historial
+    y, si cabe, el resumen de los anteriores. Los mensajes que salen del historial
+    se pueden resumir en segundo plano, uno a uno sobre el resumen anterior del chat.
+
+    Args:
+        model (str): Nombre del modelo (gpt-3, gpt-3.5-turbo, gpt-4).
+        budget (int): Tokens de entrada como máximo por prompt.
+        summarize (bool): Si se resumen los mensajes que salen del historial.
+        summary_tokens (int): Tokens como máximo del resumen de cada chat.
+        max_chats (int): Chats cuyo resumen se conserva.
+        ttl (float): Segundos que se conserva el resumen de un chat inactivo.
+    """
+
+  def __init__(self, model: str, budget: int, summarize: bool,
+               summary_tokens: int, max_chats: int, ttl: float):
+    self.model = model
+    context = MODEL_CONTEXT.get(model, budget + RESPONSE_RESERVE)
+    self.budget = min(budget, context - RESPONSE_RESERVE)
+    self.summarize = summarize
+    self.summary_tokens = summary_tokens
+    self._summaries = TTLCache(max_chats, ttl)
+    self._queue = KeyedSerialQueue()
+    # Tokens del preámbulo y el resto de la plantilla, que no cambian entre turnos
+    self._template_tokens: Dict[str, int] = {}
+    self.counters: Dict[str, int] = {
+      "prompts": 0,
+      "history_tokens": 0,
+      "trimmed_messages": 0,
+      "summaries": 0,
+      "summary_failures": 0,
+    }
+
+  def _fixed_tokens(self, template_type: str) -> int:
+    tokens = self._template_tokens.get(template_type)
+    if tokens is None:
+      tokens = token_count(get_template(template_type), self.model)
+      # Solo se guarda el recuento exacto, no la estimación previa a cargar la codificación
+      if _encodings.get(self.model) is not None:
+        self._template_tokens[template_type] = tokens
+    return tokens
+
+  def history_string(self,
+                     chat_id: Hashable,
+                     messages: List[str],
+                     text: str,
+                     template_type: str = "chat") -> str:
+    """
+      Formatea el historial de un chat para que el prompt quepa en el presupuesto.
+
+      Args:
+          chat_id (Hashable): Identificador del chat.
+          messages (List[str]): Mensajes del historial, del más nuevo al más antiguo.
+          text (str): Mensaje actual del usuario.
+          template_type (str): Plantilla más larga en la que se usará el historial.
+
+      Returns:
+          str: El historial listo para la plantilla.
+      """
+    available = self.budget - self._fixed_tokens(template_type) - token_count(
+      text, self.model)
+    kept = fit_items(messages, available, self.model)
+    available -= sum(token_count(message, self.model) + 1 for message in kept)
+
+    summary_line = ""
+    summary = self._summaries.get(chat_id)
+    if summary:
+      line = f"Resumen de la conversación anterior: {summary}"
+      if token_count(line, self.model) <= available:
+        summary_line = "\n" + line
+
+    self.counters["prompts"] += 1
+    self.counters["trimmed_messages"] += len(messages) - len(kept)
+    history = summary_line + conversation_store.history_string(kept)
+    self.counters["history_tokens"] += token_count(history, self.model)
+    return history
+
+  def forget(self, chat_id: Hashable, message: str):
+    """
+      Avisa de que un mensaje sale del historial del chat, para añadirlo a su resumen.
+
+      Args:
+          chat_id (Hashable): Identificador del chat.
+          message (str): El mensaje que sale.
+      """
+    if self.summarize and message:
+      self._queue.submit(chat_id, lambda: self._fold(chat_id, message))
+
+  async def _fold(self, chat_id: Hashable, message: str):
+    # Resume el mensaje junto con el resumen anterior; un fallo deja el resumen como estaba
+    try:
+      chain = await load_chain("summary")
+      with stage_timer("history_summary", model=self.model):
+        summary = await run_llm(chain.predict,
+                                history=self._summaries.get(chat_id, ""),
+                                human_input=message)
+    except Exception as e:
+      self.counters["summary_failures"] += 1
+      print(f"Error al resumir el historial: {e}")
+      return
+    self._summaries.set(
+      chat_id, truncate_tokens(summary.strip(), self.summary_tokens,
+                               self.model))
+    self.counters["summaries"] += 1
+
+  def stats(self) -> Dict[str, int]:
+    stats = dict(self.counters)
+    stats["budget"] = self.budget
+    stats["summarized_chats"] = len(self._summaries)
+    stats["pending_summaries"] = self._queue.pending
+    return stats
+
+  async def close(self):
+    await self._queue.close()
+
+
+prompt_builder = PromptBuilder(SELECTED_MODEL, PROMPT_TOKEN_BUDGET,
+                               HISTORY_SUMMARY, HISTORY_SUMMARY_TOKENS,
+                               HISTORY_MAX_CHATS, HISTORY_TTL)
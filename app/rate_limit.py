@@ -0,0 +1,51 @@
+import asyncio
+import time
+from typing import Dict
+
+
+class TokenBucket:
+  """
+    Limitador de tasa de tipo cubeta de fichas.
+
+    Args:
+        rate (float): Fichas que se reponen por segundo.
+        capacity (float): Fichas máximas acumuladas (tamaño de la ráfaga permitida).
+    """
+
+  def __init__(self, rate: float, capacity: float):
+    self.rate = rate
+    self.capacity = capacity
+    self._tokens = capacity
+    self._updated = time.monotonic()
+    self._blocked_until = 0.0
+    self._lock = asyncio.Lock()
+    self.waits = 0
+
+  def _refill(self, now: float):
+    self._tokens = min(self.capacity,
+                       self._tokens + (now - self._updated) * self.rate)
+    self._updated = now
+
+  async def acquire(self, tokens: float = 1):
+    # El candado hace que los que esperan obtengan sus fichas en orden de llegada
+    async with self._lock:
+      while True:
+        now = time.monotonic()
+        if now < self._blocked_until:
+          self.waits += 1
+          await asyncio.sleep(self._blocked_until - now)
+          continue
+        self._refill(now)
+        if self._tokens >= tokens:
+          self._tokens -= tokens
+          return
+        self.waits += 1
+        await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+  def block_for(self, seconds: float):
+    # Detiene la cubeta, p. ej. cuando el servidor pide esperar (retry_after)
+    self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+    self._tokens = 0
+
+  def stats(self) -> Dict[str, float]:
+    return {"rate": self.rate, "waits": self.waits}
@@ -0,0 +1,147 @@
+import hashlib
+import re
+import unicodedata
+from typing import Any, Dict, Optional
+import numpy as np
+from config import (RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL,
+                    RESPONSE_CACHE_IMAGE_TTL, RESPONSE_CACHE_TEMPLATES,
+                    RESPONSE_CACHE_SIMILARITY)
+from embeddings import embedding_service
+from ttl_cache import TTLCache
+
+
+def normalize_text(text: str) -> str:
+  # Minúsculas, sin tildes, sin signos y con espacios compactados
+  text = unicodedata.normalize("NFKD", text.lower())
+  text = "".join(c for c in text if not unicodedata.combining(c))
+  text = re.sub(r"[^\w\s]", " ", text)
+  return re.sub(r"\s+", " ", text).strip()
+
+
+def _digest(*parts: str) -> str:
+  return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+  """
+    Caché de respuestas indexada por plantilla, historial y texto normalizados.
+
+    Opcionalmente, si no hay coincidencia exacta, busca una entrada con el mismo
+    historial cuyo texto sea semánticamente parecido (similitud coseno de embeddings).
+
+    Args:
+        maxsize (int): Número máximo de respuestas guardadas.
+        ttl (float): Segundos que vive cada respuesta.
+        templates (set): Plantillas que usan la caché (p. ej. {"chat", "image"}).
+        similarity_threshold (float): Similitud mínima para la búsqueda semántica (0 la desactiva).
+        template_ttls (dict): Segundos que vive cada respuesta de esas plantillas, si es menos que ttl.
+    """
+
+  def __init__(self,
+               maxsize: int,
+               ttl: float,
+               templates,
+               similarity_threshold: float,
+               template_ttls: Optional[Dict[str, float]] = None):
+    self.templates = set(templates)
+    self.ttl = ttl
+    self.template_ttls = template_ttls or {}
+    self.similarity_threshold = similarity_threshold
+    self._entries = TTLCache(maxsize, ttl)
+    self.counters: Dict[str, int] = {
+      "hits": 0,
+      "semantic_hits": 0,
+      "misses": 0,
+    }
+
+  def enabled(self, template: str) -> bool:
+    return template in self.templates
+
+  async def _embed(self, text: str) -> np.ndarray:
+    # El servicio de embeddings ya evita pedir dos veces el mismo texto entre get() y set()
+    vector = await embedding_service.embed(text)
+    return vector / (np.linalg.norm(vector) or 1.0)
+
+  async def get(self, template: str, text: str,
+                history_string: str) -> Optional[Any]:
+    """
+      Busca una respuesta guardada para el mensaje.
+
+      Args:
+          template (str): Tipo de plantilla ("chat", "image", ...).
+          text (str): Mensaje del usuario.
+          history_string (str): Historial de la conversación.
+
+      Returns:
+          La respuesta guardada, o None si no hay.
+      """
+    if not self.enabled(template):
+      return None
+    normalized = normalize_text(text)
+    history_key = _digest(normalize_text(history_string))
+    entry = self._entries.get(_digest(template, history_key, normalized))
+    if entry is not None:
+      self.counters["hits"] += 1
+      return entry["response"]
+
+    if self.similarity_threshold > 0 and normalized:
+      candidates = [
+        entry for _, entry in self._entries.items()
+        if entry["template"] == template and entry["history"] == history_key
+        and entry["vector"] is not None
+      ]
+      if candidates:
+        query = await self._embed(normalized)
+        scores = np.stack([entry["vector"] for entry in candidates]) @ query
+        best = int(np.argmax(scores))
+        if scores[best] >= self.similarity_threshold:
+          self.counters["semantic_hits"] += 1
+          return candidates[best]["response"]
+
+    self.counters["misses"] += 1
+    return None
+
+  async def set(self, template: str, text: str, history_string: str,
+                response: Any):
+    """
+      Guarda la respuesta generada para el mensaje.
+      """
+    if not self.enabled(template):
+      return
+    normalized = normalize_text(text)
+    history_key = _digest(normalize_text(history_string))
+    vector = None
+    if self.similarity_threshold > 0 and normalized:
+      vector = await self._embed(normalized)
+    entry = {
+      "template": template,
+      "history": history_key,
+      "vector": vector,
+      "response": response,
+    }
+    self._entries.set(_digest(template, history_key, normalized),
+                      entry,
+                      ttl=self._ttl(template))
+
+  def _ttl(self, template: str) -> float:
+    # La caducidad más corta entre la general y la de la plantilla (0 o negativo: sin caducidad)
+    ttl = self.template_ttls.get(template)
+    if ttl is None or ttl <= 0:
+      return self.ttl
+    if self.ttl <= 0:
+      return ttl
+    return min(ttl, self.ttl)
+
+  def stats(self) -> Dict[str, int]:
+    stats = dict(self.counters)
+    stats["size"] = len(self._entries)
+    stats["evictions"] = self._entries.evictions
+    return stats
+
+
+# Caché compartida por todo el proceso
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE,
+                               RESPONSE_CACHE_TTL,
+                               RESPONSE_CACHE_TEMPLATES,
+                               RESPONSE_CACHE_SIMILARITY,
+                               template_ttls={"image": RESPONSE_CACHE_IMAGE_TTL})
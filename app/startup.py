@@ -0,0 +1,61 @@
+import time
+import traceback
+from typing import Callable, Dict, List, Optional, Tuple
+from executor import run_io
+
+
+class StartupReport:
+  """
+    Tiempos del arranque del servidor y del calentamiento posterior.
+
+    El reloj empieza al importarse este módulo, que main importa antes que el resto.
+    """
+
+  def __init__(self):
+    self.started = time.perf_counter()
+    self.ready_seconds: Optional[float] = None
+    self.warmup_seconds: Optional[float] = None
+    self.steps: Dict[str, float] = {}
+    self.failed: List[str] = []
+
+  def mark_ready(self):
+    # Se llama al terminar el evento de inicio, cuando el servidor ya puede atender peticiones
+    self.ready_seconds = time.perf_counter() - self.started
+    print(f"Servidor listo en {self.ready_seconds:.2f} s")
+
+  async def warm_up(self, steps: List[Tuple[str, Callable[[], object]]]):
+    """
+      Ejecuta los pasos de calentamiento en orden en el pool de E/S.
+
+      Un paso que falla se anota y no impide los demás: ese cliente se volverá
+      a inicializar en su primer uso.
+
+      Args:
+          steps (List[Tuple[str, Callable]]): Nombre y función de cada paso.
+      """
+    started = time.perf_counter()
+    for name, step in steps:
+      step_started = time.perf_counter()
+      try:
+        await run_io(step)
+      except Exception:
+        self.failed.append(name)
+        traceback.print_exc()
+      self.steps[name] = time.perf_counter() - step_started
+    self.warmup_seconds = time.perf_counter() - started
+    print(f"Calentamiento completado en {self.warmup_seconds:.2f} s: " +
+          ", ".join(f"{name} {seconds:.2f} s"
+                    for name, seconds in self.steps.items()))
+
+  def stats(self) -> Dict:
+    stats = {
+      "ready_seconds": self.ready_seconds,
+      "warmup_seconds": self.warmup_seconds,
+      "warmup_failed": len(self.failed),
+    }
+    for name, seconds in self.steps.items():
+      stats[f"warmup_{name}_seconds"] = seconds
+    return stats
+
+
+startup_report = StartupReport()
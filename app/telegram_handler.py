@@ -1,80 +1,130 @@
-import os
 from fastapi import APIRouter, Request
-import httpx
-import telegram
+from fastapi.responses import JSONResponse
 from chat_handler import process_chat_message
 from voice_handler import process_voice_message
-from config import TELEGRAM_BOT_TOKEN, BABYAGI
+from config import TELEGRAM_BOT_TOKEN, BABYAGI, CHAT_STREAMING
 from babyagi import process_task
-
-BASE_URL = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}"
-client = httpx.AsyncClient()
-
-if TELEGRAM_BOT_TOKEN is not None:
-  bot = telegram.Bot(token=TELEGRAM_BOT_TOKEN)
-else:
-  bot = None
+from telegram_sender import telegram_dispatcher
+from ingest import ingest_queue
+from dedup import deduplicator
+from coalesce import coalescer
+from metrics import current_platform, timed
 
 telegram_webhook = APIRouter()
 
 
 @telegram_webhook.post("/webhook/")
+@timed("webhook", platform="telegram")
 async def handle_telegram_webhook(req: Request):
   """
-    Handle incoming text or voice messages from Telegram and generate appropriate responses.
+    Accept an incoming Telegram update and queue it for processing.
 
     Args:
         req (Request): Incoming request containing message data.
 
     Returns:
-        dict: The generated response as a text message or a photo with a caption, depending on the type of output.
+        dict: An acknowledgement, or a 503 response when the queue is full so Telegram retries later.
     """
-  if bot is None:
+  if TELEGRAM_BOT_TOKEN is None:
     return {
       "message":
       "Telegram bot token is not configured. Please set the TELEGRAM_BOT_TOKEN environment variable."
     }
 
   data = await req.json()
+  if 'message' not in data:
+    # Ignore updates without a message (edits, callbacks, etc.)
+    return {"ok": True}
+
+  # Telegram redelivers the same update_id when a delivery fails; process it only once
+  update_key = f"telegram:{data.get('update_id')}"
+  if 'update_id' in data and not await deduplicator.first_seen(update_key):
+    return {"ok": True}
+
+  message = data['message']
+  chat_id = message['chat']['id']
+  is_voice = bool(message.get('voice'))
+  is_text = not is_voice and bool(message.get('text'))
+  if not is_voice and not is_text:
+    # Stickers, photos and other updates without text or voice get no answer
+    return {"ok": True}
+  if coalescer.enabled and is_text and not BABYAGI:
+    # Short text bursts from the same chat are merged into a single turn
+    accepted = coalescer.add(chat_id, message['text'],
+                             lambda text: answer_telegram_text(chat_id, text))
+  else:
+    coalescer.flush(chat_id)
+    if is_voice:
+      kind = "voice"
+    elif BABYAGI and message['text'].startswith("/task"):
+      kind = "task"
+    else:
+      kind = "text"
+    accepted = ingest_queue.submit(lambda: process_telegram_update(data),
+                                   key=chat_id,
+                                   kind=kind)
+
+  if not accepted:
+    if 'update_id' in data:
+      await deduplicator.forget(update_key)
+    return JSONResponse({"ok": False, "message": "Server busy"},
+                        status_code=503,
+                        headers={"Retry-After": "5"})
+  return {"ok": True}
+
+
+async def process_telegram_update(data: dict):
+  """
+    Handle incoming text or voice messages from Telegram and send the appropriate responses.
+
+    Args:
+        data (dict): The Telegram update.
+    """
+  current_platform.set("telegram")
   chat_id = data['message']['chat']['id']
   text = data['message'].get('text', '')
   voice = data['message'].get('voice', None)
   print(text)
 
   if voice:
-    # Process voice messages
-    voice_file_id = voice['file_id']
-    voice_file_info = await bot.get_file(voice_file_id)
-    voice_url = voice_file_info.file_path
+    # Process voice messages; the file URL is only requested if the transcription is not cached
+    async def get_voice_url():
+      return await telegram_dispatcher.get_file_url(voice['file_id'])
 
-    output = await process_voice_message(voice_url, chat_id)
+    output = await process_voice_message(get_voice_url,
+                                         chat_id,
+                                         audio_key=voice.get('file_unique_id'))
+  elif BABYAGI:
+    # Process text messages
+    if data["message"].get("entities") is not None:
+      if text[0:5] == "/task":
+        task = text[5:]
+        print(task)
+        await process_task(task, chat_id=chat_id, platform='telegram')
+    return
   else:
-    if BABYAGI:
-      # Process text messages
-      if data["message"].get("entities") is not None:
-        if text[0:5] == "/task":
-          is_task = True
-          task = text[5:]
-          print(task)
-          await process_task(
-            task,
-            chat_id=chat_id,
-            platform='telegram',
-            client=client,
-            base_url=BASE_URL,
-          )
-          return {"message": task}
-    else:
-      output = await process_chat_message(text, chat_id)
-
-      # Send the output as a text message or a photo with a caption, depending on the type of output
-      if isinstance(output, tuple):
-        summary, image = output
-        await bot.send_photo(chat_id, image)
-        await client.get(
-          f"{BASE_URL}/sendMessage?chat_id={chat_id}&text={summary}")
-      else:
-        await client.get(
-          f"{BASE_URL}/sendMessage?chat_id={chat_id}&text={output}")
-
-      return {"message": output}
+    await answer_telegram_text(chat_id, text)
+    return
+
+  await send_telegram_output(chat_id, output)
+
+
+async def answer_telegram_text(chat_id: int, text: str):
+  # Generate and send the answer to a text message; in streaming mode chat answers are shown as they are generated
+  current_platform.set("telegram")
+  deliver = None
+  if CHAT_STREAMING:
+    deliver = lambda chunks: telegram_dispatcher.stream_message(chat_id, chunks)
+  output = await process_chat_message(text, chat_id, deliver=deliver)
+  if output is not None:
+    await send_telegram_output(chat_id, output)
+
+
+async def send_telegram_output(chat_id: int, output):
+  # Send the output as a text message or a photo with a caption, depending on the type of output
+  if isinstance(output, tuple):
+    summary, image = output
+    await telegram_dispatcher.send_photo(chat_id, image)
+    await telegram_dispatcher.send_message(chat_id, summary)
+  else:
+    await telegram_dispatcher.send_message(chat_id, output)
@@ -0,0 +1,297 @@
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Optional
+import httpx
+from config import (TELEGRAM_BOT_TOKEN, TELEGRAM_GLOBAL_RATE,
+                    TELEGRAM_CHAT_RATE, TELEGRAM_SEND_RETRIES,
+                    TELEGRAM_EDIT_INTERVAL, TELEGRAM_API_BASE)
+from http_client import http_client
+from keyed_queue import KeyedSerialQueue
+from metrics import stage_timer
+from rate_limit import TokenBucket
+from ttl_cache import TTLCache
+
+BASE_URL = f"{TELEGRAM_API_BASE}/bot{TELEGRAM_BOT_TOKEN}"
+FILE_BASE_URL = f"{TELEGRAM_API_BASE}/file/bot{TELEGRAM_BOT_TOKEN}"
+
+# Longitud máxima de un mensaje de texto de Telegram
+MAX_MESSAGE_LENGTH = 4096
+
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+  """
+    Parte un texto largo en trozos que Telegram acepta, cortando preferentemente entre párrafos, líneas o palabras.
+
+    Args:
+        text (str): Texto a enviar.
+        limit (int): Longitud máxima de cada trozo.
+
+    Returns:
+        List[str]: Los trozos en orden.
+    """
+  chunks = []
+  while len(text) > limit:
+    cut = -1
+    for separator in ("\n\n", "\n", " "):
+      cut = text.rfind(separator, 0, limit)
+      if cut > 0:
+        break
+    if cut <= 0:
+      cut = limit
+    chunks.append(text[:cut])
+    text = text[cut:].lstrip()
+  if text:
+    chunks.append(text)
+  return chunks
+
+
+class TelegramAPIError(Exception):
+  """La API de bots de Telegram rechazó una petición."""
+
+
+class TelegramDispatcher:
+  """
+    Envía mensajes a Telegram respetando sus límites de envío.
+
+    Las peticiones se hacen por POST con JSON sobre el cliente HTTP compartido,
+    en orden por chat, con un límite global y otro por chat (cubetas de fichas),
+    y se reintentan respetando el retry_after de las respuestas 429.
+
+    Args:
+        base_url (str): URL de la API del bot (https://api.telegram.org/bot<token>).
+        file_base_url (str): URL de descarga de archivos (https://api.telegram.org/file/bot<token>).
+        global_rate (float): Mensajes por segundo para todo el bot.
+        chat_rate (float): Mensajes por segundo para cada chat.
+        retries (int): Reintentos ante errores transitorios.
+    """
+
+  def __init__(self, base_url: str, file_base_url: str, global_rate: float,
+               chat_rate: float, retries: int):
+    self.base_url = base_url
+    self.file_base_url = file_base_url
+    self.chat_rate = chat_rate
+    self.retries = retries
+    self._global_bucket = TokenBucket(global_rate, global_rate)
+    # Cubetas de los chats activos; las de chats inactivos caducan solas
+    self._chat_buckets = TTLCache(100000, 60)
+    self._queue = KeyedSerialQueue()
+    self.counters: Dict[str, int] = {
+      "sent": 0,
+      "edits": 0,
+      "chunks": 0,
+      "rate_limited": 0,
+      "retries": 0,
+      "failed": 0,
+    }
+
+  def _chat_bucket(self, chat_id) -> TokenBucket:
+    bucket = self._chat_buckets.get(chat_id)
+    if bucket is None:
+      # Se permite una pequeña ráfaga para que los trozos de un mensaje largo salgan seguidos
+      bucket = TokenBucket(self.chat_rate, 3)
+    # Se reinserta para renovar su caducidad mientras el chat siga activo
+    self._chat_buckets.set(chat_id, bucket)
+    return bucket
+
+  async def call(self, method: str, payload: Dict[str, Any]) -> Any:
+    """
+      Llama a un método de la API de bots respetando los límites de envío.
+
+      Args:
+          method (str): Método de la API, p. ej. "sendMessage".
+          payload (Dict[str, Any]): Parámetros; debe incluir chat_id.
+
+      Returns:
+          El campo "result" de la respuesta.
+
+      Raises:
+          TelegramAPIError: Si Telegram rechaza la petición tras los reintentos.
+      """
+    chat_bucket = self._chat_bucket(payload["chat_id"])
+    for attempt in range(self.retries + 1):
+      await chat_bucket.acquire()
+      await self._global_bucket.acquire()
+      try:
+        with stage_timer("send", platform="telegram"):
+          response = await http_client.post(f"{self.base_url}/{method}",
+                                            json=payload)
+        data = response.json()
+      except (httpx.HTTPError, ValueError) as e:
+        if attempt == self.retries:
+          raise TelegramAPIError(f"{method}: {e}")
+        self.counters["retries"] += 1
+        await asyncio.sleep(0.5 * 2**attempt)
+        continue
+
+      if data.get("ok"):
+        return data.get("result")
+
+      if response.status_code == 429:
+        # Telegram indica cuántos segundos hay que esperar antes de reintentar
+        self.counters["rate_limited"] += 1
+        retry_after = data.get("parameters", {}).get("retry_after", 1)
+        chat_bucket.block_for(retry_after)
+      elif response.status_code < 500 or attempt == self.retries:
+        raise TelegramAPIError(f"{method}: {data.get('description')}")
+      else:
+        await asyncio.sleep(0.5 * 2**attempt)
+      self.counters["retries"] += 1
+    raise TelegramAPIError(f"{method}: demasiados reintentos")
+
+  async def get_file_url(self, file_id: str) -> str:
+    """
+      Obtiene la URL de descarga de un archivo recibido, p. ej. una nota de voz.
+
+      getFile no cuenta para los límites de envío, así que no pasa por las cubetas.
+
+      Args:
+          file_id (str): Identificador del archivo en el mensaje.
+
+      Returns:
+          str: URL desde la que descargar el archivo.
+
+      Raises:
+          TelegramAPIError: Si Telegram rechaza la petición.
+      """
+    response = await http_client.post(f"{self.base_url}/getFile",
+                                      json={"file_id": file_id})
+    data = response.json()
+    if not data.get("ok"):
+      raise TelegramAPIError(f"getFile: {data.get('description')}")
+    return f"{self.file_base_url}/{data['result']['file_path']}"
+
+  async def _send(self, method: str, payload: Dict[str, Any]) -> bool:
+    try:
+      await self.call(method, payload)
+      self.counters["sent"] += 1
+      return True
+    except TelegramAPIError as e:
+      self.counters["failed"] += 1
+      print(f"Error al enviar el mensaje: {e}")
+      return False
+
+  def send_message(self, chat_id, text: str) -> asyncio.Future:
+    """
+      Encola un mensaje de texto, partiéndolo si supera la longitud máxima.
+
+      Args:
+          chat_id: Identificador del chat.
+          text (str): Texto del mensaje.
+
+      Returns:
+          asyncio.Future: Se resuelve con True si todos los trozos se enviaron.
+      """
+    chunks = split_message(str(text))
+    self.counters["chunks"] += len(chunks)
+
+    async def send_chunks():
+      sent = True
+      for chunk in chunks:
+        sent = await self._send("sendMessage", {
+          "chat_id": chat_id,
+          "text": chunk
+        }) and sent
+      return sent
+
+    return self._queue.submit(chat_id, send_chunks)
+
+  def stream_message(self,
+                     chat_id,
+                     chunks: AsyncIterator[str],
+                     edit_interval: float = TELEGRAM_EDIT_INTERVAL
+                     ) -> asyncio.Future:
+    """
+      Encola un mensaje que se muestra a medida que llega su texto.
+
+      El primer fragmento se envía con sendMessage y el resto se añade con
+      editMessageText, como mucho una edición cada edit_interval segundos. Si el
+      texto supera la longitud máxima, continúa en un mensaje nuevo.
+
+      Args:
+          chat_id: Identificador del chat.
+          chunks (AsyncIterator[str]): Fragmentos del texto en orden.
+          edit_interval (float): Segundos mínimos entre dos ediciones.
+
+      Returns:
+          asyncio.Future: Se resuelve con el texto completo recibido.
+      """
+    return self._queue.submit(
+      chat_id, lambda: self._stream(chat_id, chunks, edit_interval))
+
+  async def _show(self, chat_id, message_id: Optional[int],
+                  text: str) -> Optional[int]:
+    # Envía el texto como mensaje nuevo o reemplaza el del mensaje ya enviado
+    try:
+      if message_id is None:
+        result = await self.call("sendMessage", {
+          "chat_id": chat_id,
+          "text": text
+        })
+        self.counters["sent"] += 1
+        self.counters["chunks"] += 1
+        return result["message_id"]
+      await self.call("editMessageText", {
+        "chat_id": chat_id,
+        "message_id": message_id,
+        "text": text
+      })
+      self.counters["edits"] += 1
+    except TelegramAPIError as e:
+      self.counters["failed"] += 1
+      print(f"Error al enviar el mensaje: {e}")
+    return message_id
+
+  async def _stream(self, chat_id, chunks: AsyncIterator[str],
+                    edit_interval: float) -> str:
+    loop = asyncio.get_running_loop()
+    parts = []
+    # Texto del mensaje actual, lo que ya muestra Telegram y cuándo se editó por última vez
+    text, shown, message_id, last_update = "", "", None, 0.0
+    async for chunk in chunks:
+      parts.append(chunk)
+      text += chunk
+      if len(text) > MAX_MESSAGE_LENGTH:
+        # Se cierra el mensaje actual con el texto que cabe y se sigue en otro
+        pieces = split_message(text, MAX_MESSAGE_LENGTH)
+        for piece in pieces[:-1]:
+          await self._show(chat_id, message_id, piece)
+          message_id = None
+        text, shown = pieces[-1], ""
+      if (text.strip() and text != shown
+          and loop.time() - last_update >= edit_interval):
+        message_id = await self._show(chat_id, message_id, text)
+        shown, last_update = text, loop.time()
+    if text.strip() and text != shown:
+      await self._show(chat_id, message_id, text)
+    return "".join(parts)
+
+  def send_photo(self,
+                 chat_id,
+                 photo_url: str,
+                 caption: Optional[str] = None) -> asyncio.Future:
+    """
+      Encola una foto a partir de su URL.
+
+      Returns:
+          asyncio.Future: Se resuelve con True si la foto se envió.
+      """
+    payload = {"chat_id": chat_id, "photo": photo_url}
+    if caption:
+      payload["caption"] = caption
+    return self._queue.submit(chat_id,
+                              lambda: self._send("sendPhoto", payload))
+
+  def stats(self) -> Dict[str, int]:
+    stats = dict(self.counters)
+    stats["pending"] = self._queue.pending
+    stats["active_chats"] = self._queue.active_keys()
+    return stats
+
+  async def close(self):
+    await self._queue.close()
+
+
+# Despachador compartido por todo el proceso
+telegram_dispatcher = TelegramDispatcher(BASE_URL, FILE_BASE_URL,
+                                         TELEGRAM_GLOBAL_RATE,
+                                         TELEGRAM_CHAT_RATE,
+                                         TELEGRAM_SEND_RETRIES)
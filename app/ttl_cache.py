@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+class TTLCache:
+  """
+    Caché en memoria con expulsión LRU y caducidad por tiempo.
+
+    Args:
+        maxsize (int): Número máximo de entradas; al superarlo se expulsa la menos usada.
+        ttl (float): Segundos que vive cada entrada (0 o negativo: sin caducidad).
+    """
+
+  def __init__(self, maxsize: int, ttl: float = 0):
+    self.maxsize = maxsize
+    self.ttl = ttl
+    self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def get(self, key: Hashable, default: Any = None) -> Any:
+    with self._lock:
+      entry = self._data.get(key)
+      if entry is None:
+        self.misses += 1
+        return default
+      value, expires_at = entry
+      if expires_at and expires_at < time.monotonic():
+        del self._data[key]
+        self.misses += 1
+        return default
+      self._data.move_to_end(key)
+      self.hits += 1
+      return value
+
+  def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+    with self._lock:
+      self._set(key, value, ttl)
+
+  def _set(self, key: Hashable, value: Any, ttl: Optional[float]):
+    ttl = self.ttl if ttl is None else ttl
+    expires_at = time.monotonic() + ttl if ttl and ttl > 0 else 0
+    self._data[key] = (value, expires_at)
+    self._data.move_to_end(key)
+    while len(self._data) > self.maxsize:
+      self._data.popitem(last=False)
+      self.evictions += 1
+
+  def add(self, key: Hashable, value: Any = True) -> bool:
+    """
+      Inserta la clave solo si no existe (o ha caducado).
+
+      Returns:
+          bool: True si se insertó, False si ya estaba presente.
+      """
+    with self._lock:
+      entry = self._data.get(key)
+      if entry is not None and not (entry[1] and entry[1] < time.monotonic()):
+        self._data.move_to_end(key)
+        return False
+      self._set(key, value, None)
+      return True
+
+  def pop(self, key: Hashable, default: Any = None) -> Any:
+    with self._lock:
+      entry = self._data.pop(key, None)
+    return default if entry is None else entry[0]
+
+  def items(self):
+    # Copia de las entradas vigentes, de la menos a la más usada
+    now = time.monotonic()
+    with self._lock:
+      return [(key, value) for key, (value, expires_at) in self._data.items()
+              if not expires_at or expires_at >= now]
+
+  def __contains__(self, key: Hashable) -> bool:
+    with self._lock:
+      entry = self._data.get(key)
+      return entry is not None and not (entry[1]
+                                        and entry[1] < time.monotonic())
+
+  def __len__(self) -> int:
+    return len(self._data)
+
+  def clear(self):
+    with self._lock:
+      self._data.clear()
+
+  def stats(self) -> Dict[str, int]:
+    return {
+      "size": len(self._data),
+      "hits": self.hits,
+      "misses": self.misses,
+      "evictions": self.evictions,
+    }
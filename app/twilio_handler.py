@@ -1,15 +1,23 @@
-import asyncio
 from fastapi import APIRouter, Form, Response, Request
-from twilio.twiml.messaging_response import MessagingResponse
-from twilio.rest import Client
-from twilio.base.exceptions import TwilioException
 from chat_handler import process_chat_message
 from voice_handler import process_voice_message
-from config import BABYAGI, ACCOUNT_SID, AUTH_TOKEN, TWILIO_WHATSAPP_NUMBER, FACEBOOK_PAGE_ID
+from config import BABYAGI, ACCOUNT_SID, AUTH_TOKEN, TWILIO_WHATSAPP_NUMBER, FACEBOOK_PAGE_ID, CHAT_STREAMING
 from babyagi import process_task
+from twilio_sender import twilio_sender, get_twilio_sender_number
+from ingest import ingest_queue
+from dedup import deduplicator
+from coalesce import coalescer
+from metrics import current_platform, timed
 
 twilio_api_reply = APIRouter()
 
+# Respuesta TwiML vacía: Twilio no envía nada más, las respuestas salen por la API
+EMPTY_TWIML = '<?xml version="1.0" encoding="UTF-8"?><Response />'
+# Respuesta TwiML cuando la cola está llena: avisa al usuario de que reenvíe el mensaje
+BUSY_TWIML = ('<?xml version="1.0" encoding="UTF-8"?><Response><Message>'
+              'Estoy recibiendo muchos mensajes ahora mismo. Por favor, '
+              'vuelve a enviarlo en unos minutos.</Message></Response>')
+
 
 # Procesa un mensaje de chat o voz entrante y envía una respuesta utilizando Twilio.
 async def send_twilio_response(chat_id: str,
@@ -25,87 +33,52 @@ async def send_twilio_response(chat_id: str,
         is_voice (bool): Si el mensaje de entrada es un mensaje de voz (True) o un mensaje de texto (False). El valor predeterminado es False.
     """
 
-  if platform not in ("whatsapp", "messenger"):
-    raise ValueError(
-      "Plataforma no válida especificada. Las plataformas válidas son 'whatsapp' y 'messenger'."
-    )
-
-  if platform == "whatsapp" and not TWILIO_WHATSAPP_NUMBER:
-    print(
-      "Número de WhatsApp de Twilio no configurado. Por favor, establezca la variable de entorno TWILIO_WHATSAPP_NUMBER."
-    )
-    return
-  elif platform == "messenger" and not FACEBOOK_PAGE_ID:
-    print(
-      "ID de página de Facebook no configurado. Por favor, establezca la variable de entorno FACEBOOK_PAGE_ID."
-    )
+  current_platform.set(platform)
+  twilio_phone_number = get_twilio_sender_number(platform)
+  if twilio_phone_number is None:
     return
 
-  if platform == "messenger":
-    twilio_phone_number = f'messenger:{FACEBOOK_PAGE_ID}'
-  else:
-    twilio_phone_number = f'whatsapp:{TWILIO_WHATSAPP_NUMBER}'
-
   # Rest of the function remains unchanged
   if is_voice:
     # Procesa mensajes de voz
-    output = await process_voice_message(message, chat_id)
+    # Los archivos de Twilio pueden requerir autenticación HTTP básica
+    auth = (ACCOUNT_SID, AUTH_TOKEN) if ACCOUNT_SID else None
+    # El SID del medio (último segmento de la URL) identifica el audio
+    media_sid = message.rstrip("/").rsplit("/", 1)[-1]
+    output = await process_voice_message(message,
+                                         chat_id,
+                                         auth=auth,
+                                         audio_key=media_sid)
   elif BABYAGI and message.startswith("/task"):
     if BABYAGI:
       # Procesa mensajes de texto
       task = message[5:]
-      await process_task(task,
-                         chat_id=chat_id,
-                         platform='twilio',
-                         client=None,
-                         base_url=None)
+      await process_task(task, chat_id=chat_id, platform='twilio')
       output = task
   else:
-    output = await process_chat_message(message, chat_id)
-
-  # Inicializa la respuesta de Twilio
-  resp = MessagingResponse()
+    # En modo streaming las respuestas de chat se envían por párrafos a medida que se generan
+    deliver = None
+    if CHAT_STREAMING:
+      deliver = lambda chunks: twilio_sender.send_stream(
+        chat_id, chunks, twilio_phone_number)
+    output = await process_chat_message(message, chat_id, deliver=deliver)
+    if output is None:
+      return
 
   # Envía el resultado como un mensaje de texto o una foto con una leyenda, dependiendo del tipo de resultado
   if isinstance(output, tuple):
     summary, image = output
-    response_msg = resp.message(summary)
-    response_msg.media(image)
+    await twilio_sender.send(chat_id,
+                             summary,
+                             twilio_phone_number,
+                             media_url=image)
   else:
-    response_msg = resp.message(output)
-
-  # Envía el mensaje utilizando el cliente de Twilio
-  from twilio.rest import Client
-  account_sid = ACCOUNT_SID
-  auth_token = AUTH_TOKEN
-  client = Client(account_sid, auth_token)
-
-  if is_voice:
-    if isinstance(output, tuple):
-      summary, image = output
-      client.messages.create(body=summary,
-                             media_url=image,
-                             from_=twilio_phone_number,
-                             to=chat_id)
-    else:
-      client.messages.create(body=output,
-                             from_=twilio_phone_number,
-                             to=chat_id)
-  else:
-    if isinstance(output, tuple):
-      summary, image = output
-      client.messages.create(body=summary,
-                             media_url=image,
-                             from_=twilio_phone_number,
-                             to=chat_id)
-    else:
-      client.messages.create(body=output,
-                             from_=twilio_phone_number,
-                             to=chat_id)
+    await twilio_sender.send(chat_id, output, twilio_phone_number)
 
 
 # Maneja la respuesta de la API de Twilio
 @twilio_api_reply.post("/api")
+@timed("webhook", platform="twilio")
 async def handle_twilio_api_reply(request: Request,
                                   Body: str = Form(""),
                                   MediaUrl0: str = Form("")):
@@ -126,16 +99,39 @@ async def handle_twilio_api_reply(request: Request,
   if (platform == "whatsapp"
       and TWILIO_WHATSAPP_NUMBER) or (platform == "messenger"
                                       and FACEBOOK_PAGE_ID):
+    # Twilio reintenta con el mismo MessageSid; cada mensaje se procesa una sola vez
+    message_sid = form_data.get("MessageSid")
+    message_key = f"twilio:{message_sid}"
+    if message_sid and not await deduplicator.first_seen(message_key):
+      return Response(content=EMPTY_TWIML,
+                      media_type="application/xml")
+
+    text = Body.strip()
     if MediaUrl0:
-      asyncio.create_task(
-        send_twilio_response(chat_id,
-                             MediaUrl0,
-                             platform=platform,
-                             is_voice=True))
+      coalescer.flush(chat_id)
+      accepted = ingest_queue.submit(lambda: send_twilio_response(
+        chat_id, MediaUrl0, platform=platform, is_voice=True),
+                                     key=chat_id,
+                                     kind="voice")
+    elif coalescer.enabled and text and not (BABYAGI
+                                             and text.startswith("/task")):
+      # Los mensajes de texto seguidos de un mismo chat se unen en un solo turno
+      accepted = coalescer.add(
+        chat_id, text,
+        lambda merged: send_twilio_response(chat_id, merged, platform=platform))
     else:
-      asyncio.create_task(
-        send_twilio_response(chat_id, Body.strip(), platform=platform))
+      coalescer.flush(chat_id)
+      kind = "task" if BABYAGI and text.startswith("/task") else "text"
+      accepted = ingest_queue.submit(
+        lambda: send_twilio_response(chat_id, text, platform=platform),
+        key=chat_id,
+        kind=kind)
+
+    # Twilio no reintenta los webhooks que fallan (error 11200, como mucho llama a la
+    # URL de respaldo), así que si la cola está llena se contesta al usuario que vuelva
+    # a intentarlo en lugar de perder el mensaje sin avisar
+    if not accepted:
+      return Response(content=BUSY_TWIML, media_type="application/xml")
 
 # Devuelve una respuesta vacía a Twilio
-  resp = MessagingResponse()
-  return Response(content=str(resp), media_type="application/xml")
+  return Response(content=EMPTY_TWIML, media_type="application/xml")
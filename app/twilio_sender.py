@@ -0,0 +1,199 @@
+import asyncio
+import threading
+from typing import AsyncIterator, Dict, Optional
+from config import (ACCOUNT_SID, AUTH_TOKEN, TWILIO_WHATSAPP_NUMBER,
+                    FACEBOOK_PAGE_ID, TWILIO_SEND_RATE, TWILIO_SEND_RETRIES,
+                    TWILIO_STREAM_MIN_CHARS, TWILIO_API_BASE)
+from executor import run_io
+from keyed_queue import KeyedSerialQueue
+from metrics import stage_timer
+from rate_limit import TokenBucket
+
+# Códigos HTTP de Twilio que merece la pena reintentar
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# Longitud máxima del cuerpo de un mensaje de Twilio (error 21617 si se supera)
+MAX_BODY_CHARS = 1600
+
+
+def get_twilio_sender_number(platform: str) -> Optional[str]:
+  """
+    Devuelve el remitente de Twilio para la plataforma, o None si no está configurado.
+
+    Args:
+        platform (str): "whatsapp" o "messenger".
+
+    Returns:
+        Optional[str]: El remitente, p. ej. "whatsapp:+14155238886".
+    """
+  if platform not in ("whatsapp", "messenger"):
+    raise ValueError(
+      "Plataforma no válida especificada. Las plataformas válidas son 'whatsapp' y 'messenger'."
+    )
+
+  if platform == "whatsapp" and not TWILIO_WHATSAPP_NUMBER:
+    print(
+      "Número de WhatsApp de Twilio no configurado. Por favor, establezca la variable de entorno TWILIO_WHATSAPP_NUMBER."
+    )
+    return None
+  elif platform == "messenger" and not FACEBOOK_PAGE_ID:
+    print(
+      "ID de página de Facebook no configurado. Por favor, establezca la variable de entorno FACEBOOK_PAGE_ID."
+    )
+    return None
+
+  if platform == "messenger":
+    return f'messenger:{FACEBOOK_PAGE_ID}'
+  return f'whatsapp:{TWILIO_WHATSAPP_NUMBER}'
+
+
+def _is_retryable(error: Exception) -> bool:
+  from twilio.base.exceptions import TwilioException, TwilioRestException
+  if isinstance(error, TwilioRestException):
+    return error.status in RETRYABLE_STATUS
+  # Errores de red (conexión, tiempo de espera) del cliente HTTP de Twilio
+  return not isinstance(error, TwilioException)
+
+
+class TwilioSender:
+  """
+    Envía mensajes de Twilio desde un único cliente con conexiones persistentes.
+
+    Los envíos se encolan por chat para mantener su orden, se limitan por remitente
+    y se reintentan con espera exponencial si el error es transitorio.
+
+    Args:
+        rate (float): Mensajes por segundo permitidos para cada remitente.
+        retries (int): Reintentos ante errores transitorios.
+    """
+
+  def __init__(self, rate: float, retries: int):
+    self.rate = rate
+    self.retries = retries
+    # El cliente (y el paquete twilio, lento de importar) se carga en el primer envío
+    self._client = None
+    self._client_lock = threading.Lock()
+    self._queue = KeyedSerialQueue()
+    self._buckets: Dict[str, TokenBucket] = {}
+    self.counters: Dict[str, int] = {"sent": 0, "retries": 0, "failed": 0}
+
+  @property
+  def client(self):
+    # Puede llamarse desde varios hilos del pool a la vez; el cliente se publica ya configurado
+    if self._client is None:
+      with self._client_lock:
+        if self._client is None:
+          from twilio.http.http_client import TwilioHttpClient
+          from twilio.rest import Client
+          client = Client(ACCOUNT_SID,
+                          AUTH_TOKEN,
+                          http_client=TwilioHttpClient(pool_connections=True))
+          if TWILIO_API_BASE:
+            client.api.base_url = TWILIO_API_BASE
+          self._client = client
+    return self._client
+
+  def _bucket(self, sender: str) -> TokenBucket:
+    bucket = self._buckets.get(sender)
+    if bucket is None:
+      bucket = TokenBucket(self.rate, max(1.0, self.rate))
+      self._buckets[sender] = bucket
+    return bucket
+
+  def send(self,
+           to: str,
+           body: str,
+           sender: str,
+           media_url: Optional[str] = None) -> asyncio.Future:
+    """
+      Encola un mensaje para el chat; se envía después de los anteriores del mismo chat.
+
+      Args:
+          to (str): Destinatario (chat_id de Twilio).
+          body (str): Texto del mensaje.
+          sender (str): Remitente, ver get_twilio_sender_number.
+          media_url (str): URL de una imagen adjunta (opcional).
+
+      Returns:
+          asyncio.Future: Se resuelve con True si el mensaje se envió.
+      """
+    return self._queue.submit(
+      to, lambda: self._deliver(to, body, sender, media_url))
+
+  async def send_stream(self,
+                        to: str,
+                        chunks: AsyncIterator[str],
+                        sender: str,
+                        min_chars: int = TWILIO_STREAM_MIN_CHARS) -> str:
+    """
+      Envía un texto que llega por fragmentos en mensajes del tamaño de un párrafo.
+
+      Cada mensaje sale en cuanto se completa un párrafo de al menos min_chars
+      caracteres, sin esperar al resto del texto. Si no llega ningún salto de párrafo,
+      el mensaje se corta en el último espacio antes de MAX_BODY_CHARS caracteres.
+
+      Args:
+          to (str): Destinatario (chat_id de Twilio).
+          chunks (AsyncIterator[str]): Fragmentos del texto en orden.
+          sender (str): Remitente, ver get_twilio_sender_number.
+          min_chars (int): Longitud mínima de cada mensaje salvo el último.
+
+      Returns:
+          str: El texto completo recibido.
+      """
+    parts = []
+    buffer = ""
+    sends = []
+    async for chunk in chunks:
+      parts.append(chunk)
+      buffer += chunk
+      while True:
+        cut = buffer.rfind("\n\n", 0, MAX_BODY_CHARS)
+        if cut < min_chars:
+          if len(buffer) <= MAX_BODY_CHARS:
+            break
+          cut = buffer.rfind(" ", 0, MAX_BODY_CHARS)
+          if cut <= 0:
+            cut = MAX_BODY_CHARS
+        sends.append(self.send(to, buffer[:cut].strip(), sender))
+        buffer = buffer[cut:].lstrip()
+    if buffer.strip():
+      sends.append(self.send(to, buffer.strip(), sender))
+    await asyncio.gather(*sends)
+    return "".join(parts)
+
+  async def _deliver(self, to: str, body: str, sender: str,
+                     media_url: Optional[str]) -> bool:
+    kwargs = {"body": body, "from_": sender, "to": to}
+    if media_url:
+      kwargs["media_url"] = media_url
+
+    for attempt in range(self.retries + 1):
+      await self._bucket(sender).acquire()
+      try:
+        with stage_timer("send"):
+          # El cliente se resuelve en el pool: la primera vez importa twilio
+          await run_io(lambda: self.client.messages.create(**kwargs))
+        self.counters["sent"] += 1
+        return True
+      except Exception as e:
+        if attempt == self.retries or not _is_retryable(e):
+          self.counters["failed"] += 1
+          print(f"Error al enviar el mensaje: {e}")
+          return False
+        self.counters["retries"] += 1
+        await asyncio.sleep(0.5 * 2**attempt)
+    return False
+
+  def stats(self) -> Dict[str, int]:
+    stats = dict(self.counters)
+    stats["pending"] = self._queue.pending
+    stats["active_chats"] = self._queue.active_keys()
+    return stats
+
+  async def close(self):
+    await self._queue.close()
+
+
+# Remitente compartido por todo el proceso
+twilio_sender = TwilioSender(TWILIO_SEND_RATE, TWILIO_SEND_RETRIES)
@@ -1,27 +1,50 @@
-import openai
-from langchain import OpenAI, LLMChain, PromptTemplate
-from langchain.chains.conversation.memory import ConversationBufferMemory
-from langchain.chat_models import ChatOpenAI
-from config import SELECTED_MODEL, IMAGE_SIZE, ZAPIER_NLA_API_KEY, BOT_NAME
-from models import initialize_language_model
-from templates import get_template
-from langchain.agents.agent_toolkits import ZapierToolkit
-from langchain.utilities.zapier import ZapierNLAWrapper
-from langchain.agents import initialize_agent
-
-# Si se proporciona una clave API de Zapier NLA, inicializa el agente para manejar las interacciones con Zapier
-if ZAPIER_NLA_API_KEY:
-  llm = OpenAI(temperature=0)
-  zapier = ZapierNLAWrapper()
-  toolkit = ZapierToolkit.from_zapier_nla_wrapper(zapier)
-  agent = initialize_agent(toolkit.get_tools(),
-                           llm,
-                           agent="zero-shot-react-description",
-                           verbose=True)
-else:
-  zapier = None
-  toolkit = None
-  agent = None
+import threading
+from typing import AsyncIterator
+from config import IMAGE_SIZE, ZAPIER_NLA_API_KEY, BOT_NAME, SELECTED_MODEL
+from chains import load_chain
+from executor import run_llm
+from intent import intent_router, normalize_topic
+from metrics import count_tokens, stage_timer, timed, timed_stream
+from models import (estimate_tokens, get_openai, load_openai,
+                    stream_completion)
+from response_cache import response_cache
+
+# Agente de Zapier para el calendario; se crea en el primer uso porque pide las
+# acciones a la API de Zapier y carga los agentes de LangChain
+_agent = None
+_agent_lock = threading.Lock()
+
+
+def get_zapier_agent():
+  """
+    Devuelve el agente de Zapier, creándolo en el primer uso.
+
+    Returns:
+        El agente, o None si no hay clave API de Zapier NLA.
+    """
+  global _agent
+  if _agent is None and ZAPIER_NLA_API_KEY:
+    with _agent_lock:
+      if _agent is None:
+        get_openai()
+        from langchain import OpenAI
+        from langchain.agents import initialize_agent
+        from langchain.agents.agent_toolkits import ZapierToolkit
+        from langchain.utilities.zapier import ZapierNLAWrapper
+        llm = OpenAI(temperature=0)
+        zapier = ZapierNLAWrapper()
+        toolkit = ZapierToolkit.from_zapier_nla_wrapper(zapier)
+        _agent = initialize_agent(toolkit.get_tools(),
+                                  llm,
+                                  agent="zero-shot-react-description",
+                                  verbose=True)
+  return _agent
+
+
+def _count_chain_tokens(chain, text: str, history_string: str, output: str):
+  # LangChain no devuelve el uso de tokens de predict(), así que se estima
+  prompt = chain.prompt.format(history=history_string, human_input=text)
+  count_tokens(SELECTED_MODEL, estimate_tokens(prompt), estimate_tokens(output))
 
 
 async def get_topic(text: str, history_string: str) -> str:
@@ -33,25 +56,41 @@ async def get_topic(text: str, history_string: str) -> str:
         history_string (str): Cadena de historial de conversación formateada.
 
     Returns:
-        str: El tema detectado.
+        str: El tema detectado ("chat", "image" o "calendar").
     """
-  prompt_template = get_template("topic")
-  prompt = PromptTemplate(input_variables=["history", "human_input"],
-                          template=prompt_template)
+  # Primero intenta decidir localmente con reglas y el clasificador de n-gramas
+  topic = intent_router.classify(text)
+  if topic is not None:
+    return topic
+  return await llm_topic(text, history_string)
+
 
-  chatgpt_chain = LLMChain(
-    llm=initialize_language_model(SELECTED_MODEL),
-    prompt=prompt,
-    verbose=False,
-    memory=ConversationBufferMemory(),
-  )
+@timed("topic", model=SELECTED_MODEL)
+async def llm_topic(text: str, history_string: str) -> str:
+  """
+    Pide el tema al LLM, para los mensajes que intent_router no pudo clasificar localmente.
+
+    Args:
+        text (str): Mensaje de texto de entrada.
+        history_string (str): Cadena de historial de conversación formateada.
 
-  topic = chatgpt_chain.predict(history=history_string, human_input=text)
+    Returns:
+        str: El tema detectado ("chat", "image" o "calendar").
+    """
+  chatgpt_chain = await load_chain("topic")
+  with stage_timer("topic_llm", model=SELECTED_MODEL):
+    raw_topic = await run_llm(chatgpt_chain.predict,
+                              history=history_string,
+                              human_input=text)
+  _count_chain_tokens(chatgpt_chain, text, history_string, raw_topic)
+  topic = normalize_topic(raw_topic)
+  intent_router.record(text, topic)
 
   return topic
 
 
-def process_chat(text: str, history_string: str) -> str:
+@timed("chat", model=SELECTED_MODEL)
+async def process_chat(text: str, history_string: str) -> str:
   """
     Procesa un mensaje de chat y genera una respuesta.
 
@@ -62,22 +101,53 @@ def process_chat(text: str, history_string: str) -> str:
     Returns:
         str: El tema detectado.
     """
-  prompt_template = get_template("chat")
-  prompt = PromptTemplate(input_variables=["history", "human_input"],
-                          template=prompt_template)
-
-  chatgpt_chain = LLMChain(
-    llm=initialize_language_model(SELECTED_MODEL),
-    prompt=prompt,
-    verbose=False,
-    memory=ConversationBufferMemory(),
-  )
+  output = await response_cache.get("chat", text, history_string)
+  if output is not None:
+    return output
 
-  output = chatgpt_chain.predict(history=history_string, human_input=text)
+  chatgpt_chain = await load_chain("chat")
+  output = await run_llm(chatgpt_chain.predict,
+                         history=history_string,
+                         human_input=text)
+  _count_chain_tokens(chatgpt_chain, text, history_string, output)
+  await response_cache.set("chat", text, history_string, output)
 
   return output
 
 
+async def process_chat_stream(text: str,
+                              history_string: str) -> AsyncIterator[str]:
+  """
+    Como process_chat, pero devuelve la respuesta por fragmentos a medida que el modelo la genera.
+
+    Args:
+        text (str): Mensaje de texto de entrada.
+        history_string (str): Cadena de historial de conversación formateada.
+
+    Yields:
+        str: Los fragmentos de la respuesta en orden.
+    """
+  output = await response_cache.get("chat", text, history_string)
+  if output is not None:
+    yield output
+    return
+
+  chatgpt_chain = await load_chain("chat")
+  prompt = chatgpt_chain.prompt.format_prompt(history=history_string,
+                                              human_input=text)
+  parts = []
+  # Solo se mide la espera al modelo, no el envío de cada fragmento al usuario
+  async for chunk in timed_stream(stream_completion(prompt, SELECTED_MODEL),
+                                  "chat_stream",
+                                  model=SELECTED_MODEL):
+    parts.append(chunk)
+    yield chunk
+  count_tokens(SELECTED_MODEL, estimate_tokens(prompt.to_string()),
+               estimate_tokens("".join(parts)))
+  await response_cache.set("chat", text, history_string, "".join(parts))
+
+
+@timed("image", model=SELECTED_MODEL)
 async def process_image(text: str, history_string: str) -> str:
   """
     Procesa una solicitud de imagen y genera una respuesta.
@@ -89,24 +159,26 @@ async def process_image(text: str, history_string: str) -> str:
     Returns:
         str: El tema detectado.
     """
-  prompt_template = get_template("image")
-  prompt = PromptTemplate(input_variables=["history", "human_input"],
-                          template=prompt_template)
+  output = await response_cache.get("image", text, history_string)
+  if output is not None:
+    return output
 
-  chatgpt_chain = LLMChain(
-    llm=initialize_language_model(SELECTED_MODEL),
-    prompt=prompt,
-    verbose=False,
-    memory=ConversationBufferMemory(),
-  )
-
-  prompt_text = chatgpt_chain.predict(history=history_string, human_input=text)
+  chatgpt_chain = await load_chain("image")
+  prompt_text = await run_llm(chatgpt_chain.predict,
+                              history=history_string,
+                              human_input=text)
+  _count_chain_tokens(chatgpt_chain, text, history_string, prompt_text)
 
   if prompt_text == "false":
     output = "Por favor, proporciona más detalles sobre la imagen que estás buscando."
   else:
     try:
-      response = openai.Image.create(prompt=prompt_text, n=1, size=IMAGE_SIZE)
+      openai = await load_openai()
+      with stage_timer("dalle", model="dall-e"):
+        response = await run_llm(openai.Image.create,
+                                 prompt=prompt_text,
+                                 n=1,
+                                 size=IMAGE_SIZE)
       deissue = False
       image = response["data"][0]["url"]
     except:
@@ -116,11 +188,14 @@ async def process_image(text: str, history_string: str) -> str:
       output = "Tu solicitud fue rechazada debido a nuestro sistema de seguridad. Tu solicitud puede contener texto que no está permitido por nuestro sistema de seguridad."
     else:
       output = ("image of " + prompt_text, image)
+      # Solo se guardan las imágenes generadas, no los avisos de error
+      await response_cache.set("image", text, history_string, output)
 
   return output
 
 
-def process_calendar(text: str, history_string: str) -> str:
+@timed("calendar", model=SELECTED_MODEL)
+async def process_calendar(text: str, history_string: str) -> str:
   """
     Procesa una solicitud de evento de calendario y genera una respuesta.
 
@@ -131,22 +206,16 @@ def process_calendar(text: str, history_string: str) -> str:
     Returns:
         str:El tema detectado.
     """
-  if agent is None:
+  if not ZAPIER_NLA_API_KEY:
     return f"{BOT_NAME}:Lo siento, pero no puedo acceder a tu calendario sin una configuración adecuada. Por favor, configura la clave API de Zapier para habilitar la integración del calendario."
 
-  prompt_template = get_template("calendar")
-  prompt = PromptTemplate(input_variables=["history", "human_input"],
-                          template=prompt_template)
-
-  chatgpt_chain = LLMChain(
-    llm=initialize_language_model(SELECTED_MODEL),
-    prompt=prompt,
-    verbose=False,
-    memory=ConversationBufferMemory(),
-  )
-
-  prompt_calendar = chatgpt_chain.predict(history=history_string,
-                                          human_input=text)
-  output = agent.run(prompt_calendar)
+  chatgpt_chain = await load_chain("calendar")
+  prompt_calendar = await run_llm(chatgpt_chain.predict,
+                                  history=history_string,
+                                  human_input=text)
+  _count_chain_tokens(chatgpt_chain, text, history_string, prompt_calendar)
+  # El agente se crea en el pool de ejecución: la primera vez llama a la API de Zapier
+  agent = await run_llm(get_zapier_agent)
+  output = await run_llm(agent.run, prompt_calendar)
 
   return output
@@ -0,0 +1,278 @@
+import json
+import os
+import re
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from config import (VECTOR_BACKEND, VECTOR_DIMENSION, VECTOR_STORE_PATH,
+                    PINECONE_API_KEY, PINECONE_ENVIRONMENT, PINECONE_INDEX)
+from executor import run_io
+from metrics import timed
+
+# (id, vector, metadatos)
+VectorItem = Tuple[str, Any, Dict[str, Any]]
+
+
+class VectorStore(ABC):
+  """
+    Memoria vectorial de BabyAGI: guarda vectores con metadatos y busca los más parecidos.
+
+    Los vectores se agrupan en espacios de nombres (uno por chat y objetivo) y las
+    búsquedas solo miran dentro del espacio de nombres indicado.
+
+    Args:
+        dimension (int): Dimensión de los vectores.
+    """
+
+  def __init__(self, dimension: int):
+    self.dimension = dimension
+
+  @abstractmethod
+  async def upsert(self, namespace: str, items: Sequence[VectorItem]):
+    pass
+
+  @abstractmethod
+  async def query(self, namespace: str, vector, top_k: int) -> List[Dict]:
+    """
+      Busca los vectores más parecidos por similitud coseno.
+
+      Returns:
+          List[Dict]: Hasta top_k resultados {"id", "score", "metadata"}, del más parecido al menos.
+      """
+    pass
+
+  def release(self, namespace: str):
+    # Libera los recursos locales del espacio de nombres (los datos guardados se conservan)
+    pass
+
+  def connect(self):
+    # Inicializa el cliente por adelantado (bloqueante); sin hacerlo, se conecta en el primer uso
+    pass
+
+  def stats(self) -> Dict[str, int]:
+    return {}
+
+
+class _Namespace:
+  # Matriz de vectores normalizados de un espacio de nombres, con hueco para crecer
+
+  def __init__(self, dimension: int, path: Optional[str]):
+    self.dimension = dimension
+    self.path = path
+    self.ids: List[str] = []
+    self.positions: Dict[str, int] = {}
+    self.metadata: List[Dict[str, Any]] = []
+    self.matrix = np.zeros((0, dimension), dtype=np.float32)
+    if path is not None:
+      self._load()
+
+  @property
+  def count(self) -> int:
+    return len(self.ids)
+
+  def _load(self):
+    # Los metadatos se guardan en JSONL (la última línea de cada id manda) y los vectores en un memmap
+    if os.path.exists(self.path + ".jsonl"):
+      with open(self.path + ".jsonl", encoding="utf-8") as f:
+        for line in f:
+          entry = json.loads(line)
+          self._remember(entry["id"], entry["metadata"])
+    if os.path.exists(self.path + ".f32"):
+      rows = os.path.getsize(self.path + ".f32") // (self.dimension * 4)
+      if rows:
+        self.matrix = np.memmap(self.path + ".f32",
+                                dtype=np.float32,
+                                mode="r+",
+                                shape=(rows, self.dimension))
+
+  def _remember(self, item_id: str, metadata: Dict[str, Any]) -> int:
+    position = self.positions.get(item_id)
+    if position is None:
+      position = len(self.ids)
+      self.positions[item_id] = position
+      self.ids.append(item_id)
+      self.metadata.append(metadata)
+    else:
+      self.metadata[position] = metadata
+    return position
+
+  def _grow(self, rows: int):
+    capacity = max(64, len(self.matrix))
+    while capacity < rows:
+      capacity *= 2
+    if self.path is None:
+      matrix = np.zeros((capacity, self.dimension), dtype=np.float32)
+      matrix[:len(self.matrix)] = self.matrix
+      self.matrix = matrix
+      return
+    # Se amplía el archivo y se vuelve a mapear; las filas existentes no se copian
+    if isinstance(self.matrix, np.memmap):
+      self.matrix.flush()
+    self.matrix = None
+    with open(self.path + ".f32", "ab") as f:
+      f.truncate(capacity * self.dimension * 4)
+    self.matrix = np.memmap(self.path + ".f32",
+                            dtype=np.float32,
+                            mode="r+",
+                            shape=(capacity, self.dimension))
+
+  def upsert(self, items: Sequence[VectorItem]):
+    new_ids = {item_id for item_id, _, _ in items} - self.positions.keys()
+    if self.count + len(new_ids) > len(self.matrix):
+      self._grow(self.count + len(new_ids))
+    lines = []
+    for item_id, vector, metadata in items:
+      vector = np.asarray(vector, dtype=np.float32)
+      position = self._remember(item_id, metadata)
+      self.matrix[position] = vector / (np.linalg.norm(vector) or 1.0)
+      lines.append(json.dumps({"id": item_id, "metadata": metadata}))
+    if self.path is not None:
+      with open(self.path + ".jsonl", "a", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+  def query(self, vector, top_k: int) -> List[Dict]:
+    if not self.count or top_k <= 0:
+      return []
+    query = np.asarray(vector, dtype=np.float32)
+    query = query / (np.linalg.norm(query) or 1.0)
+    scores = self.matrix[:self.count] @ query
+    k = min(top_k, self.count)
+    best = np.argpartition(-scores, k - 1)[:k]
+    best = best[np.argsort(-scores[best])]
+    return [{
+      "id": self.ids[i],
+      "score": float(scores[i]),
+      "metadata": self.metadata[i],
+    } for i in best]
+
+
+class LocalVectorStore(VectorStore):
+  """
+    Memoria vectorial en el propio proceso: matrices float32 de NumPy y búsqueda coseno vectorizada.
+
+    Con path, cada espacio de nombres se guarda en disco (vectores en un archivo
+    mapeado en memoria y metadatos en JSONL) y se recupera al volver a usarlo.
+
+    Args:
+        dimension (int): Dimensión de los vectores.
+        path (str): Directorio donde guardar los datos (None: solo en memoria).
+    """
+
+  def __init__(self, dimension: int, path: Optional[str] = None):
+    super().__init__(dimension)
+    self.path = path
+    self._namespaces: Dict[str, _Namespace] = {}
+    if path is not None:
+      os.makedirs(path, exist_ok=True)
+
+  def _namespace(self, namespace: str) -> _Namespace:
+    data = self._namespaces.get(namespace)
+    if data is None:
+      file_path = None
+      if self.path is not None:
+        file_path = os.path.join(self.path, re.sub(r"[^\w.-]", "_", namespace))
+      data = _Namespace(self.dimension, file_path)
+      self._namespaces[namespace] = data
+    return data
+
+  @timed("vector_upsert")
+  async def upsert(self, namespace: str, items: Sequence[VectorItem]):
+    self._namespace(namespace).upsert(items)
+
+  @timed("vector_query")
+  async def query(self, namespace: str, vector, top_k: int) -> List[Dict]:
+    return self._namespace(namespace).query(vector, top_k)
+
+  def release(self, namespace: str):
+    data = self._namespaces.pop(namespace, None)
+    if data is not None and isinstance(data.matrix, np.memmap):
+      data.matrix.flush()
+
+  def stats(self) -> Dict[str, int]:
+    return {
+      "namespaces": len(self._namespaces),
+      "vectors": sum(data.count for data in self._namespaces.values()),
+    }
+
+
+class PineconeVectorStore(VectorStore):
+  """
+    Memoria vectorial en un índice de Pinecone.
+
+    El cliente se inicializa (y el índice se crea si no existe) la primera vez
+    que se usa, no al importar el módulo.
+
+    Args:
+        api_key (str): Clave de la API de Pinecone.
+        environment (str): Entorno de Pinecone, p. ej. "us-east1-gcp".
+        index_name (str): Nombre del índice.
+        dimension (int): Dimensión de los vectores.
+    """
+
+  def __init__(self, api_key: str, environment: str, index_name: str,
+               dimension: int):
+    super().__init__(dimension)
+    self.api_key = api_key
+    self.environment = environment
+    self.index_name = index_name
+    self._index = None
+    self._lock = threading.Lock()
+
+  def _get_index(self):
+    with self._lock:
+      if self._index is None:
+        import pinecone
+
+        pinecone.init(api_key=self.api_key, environment=self.environment)
+        if self.index_name not in pinecone.list_indexes():
+          pinecone.create_index(self.index_name,
+                                dimension=self.dimension,
+                                metric="cosine",
+                                pod_type="p1")
+        self._index = pinecone.Index(self.index_name)
+      return self._index
+
+  def connect(self):
+    self._get_index()
+
+  def _upsert(self, namespace: str, items: Sequence[VectorItem]):
+    vectors = [(item_id, np.asarray(vector, dtype=np.float32).tolist(),
+                metadata) for item_id, vector, metadata in items]
+    self._get_index().upsert(vectors, namespace=namespace)
+
+  def _query(self, namespace: str, vector, top_k: int) -> List[Dict]:
+    results = self._get_index().query(np.asarray(vector,
+                                                 dtype=np.float32).tolist(),
+                                      top_k=top_k,
+                                      include_metadata=True,
+                                      namespace=namespace)
+    matches = sorted(results.matches, key=lambda x: x.score, reverse=True)
+    return [{
+      "id": match.id,
+      "score": match.score,
+      "metadata": match.metadata,
+    } for match in matches]
+
+  @timed("vector_upsert")
+  async def upsert(self, namespace: str, items: Sequence[VectorItem]):
+    await run_io(self._upsert, namespace, items)
+
+  @timed("vector_query")
+  async def query(self, namespace: str, vector, top_k: int) -> List[Dict]:
+    return await run_io(self._query, namespace, vector, top_k)
+
+
+def create_vector_store() -> VectorStore:
+  # Crea la memoria vectorial según VECTOR_BACKEND
+  if VECTOR_BACKEND == "local":
+    return LocalVectorStore(VECTOR_DIMENSION, VECTOR_STORE_PATH)
+  elif VECTOR_BACKEND == "pinecone":
+    return PineconeVectorStore(PINECONE_API_KEY, PINECONE_ENVIRONMENT,
+                               PINECONE_INDEX, VECTOR_DIMENSION)
+  else:
+    raise ValueError(f"Memoria vectorial no válida: {VECTOR_BACKEND}")
+
+
+# Memoria vectorial compartida por las sesiones de BabyAGI
+vector_store = create_vector_store()
@@ -1,79 +1,210 @@
-import urllib.request
-import librosa
-import soundfile as sf
-import os
-import openai
+import asyncio
+import hashlib
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Awaitable, Callable, Dict, Optional, Tuple, Union
+from audio import (WHISPER_FORMATS, sniff_audio_format, transcode_to_wav,
+                   split_audio)
 from chat_handler import process_chat_message
+from config import (VOICE_PROCESS_WORKERS, TRANSCRIPTION_CACHE_SIZE,
+                    TRANSCRIPTION_CACHE_TTL, VOICE_SEGMENT_SECONDS,
+                    VOICE_SEGMENT_MIN_BYTES, VOICE_SEGMENT_CONCURRENCY)
+from executor import run_llm
+from http_client import download_media, MediaTooLargeError
+from metrics import stage_timer
+from models import get_openai
+from ttl_cache import TTLCache
+
+# URL de un audio, o una corrutina que la obtiene
+VoiceSource = Union[str, Callable[[], Awaitable[str]]]
+
+# Transcripciones ya hechas, por identificador del audio o por hash de su contenido
+transcription_cache = TTLCache(TRANSCRIPTION_CACHE_SIZE, TRANSCRIPTION_CACHE_TTL)
+transcription_stats: Dict[str, int] = {
+  "id_hits": 0,
+  "content_hits": 0,
+  "misses": 0,
+  "segmented": 0,
+}
+
+# Pool de procesos para la conversión de audio, creado en el primer uso
+_audio_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_audio_pool() -> ProcessPoolExecutor:
+  global _audio_pool
+  if _audio_pool is None:
+    # "spawn" evita heredar los hilos del servidor al crear los procesos hijos
+    _audio_pool = ProcessPoolExecutor(
+      max_workers=VOICE_PROCESS_WORKERS,
+      mp_context=multiprocessing.get_context("spawn"))
+  return _audio_pool
+
+
+def shutdown_audio_pool():
+  if _audio_pool is not None:
+    _audio_pool.shutdown(wait=False)
+
+
+def transcribe_audio(audio: bytes, filename: str) -> str:
+  """
+    Transcribe un audio utilizando la API de ASR Whisper de OpenAI.
+
+    Args:
+        audio (bytes): Contenido del archivo de audio.
+        filename (str): Nombre con la extensión del formato, p. ej. "voice.ogg".
+
+    Returns:
+        str: Texto transcrito.
+    """
+  audio_file = io.BytesIO(audio)
+  audio_file.name = filename
+  transcript = get_openai().Audio.transcribe("whisper-1", audio_file)
+  return transcript["text"]
 
 
-def transcribe_audio(audio_filepath: str) -> str:
+async def prepare_audio(audio: bytes) -> Tuple[bytes, str]:
   """
-    Transcribe un archivo de audio utilizando la API de ASR Whisper de OpenAI.
+    Deja el audio listo para Whisper, convirtiéndolo solo si su formato no es aceptado.
 
     Args:
-        audio_filepath (str): Ruta al archivo de audio.
+        audio (bytes): Contenido del archivo de audio descargado.
 
     Returns:
-        str: Texto transcrito.
+        Tuple[bytes, str]: El audio y el nombre de archivo con su extensión.
     """
-  with open(audio_filepath, "rb") as audio:
-    transcript = openai.Audio.transcribe("whisper-1", audio)
-    return transcript["text"]
+  audio_format = sniff_audio_format(audio)
+  if audio_format in WHISPER_FORMATS:
+    # OGG/Opus y el resto de formatos aceptados se envían tal cual
+    return audio, f"voice.{audio_format}"
 
+  loop = asyncio.get_running_loop()
+  with stage_timer("audio_conversion"):
+    converted = await loop.run_in_executor(get_audio_pool(), transcode_to_wav,
+                                           audio)
+  return converted, "voice.wav"
 
-async def handle_voice_message(audio_filepath: str, chat_id: int) -> str:
+
+async def transcribe_long_audio(audio: bytes) -> Optional[str]:
+  """
+    Transcribe una nota de voz larga partiéndola en silencios y enviando los segmentos a Whisper en paralelo.
+
+    Args:
+        audio (bytes): Contenido del archivo de audio.
+
+    Returns:
+        Optional[str]: El texto unido en orden, o None si el audio es corto y debe transcribirse entero.
+    """
+  if VOICE_SEGMENT_SECONDS <= 0 or len(audio) < VOICE_SEGMENT_MIN_BYTES:
+    return None
+
+  loop = asyncio.get_running_loop()
+  with stage_timer("audio_split"):
+    segments = await loop.run_in_executor(get_audio_pool(), split_audio, audio,
+                                          VOICE_SEGMENT_SECONDS)
+  if segments is None:
+    return None
+
+  transcription_stats["segmented"] += 1
+  semaphore = asyncio.Semaphore(VOICE_SEGMENT_CONCURRENCY)
+
+  async def transcribe_segment(segment: bytes) -> str:
+    async with semaphore:
+      with stage_timer("whisper", model="whisper-1"):
+        return await run_llm(transcribe_audio, segment, "voice.wav")
+
+  texts = await asyncio.gather(*[transcribe_segment(s) for s in segments])
+  return " ".join(text.strip() for text in texts if text.strip())
+
+
+async def transcribe_voice(voice_url: VoiceSource,
+                           auth: Optional[Tuple[str, str]] = None,
+                           audio_key: Optional[str] = None) -> str:
+  """
+    Obtiene la transcripción de un mensaje de voz, reutilizándola si el audio ya se transcribió.
+
+    Args:
+        voice_url: URL del audio, o una corrutina que la obtiene (solo se llama si hace falta descargarlo).
+        auth (Tuple[str, str]): Credenciales HTTP básicas para descargar el audio (opcional).
+        audio_key (str): Identificador estable del audio (file_unique_id de Telegram o SID del medio de Twilio).
+
+    Returns:
+        str: Texto transcrito.
+
+    Raises:
+        MediaTooLargeError: Si el audio supera el tamaño máximo permitido.
+    """
+  if audio_key is not None:
+    transcribed_text = transcription_cache.get(f"id:{audio_key}")
+    if transcribed_text is not None:
+      transcription_stats["id_hits"] += 1
+      return transcribed_text
+
+  # Descarga el archivo de voz desde la URL, sin pasar por disco
+  if callable(voice_url):
+    voice_url = await voice_url()
+  audio = await download_media(voice_url, auth=auth)
+
+  content_key = "sha256:" + hashlib.sha256(audio).hexdigest()
+  transcribed_text = transcription_cache.get(content_key)
+  if transcribed_text is not None:
+    transcription_stats["content_hits"] += 1
+  else:
+    transcription_stats["misses"] += 1
+    transcribed_text = await transcribe_long_audio(audio)
+    if transcribed_text is None:
+      # Convierte el audio solo si Whisper no acepta su formato original
+      audio, filename = await prepare_audio(audio)
+      with stage_timer("whisper", model="whisper-1"):
+        transcribed_text = await run_llm(transcribe_audio, audio, filename)
+    transcription_cache.set(content_key, transcribed_text)
+
+  if audio_key is not None:
+    transcription_cache.set(f"id:{audio_key}", transcribed_text)
+  return transcribed_text
+
+
+async def handle_voice_message(transcribed_text: str, chat_id: int) -> str:
   """
-    Maneja un mensaje de voz entrante y genera una respuesta apropiada.
+    Maneja un mensaje de voz ya transcrito y genera una respuesta apropiada.
 
     Args:
-        audio_filepath (str): Ruta al archivo de audio.
+        transcribed_text (str): Texto transcrito del mensaje de voz.
         chat_id (int): Identificador único para el chat.
 
     Returns:
         str: La respuesta generada.
     """
-  # Transcribe el archivo de audio
-  transcribed_text = transcribe_audio(audio_filepath)
   print("transcribed text: " + transcribed_text)
   output = await process_chat_message(transcribed_text, chat_id)
   return output
 
 
-async def process_voice_message(voice_url: str, chat_id: int) -> str:
+async def process_voice_message(voice_url: VoiceSource,
+                                chat_id: int,
+                                auth: Optional[Tuple[str, str]] = None,
+                                audio_key: Optional[str] = None) -> str:
   """
     Procesa un mensaje de voz entrante y genera una respuesta apropiada.
 
     Args:
-        voice_url (str): URL del mensaje de voz.
+        voice_url: URL del mensaje de voz, o una corrutina que la obtiene.
         chat_id (int): Identificador único para el chat.
+        auth (Tuple[str, str]): Credenciales HTTP básicas para descargar el audio (opcional).
+        audio_key (str): Identificador estable del audio, para reutilizar su transcripción (opcional).
 
     Returns:
         str: La respuesta generada.
     """
-  # Descarga el archivo de voz desde la URL
-  voice_file = "voice_message.ogg"
-
-  # Crea un agente de usuario personalizado para evitar cualquier restricción
-  user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:89.0) Gecko/20100101 Firefox/89.0"
-  headers = {"User-Agent": user_agent}
-  request = urllib.request.Request(voice_url, headers=headers)
-
-  # Descarga el archivo utilizando el agente de usuario personalizado
-  with urllib.request.urlopen(request) as response:
-    with open(voice_file, 'wb') as out_file:
-      out_file.write(response.read())
-
-  # Convierte el archivo de audio OGG/Opus a un formato compatible (por ejemplo, 'wav')
-  y, sr = librosa.load(voice_file, sr=None)
-  converted_voice_file = "converted_audio.wav"
-  sf.write(converted_voice_file, y, sr, format='wav', subtype='PCM_24')
-
-  # Procesa el archivo de voz (transcribe, analiza, responde, etc.)
-  output = await handle_voice_message(converted_voice_file, chat_id)
-
-  # Limpia los archivos de voz
-  os.remove(voice_file)
-  os.remove(converted_voice_file)
+  try:
+    transcribed_text = await transcribe_voice(voice_url, auth, audio_key)
+  except MediaTooLargeError as e:
+    print(f"Mensaje de voz descartado: {e}")
+    return "El mensaje de voz es demasiado largo. Por favor, envía uno más corto."
+
+  # Procesa el texto transcrito (analiza, responde, etc.)
+  output = await handle_voice_message(transcribed_text, chat_id)
 
   # Devuelve la salida (texto, imagen, etc.)
   return output
@@ -0,0 +1,363 @@
+import asyncio
+import hashlib
+import json
+import random
+import struct
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+# Servidores falsos de OpenAI, Telegram y Twilio para medir la aplicación sin red ni credenciales.
+
+
+def _fake_ogg(name: str) -> bytes:
+  # Audio OGG mínimo: basta con la cabecera para que la aplicación no lo convierta.
+  # Cada archivo es distinto para que la caché de transcripciones no los confunda.
+  return b"OggS" + name.encode().ljust(4096, b"\0")
+
+EMBEDDING_DIMENSION = 1536
+
+
+@dataclass
+class ServiceProfile:
+  """
+    Latencia y errores simulados de un servicio.
+
+    Args:
+        latency (float): Segundos de latencia media.
+        jitter (float): Desviación típica de la latencia, en segundos.
+        error_rate (float): Proporción de peticiones que fallan con un 500.
+    """
+  latency: float = 0.0
+  jitter: float = 0.0
+  error_rate: float = 0.0
+
+  async def delay(self):
+    seconds = max(0.0, random.gauss(self.latency, self.jitter))
+    if seconds:
+      await asyncio.sleep(seconds)
+
+  def fails(self) -> bool:
+    return self.error_rate > 0 and random.random() < self.error_rate
+
+  @classmethod
+  def parse(cls, spec: str) -> "ServiceProfile":
+    # Formato latencia[:jitter[:errores]], p. ej. "0.4:0.1:0.01"
+    values = [float(v) for v in spec.split(":")] if spec else []
+    return cls(*values)
+
+
+class Recorder:
+  """
+    Registra los mensajes salientes que recibe cada chat y cuándo llega el primero.
+    """
+
+  def __init__(self):
+    self.first_reply: Dict[str, float] = {}
+    self.replies: Dict[str, int] = defaultdict(int)
+    self.requests: Dict[str, int] = defaultdict(int)
+    self._waiters: Dict[str, asyncio.Event] = {}
+
+  def count(self, endpoint: str):
+    self.requests[endpoint] += 1
+
+  def reply(self, chat_id):
+    chat_id = str(chat_id)
+    self.replies[chat_id] += 1
+    if chat_id not in self.first_reply:
+      self.first_reply[chat_id] = time.perf_counter()
+      waiter = self._waiters.pop(chat_id, None)
+      if waiter is not None:
+        waiter.set()
+
+  async def wait(self, chat_id, timeout: float) -> Optional[float]:
+    # Espera a la primera respuesta del chat y devuelve su instante, o None si no llega a tiempo
+    chat_id = str(chat_id)
+    if chat_id not in self.first_reply:
+      waiter = self._waiters.setdefault(chat_id, asyncio.Event())
+      try:
+        await asyncio.wait_for(waiter.wait(), timeout)
+      except asyncio.TimeoutError:
+        return None
+    return self.first_reply[chat_id]
+
+
+def _words(count: int) -> str:
+  vocabulary = ("hola", "claro", "puedo", "ayudarte", "con", "eso", "aquí",
+                "tienes", "una", "respuesta", "detallada", "sobre", "el", "tema")
+  return " ".join(random.choice(vocabulary) for _ in range(count))
+
+
+def _reply_for(prompt: str, reply_words: int) -> str:
+  # Respuestas con la forma que espera cada plantilla
+  if "Devuelve una palabra única" in prompt:
+    return "chat"
+  if "IA de priorización" in prompt:
+    return "1. Investigar el tema\n2. Resumir los hallazgos"
+  if "IA de creación de tareas" in prompt:
+    return "Investigar el tema\nResumir los hallazgos"
+  if "Indicación para la imagen:" in prompt:
+    return "un gato naranja sobre un tejado"
+  return _words(reply_words)
+
+
+def _embedding(text: str) -> List[float]:
+  # Vector pseudoaleatorio estable para cada texto
+  seed = struct.unpack("<Q", hashlib.sha256(text.encode()).digest()[:8])[0]
+  rng = random.Random(seed)
+  return [rng.uniform(-1, 1) for _ in range(EMBEDDING_DIMENSION)]
+
+
+def create_fake_app(profiles: Dict[str, ServiceProfile], recorder: Recorder,
+                    base_url: str, reply_words: int = 60) -> FastAPI:
+  """
+    Crea la aplicación con los servidores falsos.
+
+    Args:
+        profiles (Dict[str, ServiceProfile]): Perfil de "openai", "telegram" y "twilio".
+        recorder (Recorder): Dónde se registran los mensajes salientes.
+        base_url (str): URL donde escucha esta aplicación, para las URLs de archivos.
+        reply_words (int): Palabras de cada respuesta de chat.
+    """
+  app = FastAPI()
+  openai_profile = profiles["openai"]
+  telegram_profile = profiles["telegram"]
+  twilio_profile = profiles["twilio"]
+
+  def openai_error():
+    return JSONResponse(
+      {"error": {
+        "message": "fake error",
+        "type": "server_error"
+      }},
+      status_code=500)
+
+  def stream(chunks: List[dict]):
+
+    async def events():
+      for chunk in chunks:
+        await asyncio.sleep(0.01)
+        yield f"data: {json.dumps(chunk)}\n\n"
+      yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+  @app.post("/v1/chat/completions")
+  async def chat_completions(request: Request):
+    body = await request.json()
+    recorder.count("openai.chat")
+    await openai_profile.delay()
+    if openai_profile.fails():
+      return openai_error()
+    # El preámbulo de la plantilla llega como mensaje de sistema
+    prompt = "\n".join(message["content"] for message in body["messages"])
+    text = _reply_for(prompt, reply_words)
+    if body.get("stream"):
+      return stream([{
+        "id": "fake",
+        "object": "chat.completion.chunk",
+        "choices": [{
+          "index": 0,
+          "delta": {
+            "content": word + " "
+          },
+          "finish_reason": None
+        }]
+      } for word in text.split(" ")])
+    return {
+      "id": "fake",
+      "object": "chat.completion",
+      "created": int(time.time()),
+      "model": body.get("model"),
+      "choices": [{
+        "index": 0,
+        "message": {
+          "role": "assistant",
+          "content": text
+        },
+        "finish_reason": "stop"
+      }],
+      "usage": {
+        "prompt_tokens": len(prompt) // 4,
+        "completion_tokens": len(text) // 4,
+        "total_tokens": (len(prompt) + len(text)) // 4
+      }
+    }
+
+  @app.post("/v1/completions")
+  async def completions(request: Request):
+    body = await request.json()
+    recorder.count("openai.completion")
+    await openai_profile.delay()
+    if openai_profile.fails():
+      return openai_error()
+    prompt = body["prompt"]
+    prompt = prompt[0] if isinstance(prompt, list) else prompt
+    text = _reply_for(prompt, reply_words)
+    if body.get("stream"):
+      return stream([{
+        "id": "fake",
+        "object": "text_completion",
+        "choices": [{
+          "index": 0,
+          "text": word + " ",
+          "finish_reason": None
+        }]
+      } for word in text.split(" ")])
+    return {
+      "id": "fake",
+      "object": "text_completion",
+      "created": int(time.time()),
+      "model": body.get("model"),
+      "choices": [{
+        "index": 0,
+        "text": text,
+        "finish_reason": "stop"
+      }],
+    }
+
+  @app.post("/v1/embeddings")
+  async def embeddings(request: Request):
+    body = await request.json()
+    recorder.count("openai.embedding")
+    await openai_profile.delay()
+    if openai_profile.fails():
+      return openai_error()
+    inputs = body["input"] if isinstance(body["input"], list) else [
+      body["input"]
+    ]
+    return {
+      "object":
+      "list",
+      "model":
+      body.get("model"),
+      "data": [{
+        "object": "embedding",
+        "index": i,
+        "embedding": _embedding(text)
+      } for i, text in enumerate(inputs)],
+    }
+
+  @app.post("/v1/audio/transcriptions")
+  async def transcriptions(request: Request):
+    await request.body()
+    recorder.count("openai.whisper")
+    await openai_profile.delay()
+    if openai_profile.fails():
+      return openai_error()
+    return {"text": _words(12)}
+
+  @app.post("/v1/images/generations")
+  async def images(request: Request):
+    await request.json()
+    recorder.count("openai.image")
+    await openai_profile.delay()
+    if openai_profile.fails():
+      return openai_error()
+    return {
+      "created": int(time.time()),
+      "data": [{
+        "url": f"{base_url}/files/image.png"
+      }]
+    }
+
+  async def telegram_reply(request: Request, method: str):
+    body = await request.json()
+    recorder.count(f"telegram.{method}")
+    await telegram_profile.delay()
+    if telegram_profile.fails():
+      return JSONResponse(
+        {
+          "ok": False,
+          "error_code": 500,
+          "description": "fake error"
+        },
+        status_code=500)
+    recorder.reply(body["chat_id"])
+    return {
+      "ok": True,
+      "result": {
+        "message_id": random.randint(1, 2**31),
+        "chat": {
+          "id": body["chat_id"]
+        },
+        "date": int(time.time())
+      }
+    }
+
+  @app.post("/bot{token}/sendMessage")
+  async def send_message(token: str, request: Request):
+    return await telegram_reply(request, "sendMessage")
+
+  @app.post("/bot{token}/sendPhoto")
+  async def send_photo(token: str, request: Request):
+    return await telegram_reply(request, "sendPhoto")
+
+  @app.post("/bot{token}/editMessageText")
+  async def edit_message(token: str, request: Request):
+    return await telegram_reply(request, "editMessageText")
+
+  @app.post("/bot{token}/getFile")
+  async def get_file(token: str, request: Request):
+    # Se aceptan los parámetros como JSON o como formulario
+    recorder.count("telegram.getFile")
+    await telegram_profile.delay()
+    if request.headers.get("content-type", "").startswith("application/json"):
+      params = await request.json()
+    else:
+      params = await request.form()
+    file_id = params.get("file_id", "voice")
+    return {
+      "ok": True,
+      "result": {
+        "file_id": file_id,
+        "file_unique_id": file_id,
+        "file_size": 4100,
+        "file_path": f"voice/{file_id}.oga"
+      }
+    }
+
+  @app.get("/file/bot{token}/{path:path}")
+  async def download_file(token: str, path: str):
+    recorder.count("telegram.download")
+    await telegram_profile.delay()
+    return Response(_fake_ogg(path), media_type="audio/ogg")
+
+  @app.post("/2010-04-01/Accounts/{account_sid}/Messages.json")
+  async def twilio_message(account_sid: str, request: Request):
+    form = await request.form()
+    recorder.count("twilio.message")
+    await twilio_profile.delay()
+    if twilio_profile.fails():
+      return JSONResponse({
+        "code": 20500,
+        "message": "fake error",
+        "status": 500
+      },
+                          status_code=500)
+    recorder.reply(form.get("To"))
+    return JSONResponse(
+      {
+        "sid": f"SM{random.getrandbits(64):016x}",
+        "account_sid": account_sid,
+        "to": form.get("To"),
+        "from": form.get("From"),
+        "body": form.get("Body"),
+        "status": "queued",
+      },
+      status_code=201)
+
+  @app.get("/media/{media_sid}")
+  async def twilio_media(media_sid: str):
+    recorder.count("twilio.media")
+    await twilio_profile.delay()
+    return Response(_fake_ogg(media_sid), media_type="audio/ogg")
+
+  @app.get("/files/{name}")
+  async def static_file(name: str):
+    return Response(b"", media_type="image/png")
+
+  return app
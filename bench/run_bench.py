@@ -0,0 +1,393 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import signal
+import socket
+import sys
+import time
+from typing import Dict, List, Optional
+import httpx
+import uvicorn
+from fake_services import Recorder, ServiceProfile, create_fake_app
+
+# Benchmark de extremo a extremo sin red: levanta servidores falsos de OpenAI, Telegram y
+# Twilio, arranca la aplicación apuntando a ellos y le envía tráfico sintético por los webhooks.
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+TELEGRAM_TOKEN = "123456:bench"
+TWILIO_ACCOUNT_SID = "AC" + "0" * 32
+TWILIO_NUMBER = "+15550000000"
+
+TEXTS = (
+  "hola, ¿qué tal estás?",
+  "¿me explicas cómo funciona la fotosíntesis?",
+  "dame ideas para una cena rápida",
+  "¿cuál es la capital de Australia?",
+  "resume en tres frases la historia de Roma",
+  "¿qué libro me recomiendas para aprender a programar?",
+)
+
+
+def _free_port() -> int:
+  with socket.socket() as s:
+    s.bind(("127.0.0.1", 0))
+    return s.getsockname()[1]
+
+
+def _percentile(values: List[float], p: float) -> Optional[float]:
+  # Percentil por rango más cercano
+  if not values:
+    return None
+  values = sorted(values)
+  index = min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))
+  return values[index]
+
+
+def _parse_mix(spec: str) -> Dict[str, float]:
+  mix = {}
+  for pair in spec.split(","):
+    kind, weight = pair.split("=")
+    mix[kind.strip()] = float(weight)
+  return mix
+
+
+def _peak_rss_mb(pid: int) -> Optional[float]:
+  # Pico de memoria residente del proceso (solo Linux)
+  try:
+    with open(f"/proc/{pid}/status") as f:
+      for line in f:
+        if line.startswith("VmHWM:"):
+          return int(line.split()[1]) / 1024
+  except OSError:
+    pass
+  return None
+
+
+def _telegram_update(i: int, chat_id: int, kind: str) -> dict:
+  message = {
+    "message_id": i,
+    "date": int(time.time()),
+    "chat": {
+      "id": chat_id,
+      "type": "private"
+    },
+    "from": {
+      "id": chat_id,
+      "is_bot": False,
+      "first_name": "Bench"
+    },
+  }
+  if kind == "voice":
+    message["voice"] = {
+      "file_id": f"voice{i}",
+      "file_unique_id": f"voice{i}",
+      "duration": 5,
+      "mime_type": "audio/ogg"
+    }
+  elif kind == "task":
+    message["text"] = "/task investigar el mercado de bicicletas eléctricas"
+    message["entities"] = [{"type": "bot_command", "offset": 0, "length": 5}]
+  else:
+    message["text"] = random.choice(TEXTS)
+  return {"update_id": i, "message": message}
+
+
+def _twilio_form(i: int, chat_id: str, kind: str, fake_url: str) -> dict:
+  form = {
+    "MessageSid": f"SM{i:032d}",
+    "AccountSid": TWILIO_ACCOUNT_SID,
+    "From": chat_id,
+    "To": f"whatsapp:{TWILIO_NUMBER}",
+    "Body": "",
+    "NumMedia": "0",
+  }
+  if kind == "voice":
+    form["NumMedia"] = "1"
+    form["MediaUrl0"] = f"{fake_url}/media/ME{i:032d}"
+  elif kind == "task":
+    form["Body"] = "/task investigar el mercado de bicicletas eléctricas"
+  else:
+    form["Body"] = random.choice(TEXTS)
+  return form
+
+
+async def _wait_ready(client: httpx.AsyncClient, url: str, timeout: float):
+  deadline = time.monotonic() + timeout
+  while time.monotonic() < deadline:
+    try:
+      if (await client.get(url)).status_code == 200:
+        return
+    except httpx.HTTPError:
+      pass
+    await asyncio.sleep(0.1)
+  raise RuntimeError(f"La aplicación no arrancó en {timeout} segundos")
+
+
+async def run(args) -> dict:
+  fake_port, app_port = _free_port(), _free_port()
+  fake_url = f"http://127.0.0.1:{fake_port}"
+  app_url = f"http://127.0.0.1:{app_port}"
+  recorder = Recorder()
+  profiles = {
+    "openai": ServiceProfile.parse(args.openai),
+    "telegram": ServiceProfile.parse(args.telegram),
+    "twilio": ServiceProfile.parse(args.twilio),
+  }
+  fake_server = uvicorn.Server(
+    uvicorn.Config(create_fake_app(profiles, recorder, fake_url,
+                                   args.reply_words),
+                   host="127.0.0.1",
+                   port=fake_port,
+                   log_level="warning"))
+  fake_task = asyncio.create_task(fake_server.serve())
+  while not fake_server.started:
+    await asyncio.sleep(0.05)
+
+  mix = _parse_mix(args.mix)
+  env = dict(os.environ)
+  env.update({
+    "OPENAI_API_KEY": "sk-bench",
+    "OPENAI_API_BASE": f"{fake_url}/v1",
+    "TELEGRAM_BOT_TOKEN": TELEGRAM_TOKEN,
+    "TELEGRAM_API_BASE": fake_url,
+    "TWILIO_API_BASE": fake_url,
+    "ACCOUNT_SID": TWILIO_ACCOUNT_SID,
+    "AUTH_TOKEN": "bench",
+    "TWILIO_WHATSAPP_NUMBER": TWILIO_NUMBER,
+    "BABYAGI": "true" if mix.get("task") else "false",
+    "FIRST_TASK": "Hacer una lista de tareas",
+  })
+  for assignment in args.env:
+    key, value = assignment.split("=", 1)
+    env[key] = value
+
+  log = open(args.app_log, "w") if args.app_log else None
+  started = time.perf_counter()
+  process = await asyncio.create_subprocess_exec(
+    sys.executable,
+    os.path.join(BENCH_DIR, "serve_app.py"),
+    "--port",
+    str(app_port),
+    env=env,
+    stdout=log or asyncio.subprocess.DEVNULL,
+    stderr=log or asyncio.subprocess.DEVNULL)
+
+  results: List[dict] = []
+  try:
+    async with httpx.AsyncClient(timeout=30) as client:
+      await _wait_ready(client, f"{app_url}/stats", args.startup_timeout)
+      startup_seconds = time.perf_counter() - started
+      await client.get(f"{app_url}/_bench/lag", params={"reset": True})
+
+      # El reparto de tipos y plataformas se decide de antemano para que la semilla lo reproduzca
+      kinds = random.choices(list(mix), [mix[kind] for kind in mix],
+                             k=args.messages)
+      platforms = [
+        "telegram" if random.random() < args.telegram_share else "twilio"
+        for _ in range(args.messages)
+      ]
+
+      async def send_one(i: int, at: float):
+        await asyncio.sleep(max(0.0, at - time.perf_counter()))
+        kind, platform = kinds[i], platforms[i]
+        if platform == "telegram":
+          chat_id = 10_000_000 + i
+          request = client.post(f"{app_url}/webhook/",
+                                json=_telegram_update(i, chat_id, kind))
+        else:
+          chat_id = f"whatsapp:+1666{i:07d}"
+          request = client.post(f"{app_url}/api",
+                                data=_twilio_form(i, chat_id, kind, fake_url))
+        sent_at = time.perf_counter()
+        try:
+          status = (await request).status_code
+        except httpx.HTTPError:
+          status = None
+        result = {"kind": kind, "platform": platform, "status": status}
+        if status == 200:
+          replied_at = await recorder.wait(chat_id, args.timeout)
+          if replied_at is not None:
+            result["latency"] = replied_at - sent_at
+            result["replied_at"] = replied_at
+        result["sent_at"] = sent_at
+        results.append(result)
+
+      t0 = time.perf_counter()
+      interval = 1 / args.rate if args.rate > 0 else 0
+      await asyncio.gather(*(send_one(i, t0 + i * interval)
+                             for i in range(args.messages)))
+
+      lag = (await client.get(f"{app_url}/_bench/lag")).json()["samples"]
+      app_stats = (await client.get(f"{app_url}/stats")).json()
+      stages = _stage_means((await client.get(f"{app_url}/metrics")).text)
+      peak_rss = _peak_rss_mb(process.pid)
+  finally:
+    if process.returncode is None:
+      process.send_signal(signal.SIGINT)
+      try:
+        await asyncio.wait_for(process.wait(), 10)
+      except asyncio.TimeoutError:
+        process.kill()
+    if log:
+      log.close()
+    fake_server.should_exit = True
+    await fake_task
+
+  return _report(results, lag, peak_rss, startup_seconds, recorder, app_stats,
+                 stages)
+
+
+def _stage_means(metrics_text: str) -> Dict[str, dict]:
+  # Suma y número de observaciones de cada etapa en la salida de /metrics, juntando plataformas y temas
+  totals: Dict[str, List[float]] = {}
+  pattern = re.compile(
+    r'^chatbot_stage_duration_seconds_(sum|count)\{stage="([^"]*)"[^}]*\} (\S+)$')
+  for line in metrics_text.splitlines():
+    match = pattern.match(line)
+    if match:
+      field, stage, value = match.groups()
+      entry = totals.setdefault(stage, [0.0, 0])
+      entry[0 if field == "sum" else 1] += float(value)
+  return {
+    stage: {
+      "count": int(count),
+      "mean": total / count if count else None
+    }
+    for stage, (total, count) in sorted(totals.items())
+  }
+
+
+def _summary(latencies: List[float]) -> dict:
+  return {
+    "p50": _percentile(latencies, 50),
+    "p95": _percentile(latencies, 95),
+    "p99": _percentile(latencies, 99),
+    "max": max(latencies) if latencies else None,
+  }
+
+
+def _report(results: List[dict], lag: List[float], peak_rss: Optional[float],
+            startup_seconds: float, recorder: Recorder,
+            app_stats: dict, stages: Dict[str, dict]) -> dict:
+  replied = [r for r in results if "latency" in r]
+  first_sent = min((r["sent_at"] for r in results), default=0.0)
+  last_reply = max((r["replied_at"] for r in replied), default=first_sent)
+  elapsed = last_reply - first_sent
+  by_kind = {}
+  for kind in sorted({r["kind"] for r in results}):
+    of_kind = [r for r in results if r["kind"] == kind]
+    by_kind[kind] = {
+      "sent": len(of_kind),
+      "replied": sum(1 for r in of_kind if "latency" in r),
+      **_summary([r["latency"] for r in of_kind if "latency" in r]),
+    }
+  return {
+    "messages": len(results),
+    "accepted": sum(1 for r in results if r["status"] == 200),
+    "rejected": sum(1 for r in results if r["status"] == 503),
+    "errors": sum(1 for r in results if r["status"] not in (200, 503)),
+    "replied": len(replied),
+    "elapsed_seconds": elapsed,
+    "messages_per_second": len(replied) / elapsed if elapsed > 0 else 0.0,
+    "latency_seconds": _summary([r["latency"] for r in replied]),
+    "latency_by_kind": by_kind,
+    "loop_lag_seconds": _summary(lag),
+    "peak_rss_mb": peak_rss,
+    "startup_seconds": startup_seconds,
+    "upstream_requests": dict(recorder.requests),
+    "stage_seconds": stages,
+    "app_stats": app_stats,
+  }
+
+
+def _print_report(report: dict):
+
+  def ms(value):
+    return "-" if value is None else f"{value * 1000:.1f} ms"
+
+  print(f"Mensajes: {report['messages']} enviados, {report['accepted']} "
+        f"aceptados, {report['rejected']} rechazados (503), "
+        f"{report['errors']} errores, {report['replied']} respondidos")
+  print(f"Arranque: {report['startup_seconds']:.2f} s")
+  print(f"Rendimiento: {report['messages_per_second']:.1f} mensajes/s "
+        f"en {report['elapsed_seconds']:.1f} s")
+  latency = report["latency_seconds"]
+  print(f"Latencia: p50 {ms(latency['p50'])}, p95 {ms(latency['p95'])}, "
+        f"p99 {ms(latency['p99'])}, máx {ms(latency['max'])}")
+  for kind, stats in report["latency_by_kind"].items():
+    print(f"  {kind}: {stats['replied']}/{stats['sent']} respondidos, "
+          f"p50 {ms(stats['p50'])}, p95 {ms(stats['p95'])}, "
+          f"p99 {ms(stats['p99'])}")
+  lag = report["loop_lag_seconds"]
+  print(f"Retraso del bucle de eventos: p50 {ms(lag['p50'])}, "
+        f"p99 {ms(lag['p99'])}, máx {ms(lag['max'])}")
+  if report["peak_rss_mb"] is not None:
+    print(f"Memoria residente máxima: {report['peak_rss_mb']:.1f} MB")
+  print("Peticiones a los servicios falsos: " + ", ".join(
+    f"{name}={count}"
+    for name, count in sorted(report["upstream_requests"].items())))
+  if report["stage_seconds"]:
+    print("Duración media por etapa: " + ", ".join(
+      f"{stage} {ms(stats['mean'])} ({stats['count']})"
+      for stage, stats in report["stage_seconds"].items()))
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="Benchmark de extremo a extremo con servicios falsos")
+  parser.add_argument("--messages",
+                      type=int,
+                      default=200,
+                      help="mensajes a enviar")
+  parser.add_argument("--rate",
+                      type=float,
+                      default=20,
+                      help="mensajes por segundo (0: todos a la vez)")
+  parser.add_argument("--mix",
+                      default="text=8,voice=2,task=0",
+                      help="proporción de text, voice y task")
+  parser.add_argument("--telegram-share",
+                      type=float,
+                      default=0.5,
+                      help="fracción de mensajes por Telegram (el resto, WhatsApp)")
+  parser.add_argument("--openai",
+                      default="0.5:0.15:0",
+                      help="latencia:jitter:errores de OpenAI")
+  parser.add_argument("--telegram",
+                      default="0.05:0.01:0",
+                      help="latencia:jitter:errores de Telegram")
+  parser.add_argument("--twilio",
+                      default="0.1:0.03:0",
+                      help="latencia:jitter:errores de Twilio")
+  parser.add_argument("--reply-words",
+                      type=int,
+                      default=60,
+                      help="palabras de cada respuesta de chat")
+  parser.add_argument("--timeout",
+                      type=float,
+                      default=120,
+                      help="segundos máximos de espera de cada respuesta")
+  parser.add_argument("--startup-timeout", type=float, default=120)
+  parser.add_argument("--env",
+                      action="append",
+                      default=[],
+                      help="variable de entorno extra para la aplicación, CLAVE=VALOR")
+  parser.add_argument("--app-log", help="archivo donde guardar la salida de la aplicación")
+  parser.add_argument("--json", help="archivo donde guardar el informe en JSON")
+  parser.add_argument("--seed", type=int, default=0)
+  args = parser.parse_args()
+
+  random.seed(args.seed)
+  report = asyncio.run(run(args))
+  _print_report(report)
+  if args.json:
+    with open(args.json, "w") as f:
+      json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+  main()
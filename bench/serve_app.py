@@ -0,0 +1,54 @@
+import argparse
+import asyncio
+import os
+import sys
+from collections import deque
+
+# Arranca la aplicación real con una sonda que mide el retraso del bucle de eventos.
+# run_bench.py la lanza como proceso aparte, con las variables de entorno que apuntan a los servidores falsos.
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                       "app")
+sys.path.insert(0, APP_DIR)
+
+import uvicorn
+from main import app
+
+# Intervalo de la sonda, en segundos
+PROBE_INTERVAL = 0.01
+
+_lags: deque = deque(maxlen=200000)
+# Tarea de la sonda; se guarda para que el recolector no la cancele
+_probe_task = None
+
+
+async def _probe_loop_lag():
+  # Cuánto se retrasa un sleep corto respecto a lo pedido: el tiempo que el bucle estuvo ocupado
+  loop = asyncio.get_running_loop()
+  while True:
+    started = loop.time()
+    await asyncio.sleep(PROBE_INTERVAL)
+    _lags.append(loop.time() - started - PROBE_INTERVAL)
+
+
+async def _start_probe():
+  global _probe_task
+  _probe_task = asyncio.create_task(_probe_loop_lag())
+
+
+app.router.add_event_handler("startup", _start_probe)
+
+
+@app.get("/_bench/lag")
+async def loop_lag(reset: bool = False):
+  samples = list(_lags)
+  if reset:
+    _lags.clear()
+  return {"samples": samples}
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--port", type=int, required=True)
+  args = parser.parse_args()
+  uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")